@@ -0,0 +1,228 @@
+# admission.py
+"""
+In-process admission control in front of the single SQLite writer.
+
+AdmissionMiddleware is a pure ASGI middleware that only looks at write
+requests (anything but GET/HEAD/OPTIONS). It applies two checks:
+
+  rate limit   a token bucket per route in RATE_LIMITS and per subject. The
+               subject is the route's first path parameter (user_id,
+               session_id) or else the client address. Over the limit the
+               request gets 429 with Retry-After set to when a token is due.
+  write gate   at most ADMISSION_MAX_WRITES write requests in flight, and at
+               most ADMISSION_MAX_QUEUE more waiting for up to
+               ADMISSION_QUEUE_TIMEOUT seconds. A request that finds the
+               queue full, or waits too long, gets 503 with Retry-After.
+
+Both checks run before the body is read, so a shed request costs no DB work.
+The state is per process: with N workers a subject gets up to N times its
+limit, and up to N * ADMISSION_MAX_WRITES writes can be in flight.
+SingleFlight shares one run of a coroutine between concurrent callers
+(main.py uses it for /refresh_blocks). ADMISSION_ENABLED=0 leaves the
+middleware out.
+"""
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Dict, Optional, Tuple
+
+from starlette.routing import Match
+
+import metrics
+from serialization import dumps
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "1").lower() not in ("0", "false", "no")
+ADMISSION_MAX_WRITES = int(os.getenv("ADMISSION_MAX_WRITES", "4"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "64"))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "2"))
+RATE_LIMIT_BUCKETS = int(os.getenv("RATE_LIMIT_BUCKETS", "100000"))  # least recently used are dropped
+
+READ_METHODS = frozenset(("GET", "HEAD", "OPTIONS"))
+
+# (method, route template) -> (tokens per second, burst) for each subject
+RATE_LIMITS: Dict[Tuple[str, str], Tuple[float, int]] = {
+    ("POST", "/auth/google"): (5, 20),
+    ("POST", "/users"): (5, 20),
+    ("POST", "/users/{user_id}/schedules"): (1, 10),
+    ("DELETE", "/users/{user_id}/schedules/{schedule_id}"): (1, 10),
+    ("POST", "/users/{user_id}/sessions"): (1, 10),
+    ("POST", "/sessions/{session_id}/pause"): (2, 10),
+    ("POST", "/sessions/{session_id}/resume"): (2, 10),
+    ("POST", "/sessions/{session_id}/stop"): (2, 10),
+    ("POST", "/users/{user_id}/blocks"): (2, 10),
+    ("POST", "/batch"): (2, 10),
+    ("POST", "/refresh_blocks"): (1, 5),
+}
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, burst: int, now: float):
+        self.tokens, self.updated = float(burst), now
+
+    def take(self, rate: float, burst: int, now: float) -> float:
+        """0 if a token was taken, otherwise the seconds until one is due."""
+        self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / rate
+
+
+class RateLimiter:
+    """Token buckets keyed by (method, route, subject), at most max_buckets of them (LRU)."""
+
+    def __init__(self, limits: Dict[Tuple[str, str], Tuple[float, int]], max_buckets: int = RATE_LIMIT_BUCKETS):
+        self.limits = limits
+        self.max_buckets = max_buckets
+        self._buckets: "OrderedDict[tuple, TokenBucket]" = OrderedDict()
+
+    def take(self, method: str, route: str, subject: str) -> float:
+        limit = self.limits.get((method, route))
+        if limit is None:
+            return 0.0
+        rate, burst = limit
+        now = time.monotonic()
+        key = (method, route, subject)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(burst, now)
+            if len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket.take(rate, burst, now)
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class WriteGate:
+    """
+    A semaphore with a bounded, time-limited wait queue. A slot freed by
+    release() is handed straight to the oldest waiter.
+    """
+
+    def __init__(self, limit: int, queue: int, timeout: float):
+        self.limit, self.queue, self.timeout = limit, queue, timeout
+        self.active = 0
+        self._waiters = deque()
+
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self) -> bool:
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return True
+        if len(self._waiters) >= self.queue:
+            return False
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        self._waiters.append(waiter)
+        timer = loop.call_later(self.timeout, self._expire, waiter)
+        try:
+            return await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled() and waiter.result():
+                self.release()  # granted just before the caller went away
+            raise
+        finally:
+            timer.cancel()
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def _expire(self, waiter):
+        if not waiter.done():
+            self._waiters.remove(waiter)
+            waiter.set_result(False)
+
+    def release(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(True)  # the slot passes to it, active is unchanged
+                return
+        self.active -= 1
+
+
+class SingleFlight:
+    """Concurrent run() calls share one execution of fn() and its result (or exception)."""
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+
+    async def run(self, fn):
+        if self._task is None:
+            self._task = asyncio.ensure_future(fn())
+            self._task.add_done_callback(self._done)
+        # shielded: a caller that goes away does not cancel the run the others wait on
+        return await asyncio.shield(self._task)
+
+    def _done(self, task):
+        if self._task is task:
+            self._task = None
+        if not task.cancelled():
+            task.exception()  # retrieved here, even if every caller went away
+
+
+async def _reject(scope, send, route, status: int, retry_after: float, detail: str):
+    if route is not None:
+        scope["route"] = route  # for MetricsMiddleware's route label
+    body = dumps({"detail": detail})
+    await send({"type": "http.response.start", "status": status, "headers": [
+        (b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+        (b"retry-after", str(max(1, math.ceil(retry_after))).encode())]})
+    await send({"type": "http.response.body", "body": body})
+
+
+rate_limiter = RateLimiter(RATE_LIMITS)
+write_gate = WriteGate(ADMISSION_MAX_WRITES, ADMISSION_MAX_QUEUE, ADMISSION_QUEUE_TIMEOUT)
+
+
+class AdmissionMiddleware:
+    """
+    Pure ASGI middleware; add it before CORSMiddleware so that rejections still
+    carry CORS headers. `routes` is the app's route list, matched lazily so
+    routes declared after the middleware count too.
+    """
+
+    def __init__(self, app, routes, limiter: RateLimiter = rate_limiter, gate: WriteGate = write_gate):
+        self.app = app
+        self.routes = routes
+        self.limiter, self.gate = limiter, gate
+
+    def _match(self, scope):
+        for route in self.routes:
+            match, child = route.matches(scope)
+            if match == Match.FULL:
+                return route, child.get("path_params", {})
+        return None, {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] in READ_METHODS:
+            return await self.app(scope, receive, send)
+        method = scope["method"]
+        route, params = self._match(scope)
+        label = getattr(route, "path", None) or "unmatched"
+
+        if params:
+            subject = f"{next(iter(params))}:{next(iter(params.values()))}"
+        else:
+            subject = scope["client"][0] if scope.get("client") else "-"
+        wait = self.limiter.take(method, label, subject)
+        if wait:
+            metrics.ADMISSION_REJECTED.inc("rate_limited", method, label)
+            return await _reject(scope, send, route, 429, wait, "Too many requests")
+
+        if not await self.gate.acquire():
+            metrics.ADMISSION_REJECTED.inc("overloaded", method, label)
+            return await _reject(scope, send, route, 503, 1, "Server busy, retry later")
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.gate.release()
@@ -0,0 +1,210 @@
+# archive.py
+"""
+Retention for rows nothing reads any more: expired blocks (is_active = 0) and
+finished/stopped sessions whose end_time is older than the retention window
+are moved out of the main database into an archive SQLite file, attached to
+a dedicated connection as "archive", then the freed pages are returned to
+the filesystem with incremental VACUUM.
+
+Each batch of ARCHIVE_BATCH rows is copied (INSERT OR REPLACE, committed)
+and then deleted from the main database (re-checking the retention
+predicate, committed), so a crash in between leaves at most a duplicate
+copy, the main database's write lock is only ever held for one batch-sized
+DELETE, and concurrent runs are harmless.
+"""
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import (create_engine, event, select, insert, delete, literal, Table, Column, MetaData,
+                        Integer, String, DateTime, Index)
+from sqlalchemy.engine import make_url
+
+import database
+import metrics
+import models
+
+logger = logging.getLogger("focusbubble.archive")
+
+ARCHIVE_RETENTION_DAYS = float(os.getenv("ARCHIVE_RETENTION_DAYS", "30"))
+ARCHIVE_INTERVAL_SECONDS = int(os.getenv("ARCHIVE_INTERVAL_SECONDS", "3600"))  # 0 disables the job
+ARCHIVE_BATCH = int(os.getenv("ARCHIVE_BATCH", "500"))
+ARCHIVE_PAUSE_SECONDS = float(os.getenv("ARCHIVE_PAUSE_MS", "50")) / 1000  # between batches, for other writers
+ARCHIVE_VACUUM_PAGES = int(os.getenv("ARCHIVE_VACUUM_PAGES", "1000"))  # pages freed per incremental_vacuum
+ARCHIVE_DATABASE_PATH = os.getenv("ARCHIVE_DATABASE_PATH")  # default: <main db>.archive.db
+
+metadata = MetaData(schema="archive")
+
+blocked_apps = Table(
+    "blocked_apps", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("user_id", Integer, nullable=False),
+    Column("app_id", Integer, nullable=False),
+    Column("app_name", String, nullable=True),
+    Column("start_time", DateTime, nullable=False),
+    Column("end_time", DateTime, nullable=False),
+    Column("archived_at", DateTime, nullable=False),
+    Index("ix_archive_blocked_apps_user_start", "user_id", "start_time"),
+)
+
+sessions = Table(
+    "sessions", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("user_id", Integer, nullable=False),
+    Column("schedule_id", Integer, nullable=True),
+    Column("start_time", DateTime, nullable=False),
+    Column("end_time", DateTime, nullable=False),
+    Column("status", String, nullable=False),
+    Column("archived_at", DateTime, nullable=False),
+    # what crud.backfill_stats needs to count an archived session like a live one
+    Column("paused_at", DateTime, nullable=True),
+    Column("paused_seconds", Integer, nullable=False, server_default="0"),
+    Column("ended_at", DateTime, nullable=True),
+    Index("ix_archive_sessions_user_start", "user_id", "start_time"),
+)
+
+# The archive file is not under Alembic: create_all() only creates missing
+# tables, so columns added to them later are listed here and added to an
+# older file by upgrade_schema(). Rows archived before then keep the defaults.
+ADDED_COLUMNS = (
+    (sessions, "paused_at"),
+    (sessions, "paused_seconds"),
+    (sessions, "ended_at"),
+)
+
+
+def archive_path(url: str = database.SQLALCHEMY_DATABASE_URL) -> Optional[str]:
+    """ARCHIVE_DATABASE_PATH, or <main db>.archive.db next to the main file; None for in-memory databases."""
+    if ARCHIVE_DATABASE_PATH:
+        return ARCHIVE_DATABASE_PATH
+    path = make_url(url).database
+    if not path or path == ":memory:":
+        return None
+    return os.path.splitext(path)[0] + ".archive.db"
+
+
+def make_engine(url: str = database.SQLALCHEMY_DATABASE_URL, path: str = None):
+    """Engine on the main database with the archive file attached (and created) on every connection."""
+    path = path or archive_path(url)
+    engine = create_engine(url, connect_args={"check_same_thread": False})
+
+    @event.listens_for(engine, "connect")
+    def attach(dbapi_connection, connection_record):
+        if database.DB_PROFILE == "production":
+            database.apply_sqlite_pragmas(dbapi_connection)
+        dbapi_connection.execute("ATTACH DATABASE ? AS archive", (path,))
+
+    metrics.instrument_engine(engine)
+    metadata.create_all(engine)
+    upgrade_schema(engine)
+    return engine
+
+
+def upgrade_schema(engine):
+    """Adds the ADDED_COLUMNS an existing archive file lacks; returns their names."""
+    added = []
+    with engine.begin() as conn:
+        for table, name in ADDED_COLUMNS:
+            present = {r[1] for r in conn.exec_driver_sql(f"PRAGMA archive.table_info({table.name})")}
+            if name in present:
+                continue
+            column = table.c[name]
+            ddl = f"ALTER TABLE archive.{table.name} ADD COLUMN {name} {column.type.compile(engine.dialect)}"
+            if column.server_default is not None:
+                ddl += f" NOT NULL DEFAULT {column.server_default.arg}"
+            conn.exec_driver_sql(ddl)
+            added.append(f"{table.name}.{name}")
+    if added:
+        logger.info(f"Added {', '.join(added)} to the archive database.")
+    return added
+
+
+def _eligible(cutoff: datetime):
+    """(main table, archive table, columns, retention predicate) per archived table."""
+    b, s = models.BlockedApp, models.FocusSession
+    return (
+        (b.__table__, blocked_apps, ("id", "user_id", "app_id", "app_name", "start_time", "end_time"),
+         (b.is_active == False, b.end_time < cutoff)),
+        (s.__table__, sessions, ("id", "user_id", "schedule_id", "start_time", "end_time", "status",
+                                 "paused_at", "paused_seconds", "ended_at"),
+         (s.status.in_(("finished", "stopped")), s.end_time < cutoff)),
+    )
+
+
+def _move_batch(conn, source, target, columns, where, now: datetime, batch: int) -> int:
+    ids = conn.execute(select(source.c.id).where(*where).limit(batch)).scalars().all()
+    if not ids:
+        return 0
+    conn.execute(insert(target).prefix_with("OR REPLACE").from_select(
+        columns + ("archived_at",),
+        select(*(source.c[c] for c in columns), literal(now, DateTime)).where(source.c.id.in_(ids))))
+    conn.commit()
+    # a row that stopped qualifying in between (e.g. re-stopped) stays; its copy is refreshed next run
+    conn.execute(delete(source).where(source.c.id.in_(ids), *where))
+    conn.commit()
+    return len(ids)
+
+
+def incremental_vacuum(conn, pages: int = ARCHIVE_VACUUM_PAGES, pause: float = ARCHIVE_PAUSE_SECONDS) -> Optional[int]:
+    """
+    Returns the main database's free pages to the filesystem, `pages` at a time.
+    Returns the bytes reclaimed, or None when the database is not in
+    auto_vacuum=INCREMENTAL mode (see manage.py enable-incremental-vacuum).
+    """
+    if conn.exec_driver_sql("PRAGMA main.auto_vacuum").scalar() != 2:
+        return None
+    page_size = conn.exec_driver_sql("PRAGMA main.page_size").scalar()
+    before = conn.exec_driver_sql("PRAGMA main.page_count").scalar()
+    while conn.exec_driver_sql("PRAGMA main.freelist_count").scalar():
+        # sqlite3's execute() stops after the first page for this pragma; executescript runs it through
+        conn.connection.dbapi_connection.executescript(f"PRAGMA main.incremental_vacuum({int(pages)});")
+        time.sleep(pause)
+    return (before - conn.exec_driver_sql("PRAGMA main.page_count").scalar()) * page_size
+
+
+def run(engine, retention_days: float = ARCHIVE_RETENTION_DAYS, batch: int = ARCHIVE_BATCH,
+        pause: float = ARCHIVE_PAUSE_SECONDS, vacuum: bool = True) -> dict:
+    """
+    One archival pass over every table; returns {"blocked_apps": rows,
+    "sessions": rows, "reclaimed_bytes": bytes or None}.
+    """
+    start = time.perf_counter()
+    now = datetime.utcnow()
+    cutoff = now - timedelta(days=retention_days)
+    result = {}
+    try:
+        with engine.connect() as conn:
+            for source, target, columns, where in _eligible(cutoff):
+                moved = 0
+                while True:
+                    n = _move_batch(conn, source, target, columns, where, now, batch)
+                    moved += n
+                    if n < batch:
+                        break
+                    time.sleep(pause)
+                result[source.name] = moved
+                if moved:
+                    metrics.ARCHIVE_ROWS.inc(source.name, amount=moved)
+            reclaimed = incremental_vacuum(conn, pause=pause) if vacuum and any(result.values()) else 0
+            result["reclaimed_bytes"] = reclaimed
+            if reclaimed:
+                metrics.ARCHIVE_RECLAIMED_BYTES.inc(amount=reclaimed)
+    finally:
+        metrics.ARCHIVE_RUN_SECONDS.observe(time.perf_counter() - start)
+    if any(result.values()):
+        logger.info(f"Archived {result['blocked_apps']} blocks and {result['sessions']} sessions "
+                    f"ended before {cutoff.isoformat()}, reclaimed {reclaimed or 0} bytes.")
+    if reclaimed is None:
+        logger.warning("auto_vacuum is not INCREMENTAL: archived rows free pages but the file does not "
+                       "shrink; run `python manage.py enable-incremental-vacuum` once.")
+    return result
+
+
+def enable_incremental_vacuum(engine=database.engine):
+    """Switches the main database to auto_vacuum=INCREMENTAL; rewrites the whole file (full VACUUM)."""
+    with engine.connect() as conn:
+        conn.exec_driver_sql("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.exec_driver_sql("VACUUM")
+        return conn.exec_driver_sql("PRAGMA auto_vacuum").scalar()
@@ -1,33 +1,194 @@
 # auth.py
-from google.oauth2 import id_token
-from google.auth.transport import requests as grequests
 from fastapi import HTTPException
+from collections import OrderedDict
+import base64
+import hashlib
+import json
 import logging
+import re
+import threading
+import time
+
+import metrics
 
 logger = logging.getLogger(__name__)
 
 GOOGLE_CLIENT_ID = None  # Optionally set from env or .env
+GOOGLE_CERTS_URL = "https://www.googleapis.com/oauth2/v1/certs"
+GOOGLE_ISSUERS = ("accounts.google.com", "https://accounts.google.com")
+DEFAULT_CERTS_MAX_AGE = 300  # used when the cert response has no Cache-Control max-age
+MIN_FORCED_REFRESH_SECONDS = 60  # unknown key ids refetch at most this often
+TOKEN_CACHE_SIZE = 10000
+
+_MAX_AGE_RE = re.compile(r"max-age=(\d+)")
+
+
+class CertCache:
+    """
+    Google's signing certificates, cached for the Cache-Control max-age of the
+    response. Refresh is single-flight: concurrent callers that find the cache
+    stale wait for the one fetch in progress instead of issuing their own.
+    """
+
+    def __init__(self, url: str = GOOGLE_CERTS_URL):
+        self.url = url
+        self._certs = None
+        self._expires_at = 0.0
+        self._fetched_at = None
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def _fresh(self):
+        return self._certs is not None and time.monotonic() < self._expires_at
+
+    def get(self, request, force: bool = False):
+        if not force and self._fresh():
+            return self._certs
+        seen = self._generation
+        with self._lock:
+            # someone else refreshed while we waited for the lock: share their fetch
+            if (self._generation != seen or not force) and self._fresh():
+                return self._certs
+            # a forged kid must not let callers hammer Google's endpoint
+            if force and self._fresh() and time.monotonic() - self._fetched_at < MIN_FORCED_REFRESH_SECONDS:
+                return self._certs
+            self._certs, max_age = self._fetch(request)
+            self._fetched_at = time.monotonic()
+            self._expires_at = self._fetched_at + max_age
+            self._generation += 1
+            return self._certs
 
-def verify_google_token(id_token_str: str, client_id: str = None):
+    def clear(self):
+        with self._lock:
+            self._certs = None
+            self._expires_at = 0.0
+            self._fetched_at = None
+
+    def _fetch(self, request):
+        response = request(self.url, method="GET")
+        if response.status != 200:
+            raise _google().exceptions.TransportError(f"Could not fetch certificates at {self.url}")
+        certs = json.loads(response.data.decode("utf-8") if isinstance(response.data, bytes) else response.data)
+        headers = {k.lower(): v for k, v in (response.headers or {}).items()}
+        match = _MAX_AGE_RE.search(headers.get("cache-control", ""))
+        max_age = int(match.group(1)) if match else DEFAULT_CERTS_MAX_AGE
+        try:
+            max_age -= int(headers.get("age", 0))
+        except ValueError:
+            pass
+        logger.debug(f"Fetched {len(certs)} Google certs, caching for {max_age}s")
+        return certs, max(max_age, 0)
+
+
+class TokenCache:
+    """
+    Bounded LRU of verified token payloads keyed by sha256(token) + audience.
+    Entries are dropped once the token's exp has passed.
+    """
+
+    def __init__(self, maxsize: int = TOKEN_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(token: str, audience):
+        return hashlib.sha256(token.encode("utf-8")).hexdigest(), audience
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            payload, exp = entry
+            if time.time() >= exp:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return payload
+
+    def put(self, key, payload: dict):
+        exp = payload.get("exp")
+        if not exp:
+            return
+        with self._lock:
+            self._entries[key] = (payload, float(exp))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+cert_cache = CertCache()
+token_cache = TokenCache()
+_request = None
+
+
+def _google():
+    """
+    google.auth with the modules used here, imported on the first sign-in rather
+    than when a worker starts: with requests under its transport it is ~100 ms
+    of import time that most workers never need.
+    """
+    import google.auth.exceptions
+    import google.auth.jwt
+    import google.auth.transport.requests
+    return google.auth
+
+
+def _get_request():
+    # one transport (and its pooled requests.Session) shared by every sign-in
+    global _request
+    if _request is None:
+        _request = _google().transport.requests.Request()
+    return _request
+
+
+def _token_kid(token: str):
+    try:
+        header = token.split(".", 1)[0]
+        return json.loads(base64.urlsafe_b64decode(header + "=" * (-len(header) % 4))).get("kid")
+    except Exception:
+        return None
+
+
+def verify_google_token(id_token_str: str, client_id: str = None, request=None):
     """
     Verifies the Google ID token. Returns payload dict if valid.
+    Verified payloads and Google's certs are cached (see TokenCache/CertCache).
     """
+    start = time.perf_counter()
     cid = client_id or GOOGLE_CLIENT_ID
+    key = TokenCache.key(id_token_str, cid)
+    info = token_cache.get(key)
+    if info is not None:
+        metrics.AUTH_VERIFY_SECONDS.observe(time.perf_counter() - start, "cached")
+        return info
     try:
-        logger.info(f"🔵 Verifying Google token (length: {len(id_token_str)})")
-        logger.info(f"🔑 Expected client ID: {cid}")
-        
+        google = _google()
+        request = request or _get_request()
+        certs = cert_cache.get(request)
+        kid = _token_kid(id_token_str)
+        if kid and kid not in certs:
+            # Google rotated its keys before our cached copy expired
+            certs = cert_cache.get(request, force=True)
         # If client_id not provided, verification will still validate token but
         # will not check aud (audience). It's recommended to set GOOGLE_CLIENT_ID.
-        request = grequests.Request()
-        info = id_token.verify_oauth2_token(id_token_str, request, audience=cid)
-        
-        logger.info(f"✅ Token verified successfully!")
-        logger.info(f"📧 Email: {info.get('email')}")
-        logger.info(f"👤 Name: {info.get('name')}")
-        
-        # info includes: email, email_verified, name, picture, sub (user id)
-        return info
+        info = google.jwt.decode(id_token_str, certs=certs, audience=cid)
+        if info.get("iss") not in GOOGLE_ISSUERS:
+            raise google.exceptions.GoogleAuthError(f"Wrong issuer. 'iss' should be one of {GOOGLE_ISSUERS} but is {info.get('iss')}")
     except Exception as e:
+        metrics.AUTH_VERIFY_SECONDS.observe(time.perf_counter() - start, "invalid")
         logger.error(f"❌ Token verification failed: {type(e).__name__}: {str(e)}")
         raise HTTPException(status_code=401, detail=f"Invalid Google token: {e}")
+    metrics.AUTH_VERIFY_SECONDS.observe(time.perf_counter() - start, "verified")
+    logger.debug(f"✅ Token verified for {info.get('email')}")
+    # info includes: email, email_verified, name, picture, sub (user id)
+    token_cache.put(key, info)
+    return info
@@ -1,41 +1,229 @@
 # background.py
 import asyncio
 from database import SessionLocal
-from crud import deactivate_expired_blocks, list_active_sessions
+from crud import (deactivate_expired_blocks, finish_expired_sessions, expire_blocks, finish_sessions,
+                  compact_change_log, next_deadline, acquire_lease, release_lease)
+from scheduler import expiry_scheduler, BLOCK, SESSION
+import writer
+import metrics
+import archive
 from datetime import datetime
 import logging
+import os
+import socket
+import time
+import uuid
 
 logger = logging.getLogger("focusbubble.background")
 
-async def expiry_loop(poll_seconds:int = 30):
+EXPIRE_BATCH = 500  # ids per UPDATE ... WHERE id IN (...)
+CHANGE_LOG_RETENTION_SECONDS = int(os.getenv("CHANGE_LOG_RETENTION_HOURS", "72")) * 3600
+EXPIRY_LEASE_SECONDS = int(os.getenv("EXPIRY_LEASE_SECONDS", "30"))
+ARCHIVE_START_DELAY = 60  # seconds after startup before the first archival attempt
+
+def reconcile(db):
+    """
+    Safety net: sweep anything overdue that the scheduler missed (e.g. rows
+    written by another process) and re-seed the deadline heap from the DB.
+    Also compacts the delta-sync change log. Returns (blocks, sessions) ended.
+    """
+    expired_blocks = deactivate_expired_blocks(db)
+    if expired_blocks:
+        logger.info(f"Reconcile expired {expired_blocks} blocks at {datetime.utcnow().isoformat()}")
+    finished = finish_expired_sessions(db)
+    if finished:
+        logger.info(f"Reconcile marked {finished} sessions finished.")
+    expiry_scheduler.seed(db)
+    compacted = compact_change_log(db, CHANGE_LOG_RETENTION_SECONDS)
+    if compacted:
+        logger.info(f"Compacted {compacted} change log entries.")
+    return expired_blocks, finished
+
+def expire_due(db, now: datetime):
+    """
+    Expires exactly the blocks/sessions whose scheduled deadline is <= now.
+    """
+    due = expiry_scheduler.pop_due(now)
+    n_blocks = n_sessions = 0
+    for i in range(0, len(due[BLOCK]), EXPIRE_BATCH):
+        n_blocks += expire_blocks(db, due[BLOCK][i:i + EXPIRE_BATCH], now)
+    for i in range(0, len(due[SESSION]), EXPIRE_BATCH):
+        n_sessions += finish_sessions(db, due[SESSION][i:i + EXPIRE_BATCH], now)
+    if n_blocks:
+        logger.info(f"Expired {n_blocks} blocks at {now.isoformat()}")
+    if n_sessions:
+        logger.info(f"Marked {n_sessions} sessions finished.")
+    return n_blocks, n_sessions
+
+async def run_write(fn, *args):
+    """
+    Runs fn(db, *args) on the group-commit writer when it is running,
+    otherwise on a short-lived SessionLocal.
+    """
+    if writer.group_writer is not None:
+        return await writer.group_writer.run(fn, *args)
+    db = SessionLocal()
+    try:
+        return fn(db, *args)
+    finally:
+        db.close()
+
+def _own_session(fn, *args):
+    db = SessionLocal()
+    try:
+        return fn(db, *args)
+    finally:
+        db.close()
+
+async def run_read(fn, *args):
+    """Runs fn(db, *args) on a short-lived SessionLocal in a worker thread."""
+    return await asyncio.to_thread(_own_session, fn, *args)
+
+async def run_sweep(fn, *args):
+    """
+    Like run_read, for the bulk expiry passes, which commit after every chunk
+    (crud._update_in_chunks). Never on the group writer: inside its batch those
+    commits only flush, so the whole backlog would hold the write lock in one
+    transaction and every queued request would wait behind it.
+    """
+    return await asyncio.to_thread(_own_session, fn, *args)
+
+async def timed_pass(name: str, fn, *args):
+    """run_sweep(fn, *args), recording its duration and the rows it ended in metrics.py."""
+    start = time.perf_counter()
+    try:
+        n_blocks, n_sessions = await run_sweep(fn, *args)
+    finally:
+        metrics.EXPIRY_TICK_SECONDS.observe(time.perf_counter() - start, name)
+    if n_blocks:
+        metrics.EXPIRY_ROWS.inc("block", amount=n_blocks)
+    if n_sessions:
+        metrics.EXPIRY_ROWS.inc("session", amount=n_sessions)
+
+def sweep_overdue(db):
+    """
+    Expires whatever is overdue in the DB. Deadlines set while serving requests
+    on other workers never reach the leader's heap, so the leader runs this
+    every renew_interval, once a read of crud.next_deadline says something is
+    due (the usual nothing-due case takes no write lock).
+    """
+    return deactivate_expired_blocks(db), finish_expired_sessions(db)
+
+
+class LeaderLease:
+    """
+    This process's claim on a lease row (crud.acquire_lease), renewed every
+    ttl/3 seconds. held() turns False locally ttl/3 seconds before the lease
+    can expire in the DB, so a leader that stalls (GC pause, SIGSTOP, lost
+    DB) stops working before another process is able to take over.
+    """
+
+    def __init__(self, name: str, ttl_seconds: int = EXPIRY_LEASE_SECONDS):
+        self.name = name
+        self.ttl = ttl_seconds
+        self.renew_interval = ttl_seconds / 3
+        self._valid_until = 0.0
+        self._new_holder()
+        # a worker forked by serve.py must not share its parent's claim
+        os.register_at_fork(after_in_child=self._new_holder)
+
+    def _new_holder(self):
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._valid_until = 0.0
+
+    def held(self) -> bool:
+        return time.monotonic() < self._valid_until
+
+    async def renew(self) -> bool:
+        start = time.monotonic()
+        if await run_write(acquire_lease, self.name, self.holder, self.ttl):
+            self._valid_until = start + self.ttl - self.renew_interval
+        else:
+            self._valid_until = 0.0
+        return self.held()
+
+    async def release(self):
+        if self._valid_until:
+            self._valid_until = 0.0
+            await run_write(release_lease, self.name, self.holder)
+
+
+expiry_lease = LeaderLease("expiry")
+
+async def expiry_loop(reconcile_seconds: int = 300, lease: LeaderLease = None):
     """
     Background loop to expire sessions and blocks.
-    It runs every poll_seconds and marks expired blocks/sessions.
-    Note: Sessions are not explicitly finished here, but block rows are deactivated.
+    Sleeps until the next deadline held by the expiry scheduler (or until woken
+    by crud.py scheduling an earlier one) and expires only the rows that are due.
+    Every reconcile_seconds it also runs a full DB sweep and re-seeds the heap.
+
+    Every worker runs this loop but only the holder of the "expiry" lease does
+    any of the work; the others only retry the lease every renew_interval, so
+    a dead leader is replaced within EXPIRY_LEASE_SECONDS.
     """
+    lease = lease or expiry_lease
+    expiry_scheduler.bind(asyncio.get_running_loop())
+    expiry_scheduler.set_active(False)
+    leading = False
+    next_renew = next_reconcile = next_poll = 0.0
     while True:
+        if time.monotonic() >= next_renew:
+            next_renew = time.monotonic() + lease.renew_interval
+            try:
+                await lease.renew()
+            except Exception as e:
+                logger.warning(f"Could not renew the {lease.name} lease: {e}")
+        if lease.held() != leading:
+            leading = lease.held()
+            logger.info(f"{lease.holder} {'took' if leading else 'lost'} the {lease.name} lease")
+            expiry_scheduler.set_active(leading)
+            next_reconcile = next_poll = 0.0
         try:
-            db = SessionLocal()
-            expired_blocks = deactivate_expired_blocks(db)
-            if expired_blocks:
-                logger.info(f"Expired {len(expired_blocks)} blocks at {datetime.utcnow().isoformat()}")
-            # Optionally also mark sessions finished if end_time passed
-            # (update status to finished)
-            now = datetime.utcnow()
-            sessions = db.query.__class__  # dummy to avoid lint; below we do session query properly
-            # mark sessions which are running but end_time <= now as finished
-            from models import FocusSession
-            rows = db.query(FocusSession).filter(FocusSession.status == "running", FocusSession.end_time <= now).all()
-            for r in rows:
-                r.status = "finished"
-            if rows:
-                db.commit()
-                logger.info(f"Marked {len(rows)} sessions finished.")
+            if not leading:
+                pass
+            elif time.monotonic() >= next_reconcile:
+                next_reconcile = time.monotonic() + reconcile_seconds
+                next_poll = time.monotonic() + lease.renew_interval
+                await timed_pass("reconcile", reconcile)
+            else:
+                now = datetime.utcnow()
+                deadline = expiry_scheduler.next_deadline()
+                if deadline is not None and deadline <= now:
+                    await timed_pass("due", expire_due, now)
+                if time.monotonic() >= next_poll:
+                    next_poll = time.monotonic() + lease.renew_interval
+                    overdue = await run_read(next_deadline)
+                    if overdue is not None and overdue <= datetime.utcnow():
+                        await timed_pass("overdue", sweep_overdue)
         except Exception as e:
             logger.exception("Background expiry loop error: %s", e)
-        finally:
-            try:
-                db.close()
-            except:
-                pass
-        await asyncio.sleep(poll_seconds)
\ No newline at end of file
+        wake = [next_renew]
+        if leading:
+            wake += [next_reconcile, next_poll]
+        timeout = max(min(wake) - time.monotonic(), 0)
+        deadline = expiry_scheduler.next_deadline()
+        if deadline is not None:
+            timeout = min(timeout, max((deadline - datetime.utcnow()).total_seconds(), 0))
+        await expiry_scheduler.wait(timeout)
+
+
+async def archive_loop(interval_seconds: int = archive.ARCHIVE_INTERVAL_SECONDS):
+    """
+    Runs archive.run about every interval_seconds on one worker. The "archive"
+    lease lives for a whole interval, so the worker that takes it runs the
+    pass and the others skip it until the lease lapses.
+    """
+    if archive.archive_path() is None:
+        logger.info("In-memory database: archival disabled.")
+        return
+    lease = LeaderLease("archive", interval_seconds)
+    engine = None
+    await asyncio.sleep(min(interval_seconds, ARCHIVE_START_DELAY))
+    while True:
+        try:
+            if await lease.renew():
+                engine = engine or archive.make_engine()
+                await asyncio.to_thread(archive.run, engine)
+        except Exception as e:
+            logger.exception("Archival error: %s", e)
+        await asyncio.sleep(interval_seconds)
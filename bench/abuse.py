@@ -0,0 +1,163 @@
+# bench/abuse.py
+"""
+Latency of well-behaved clients next to abusive ones, with and without
+admission.py. Each scenario starts a `uvicorn main:app` child on its own copy
+of a bench.seed database and drives it over HTTP for --duration seconds:
+
+  normal    --clients bench.load virtual users (sign in, schedules, block polls,
+            a session through start / pause / resume / stop), each from its
+            own address (X-Forwarded-For, which uvicorn trusts from 127.0.0.1)
+  abusers   --abusers tasks from one address that ignore Retry-After and loop,
+            in turn, on POST /users/1/blocks (one hot user), POST
+            /refresh_blocks (a full expiry sweep each) and POST
+            /users/{random}/blocks (spread over every user, so only the write
+            gate stops them)
+
+Scenarios: "baseline" (no abusers), "abuse, admission off" and "abuse,
+admission on". Reports the normal clients' p50/p95/p99 and errors, and what
+the abusers got back.
+
+    python -m bench.abuse --clients 20 --abusers 30 --duration 20 --out abuse.json
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from collections import Counter
+
+from bench.load import Recorder, summarize, virtual_user
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ABUSE = ("hot", "refresh", "spread")
+
+
+async def abuser(client, kind: str, users: int, rng: random.Random, statuses: Counter, since, stop):
+    packages = [{"package_name": f"com.abuse{i}"} for i in range(10)]
+    while not stop():
+        if kind == "refresh":
+            url, body = "/refresh_blocks", None
+        else:
+            url, body = f"/users/{1 if kind == 'hot' else rng.randint(1, users)}/blocks", packages
+        try:
+            r = await client.post(url, json=body)
+            status = r.status_code
+        except Exception:
+            status = "error"
+        if time.perf_counter() >= since():
+            statuses[f"{kind} {status}"] += 1
+
+
+async def drive(base_url: str, users: int, clients: int, abusers: int, duration: float, warmup: float, seed: int):
+    import httpx
+
+    rec = Recorder()
+    statuses = Counter()
+    deadline = None
+
+    def stop():
+        return deadline is not None and time.perf_counter() >= deadline
+
+    def client(address: str):
+        return httpx.AsyncClient(base_url=base_url, timeout=60, headers={"X-Forwarded-For": address})
+
+    normal = [client(f"10.0.{i // 256}.{i % 256}") for i in range(clients)]
+    bad = client("192.0.2.66")
+    try:
+        rec.since = time.perf_counter() + warmup
+        deadline = rec.since + duration
+        await asyncio.gather(
+            *(virtual_user(c, rec, random.Random(seed * 100003 + i), users, False, stop)
+              for i, c in enumerate(normal)),
+            *(abuser(bad, ABUSE[i % len(ABUSE)], users, random.Random(seed * 7919 + i), statuses,
+                     lambda: rec.since, stop) for i in range(abusers)))
+        elapsed = time.perf_counter() - rec.since
+    finally:
+        for c in normal + [bad]:
+            await c.aclose()
+    results = summarize(rec, elapsed)
+    results["abusers"] = {k: dict(requests=n, rps=n / elapsed) for k, n in sorted(statuses.items())}
+    return results
+
+
+def _free_port() -> int:
+    import socket
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def scenario(seeded: str, tmpdir: str, admission: bool, args, abusers: int) -> dict:
+    path = os.path.join(tmpdir, "abuse.db")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.unlink(path + suffix)
+    shutil.copyfile(seeded, path)
+    port = _free_port()
+    base = f"http://127.0.0.1:{port}"
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{path}", ADMISSION_ENABLED="1" if admission else "0",
+               ARCHIVE_INTERVAL_SECONDS="0", SLOW_REQUEST_MS="1e9", SLOW_QUERY_MS="1e9")
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(port),
+                             "--log-level", "warning"], env=env, cwd=ROOT,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            try:
+                urllib.request.urlopen(f"{base}/health").read()
+                break
+            except OSError:
+                if proc.poll() is not None:
+                    raise RuntimeError("uvicorn exited early")
+                time.sleep(0.05)
+        results = asyncio.run(drive(base, args.users, args.clients, abusers, args.duration, args.warmup, args.seed))
+        with urllib.request.urlopen(f"{base}/metrics") as r:
+            results["rejected"] = {line.split("{", 1)[1].rsplit("}", 1)[0]: float(line.rsplit(" ", 1)[1])
+                                   for line in r.read().decode().splitlines()
+                                   if line.startswith("admission_rejected_total{")}
+    finally:
+        proc.terminate()
+        proc.wait()
+    return results
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--users", type=int, default=1000)
+    ap.add_argument("--clients", type=int, default=20)
+    ap.add_argument("--abusers", type=int, default=30)
+    ap.add_argument("--duration", type=float, default=20)
+    ap.add_argument("--warmup", type=float, default=2)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", help="write machine-readable results (JSON) here")
+    args = ap.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix="fb-abuse-")
+    seeded = os.path.join(tmpdir, "seeded.db")
+    try:
+        from bench.seed import seed
+        seed(seeded, args.users, args.users * 3, args.users * 10, args.users * 20, seed=args.seed)
+        results = {"baseline": scenario(seeded, tmpdir, True, args, 0),
+                   "abuse, admission off": scenario(seeded, tmpdir, False, args, args.abusers),
+                   "abuse, admission on": scenario(seeded, tmpdir, True, args, args.abusers)}
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    for name, r in results.items():
+        t = r["total"]
+        print(f"{name}: normal clients {t['requests']} requests, {t['errors']} errors, {t['rps']:.1f} req/s, "
+              f"p50 {t['p50_ms']:.1f} / p95 {t['p95_ms']:.1f} / p99 {t['p99_ms']:.1f} ms")
+        for label, a in r["abusers"].items():
+            print(f"    abusers {label:14s} {a['requests']:7d} ({a['rps']:.0f}/s)")
+    if args.out:
+        from bench.common import write_results
+        write_results(args.out, "abuse", vars(args), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+# bench/active_sessions.py
+"""
+GET /users/{id}/sessions/active on a seeded database (bench.seed; a fresh
+one when --db is not given), driven in-process through httpx's ASGI
+transport, with the session registry syncing from the change log (the
+default, multi-worker) and without (SESSION_REGISTRY_SYNC=0). For reference
+it also times crud.list_active_sessions against the filtered SQL query the
+endpoint used before the registry, with --writes session updates from
+"another worker" landing in the change log between reads.
+
+    python -m bench.active_sessions --requests 2000 --out active.json
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import tempfile
+import time
+from collections import defaultdict
+
+
+def sql_active_sessions(db, user_id: int):
+    """The pre-registry list_active_sessions."""
+    import models
+    from datetime import datetime
+
+    return db.query(models.FocusSession).filter(
+        models.FocusSession.user_id == user_id,
+        models.FocusSession.status == "running",
+        models.FocusSession.end_time > datetime.utcnow()
+    ).all()
+
+
+def other_worker_write(path: str, rng: random.Random, sessions: int):
+    """Bumps a random session the way crud.py would, behind this process' registry."""
+    import sqlite3
+
+    sid = rng.randint(1, sessions)
+    with sqlite3.connect(path, timeout=30) as conn:
+        row = conn.execute("UPDATE sessions SET version = version + 1 WHERE id = ? RETURNING user_id",
+                           (sid,)).fetchone()
+        conn.execute("INSERT INTO change_log (user_id, entity, entity_id, op, created_at) "
+                     "VALUES (?, 'session', ?, 'upsert', datetime('now'))", (row[0], sid))
+
+
+async def bench_endpoint(users: int, requests: int, seed: int):
+    import httpx
+    import main
+
+    rng = random.Random(seed)
+    samples = []
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://bench") as c:
+        for _ in range(requests):
+            uid = rng.randint(1, users)
+            start = time.perf_counter()
+            r = await c.get(f"/users/{uid}/sessions/active")
+            samples.append(time.perf_counter() - start)
+            r.raise_for_status()
+    return samples
+
+
+def bench_functions(path: str, users: int, sessions: int, requests: int, writes: int, seed: int):
+    import crud
+    from database import SessionLocal
+
+    rng = random.Random(seed)
+    samples = defaultdict(list)
+    db = SessionLocal()
+    try:
+        for i in range(requests):
+            if writes and i % max(requests // writes, 1) == 0:
+                other_worker_write(path, rng, sessions)
+            uid = rng.randint(1, users)
+            for label, fn in (("sql", sql_active_sessions), ("registry", crud.list_active_sessions)):
+                start = time.perf_counter()
+                rows = fn(db, uid)
+                samples[label].append(time.perf_counter() - start)
+                db.commit()
+                samples[f"{label}.rows"].append(len(rows))
+    finally:
+        db.close()
+    mismatches = sum(a != b for a, b in zip(samples.pop("sql.rows"), samples.pop("registry.rows")))
+    return samples, mismatches
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--db", help="seeded database to copy (bench.seed); default seeds a fresh one")
+    ap.add_argument("--users", type=int, default=10000)
+    ap.add_argument("--schedules", type=int, default=0)
+    ap.add_argument("--sessions", type=int, default=100000)
+    ap.add_argument("--blocks", type=int, default=0)
+    ap.add_argument("--requests", type=int, default=2000)
+    ap.add_argument("--writes", type=int, default=200, help="out-of-process session updates during the function run")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", help="write machine-readable results (JSON) here")
+    args = ap.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix="fb-active-")
+    path = os.path.join(tmpdir, "active.db")
+    if args.db:
+        shutil.copyfile(args.db, path)
+    # must be set before main / database are imported
+    os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    os.environ.setdefault("SLOW_REQUEST_MS", "1e9")
+    os.environ.setdefault("SLOW_QUERY_MS", "1e9")
+    from bench.common import percentiles
+    try:
+        if not args.db:
+            from bench.seed import seed
+            seed(path, args.users, args.schedules, args.sessions, args.blocks, seed=args.seed)
+        import sqlite3
+        with sqlite3.connect(path) as conn:
+            users = conn.execute("SELECT count(*) FROM users").fetchone()[0]
+            sessions = conn.execute("SELECT count(*) FROM sessions").fetchone()[0]
+
+        from database import SessionLocal
+        from registry import session_registry
+
+        db = SessionLocal()
+        start = time.perf_counter()
+        loaded = session_registry.load(db)
+        load_seconds = time.perf_counter() - start
+        db.close()
+        results = {"registry.load": {"seconds": load_seconds, "rows": loaded}}
+
+        for label, sync in (("GET /users/{id}/sessions/active", True),
+                            ("GET /users/{id}/sessions/active (sync off)", False)):
+            session_registry.sync_enabled = sync
+            samples = asyncio.run(bench_endpoint(users, args.requests, args.seed))
+            results[label] = dict(percentiles(samples), requests=len(samples),
+                                  rps=len(samples) / sum(samples), mean_ms=sum(samples) / len(samples) * 1000)
+        session_registry.sync_enabled = True
+
+        samples, mismatches = bench_functions(path, users, sessions, args.requests, args.writes, args.seed)
+        for label, s in samples.items():
+            results[f"list_active_sessions.{label}"] = dict(percentiles(s), calls=len(s),
+                                                            rps=len(s) / sum(s), mean_ms=sum(s) / len(s) * 1000)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    print(f"registry.load: {loaded} live sessions in {load_seconds * 1000:.1f} ms")
+    for name, r in results.items():
+        if "p50_ms" in r:
+            print(f"{name:48s} p50 {r['p50_ms']:7.3f} ms  p95 {r['p95_ms']:7.3f} ms  "
+                  f"p99 {r['p99_ms']:7.3f} ms  {r['rps']:8.0f}/s")
+    print(f"row count mismatches between the SQL query and the registry: {mismatches}")
+    if args.out:
+        from bench.common import write_results
+        write_results(args.out, "active_sessions", vars(args), results)
+    if mismatches:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
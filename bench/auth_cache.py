@@ -0,0 +1,197 @@
+# bench/auth_cache.py
+"""
+Checks auth.CertCache and auth.TokenCache offline, and exits non-zero on a
+failure. Tokens are signed with a locally generated RSA key; the cert endpoint
+is a fake `request` callable serving that key's certificate with Cache-Control
+max-age and Age headers. auth's clock is shifted instead of sleeping.
+
+  single flight   --concurrency concurrent verify_google_token calls with a
+                  cold cache: exactly one cert fetch
+  max-age         the certs are reused until max-age minus Age has passed,
+                  then fetched once more
+  unknown kid     repeated tokens with a kid the cached certs lack: at most one
+                  refetch per MIN_FORCED_REFRESH_SECONDS; a rotated-in key
+                  verifies after that refetch
+  token cache     an entry is dropped once its exp has passed, and the least
+                  recently used entry is evicted at maxsize
+
+    python -m bench.auth_cache --concurrency 20
+"""
+import argparse
+import datetime
+import json
+import logging
+import sys
+import threading
+import time
+
+CLIENT_ID = "bench-client"
+
+
+class Clock:
+    """Stands in for auth's `time` module: real time plus a settable offset."""
+
+    def __init__(self):
+        self.offset = 0.0
+
+    def advance(self, seconds: float):
+        self.offset += seconds
+
+    def monotonic(self):
+        return time.monotonic() + self.offset
+
+    def time(self):
+        return time.time() + self.offset
+
+    def perf_counter(self):
+        return time.perf_counter()
+
+
+class FakeCertEndpoint:
+    """A `request` callable for CertCache: counts fetches, serves `certs`."""
+
+    def __init__(self, certs: dict, max_age: int, age: int = 0, delay: float = 0.2):
+        self.certs, self.max_age, self.age, self.delay = certs, max_age, age, delay
+        self.fetches = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, url, method="GET", **kwargs):
+        with self._lock:
+            self.fetches += 1
+        time.sleep(self.delay)  # long enough for concurrent callers to pile up
+
+        class Response:
+            status = 200
+            headers = {"Cache-Control": f"public, max-age={self.max_age}", "Age": str(self.age)}
+            data = json.dumps(self.certs).encode()
+        return Response()
+
+
+def _key_pair():
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.x509.oid import NameOID
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "bench")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key())
+            .serial_number(1).not_valid_before(now - datetime.timedelta(days=1))
+            .not_valid_after(now + datetime.timedelta(days=1)).sign(key, hashes.SHA256()))
+    private = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                serialization.NoEncryption()).decode()
+    return private, cert.public_bytes(serialization.Encoding.PEM).decode()
+
+
+def run(concurrency: int):
+    from fastapi import HTTPException
+    from google.auth import crypt, jwt
+
+    import auth
+
+    logging.getLogger("auth").setLevel(logging.CRITICAL)  # the rejected tokens below are expected
+    clock = Clock()
+    auth.time = clock
+    private, cert = _key_pair()
+    signers = {kid: crypt.RSASigner.from_string(private, kid) for kid in ("k1", "k2")}
+    serial = iter(range(1 << 30))
+
+    def token(kid="k1"):
+        now = int(time.time())
+        return jwt.encode(signers[kid], {"iss": "accounts.google.com", "aud": CLIENT_ID, "sub": str(next(serial)),
+                                         "iat": now, "exp": now + 3600}).decode()
+
+    def verify(tok, endpoint):
+        try:
+            auth.verify_google_token(tok, CLIENT_ID, request=endpoint)
+            return True
+        except HTTPException:
+            return False
+
+    failures = []
+    results = {}
+
+    def check(name, ok, detail):
+        results[name] = detail
+        if not ok:
+            failures.append(f"{name}: {detail}")
+
+    # single flight: a cold cache and N callers at once
+    endpoint = FakeCertEndpoint({"k1": cert}, max_age=100, age=40)
+    tokens = [token() for _ in range(concurrency)]
+    verified = []
+    threads = [threading.Thread(target=lambda t=t: verified.append(verify(t, endpoint))) for t in tokens]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    check("single flight", endpoint.fetches == 1 and all(verified) and len(verified) == concurrency,
+          f"{sum(verified)}/{concurrency} verified with {endpoint.fetches} fetches")
+
+    # max-age 100 minus Age 40: fresh for 60 s
+    endpoint.delay = 0
+    clock.advance(59)
+    verify(token(), endpoint)
+    before = endpoint.fetches
+    clock.advance(2)
+    verify(token(), endpoint)
+    verify(token(), endpoint)
+    check("max-age", before == 1 and endpoint.fetches == 2,
+          f"{before} fetches at 59 s, {endpoint.fetches} at 61 s (want 1, 2)")
+
+    # unknown kid: k2 is not served yet, then rotated in; certs stay fresh throughout
+    endpoint.max_age, endpoint.age = 10000, 0
+    clock.advance(60)
+    verify(token(), endpoint)
+    clock.advance(auth.MIN_FORCED_REFRESH_SECONDS + 1)
+    before = endpoint.fetches
+    rejected = [verify(token("k2"), endpoint) for _ in range(10)]
+    first = endpoint.fetches - before
+    clock.advance(auth.MIN_FORCED_REFRESH_SECONDS / 2)
+    rejected += [verify(token("k2"), endpoint) for _ in range(10)]
+    within = endpoint.fetches - before
+    endpoint.certs = {"k1": cert, "k2": cert}
+    clock.advance(auth.MIN_FORCED_REFRESH_SECONDS / 2 + 1)
+    rotated = [verify(token("k2"), endpoint) for _ in range(10)]
+    after = endpoint.fetches - before
+    check("unknown kid", first == 1 and within == 1 and after == 2 and not any(rejected) and all(rotated),
+          f"refetches: {first} after 10 unknown kids, {within} within the interval, {after} after it "
+          f"(want 1, 1, 2); rotated key verified {sum(rotated)}/10")
+
+    # token cache, on its own instance
+    cache = auth.TokenCache(maxsize=3)
+    cache.put("a", {"exp": clock.time() + 5})
+    clock.advance(4)
+    alive = cache.get("a") is not None
+    clock.advance(2)
+    expired = cache.get("a") is None and len(cache) == 0
+    check("token exp", alive and expired, f"kept before exp: {alive}, dropped after: {expired}")
+    for k in "abc":
+        cache.put(k, {"exp": clock.time() + 3600})
+    cache.get("a")
+    cache.put("d", {"exp": clock.time() + 3600})
+    kept = sorted(k for k in "abcd" if cache.get(k) is not None)
+    check("token lru", kept == ["a", "c", "d"] and len(cache) == 3, f"kept {kept} (want a, c, d)")
+    return results, failures
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--concurrency", type=int, default=20)
+    ap.add_argument("--out", help="write machine-readable results (JSON) here")
+    args = ap.parse_args()
+
+    results, failures = run(args.concurrency)
+    for name, detail in results.items():
+        print(f"{name:14s} {detail}")
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    if args.out:
+        from bench.common import write_results
+        write_results(args.out, "auth_cache", vars(args), results)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+# bench/bulk_update.py
+"""
+Old (load ORM rows, flip flags in Python) vs new (set-based UPDATE ... RETURNING)
+expiry and stop paths.
+
+    python -m bench.bulk_update --rows 1000000
+"""
+import argparse
+import os
+from datetime import datetime
+
+import crud
+import models
+from bench.common import temp_engine, seed_blocks, timed
+
+
+def legacy_deactivate_expired_blocks(db):
+    now = datetime.utcnow()
+    expired = db.query(models.BlockedApp).filter(models.BlockedApp.is_active == True, models.BlockedApp.end_time <= now).all()
+    for e in expired:
+        e.is_active = False
+    db.commit()
+    return len(expired)
+
+
+def legacy_stop_blocks(db, user_id):
+    now = datetime.utcnow()
+    blocks = db.query(models.BlockedApp).filter(models.BlockedApp.user_id == user_id, models.BlockedApp.is_active == True).all()
+    for b in blocks:
+        b.is_active = False
+        b.end_time = now
+    db.commit()
+    return len(blocks)
+
+
+def run(rows: int, users: int):
+    results = {}
+    for label, expire, stop in (
+        ("old", legacy_deactivate_expired_blocks, legacy_stop_blocks),
+        ("new", crud.deactivate_expired_blocks, crud.deactivate_blocks_for_user),
+    ):
+        engine, SessionLocal, path = temp_engine()
+        try:
+            seed_blocks(engine, rows, users)
+            db = SessionLocal()
+            with timed(results, f"{label}.expire"):
+                n = expire(db)
+            results[f"{label}.expired_rows"] = n
+            with timed(results, f"{label}.stop_user"):
+                stop(db, 1)
+            db.close()
+        finally:
+            engine.dispose()
+            os.unlink(path)
+    return results
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--rows", type=int, default=1_000_000)
+    ap.add_argument("--users", type=int, default=1000)
+    args = ap.parse_args()
+    for k, v in run(args.rows, args.users).items():
+        print(f"{k:20s} {v:.3f}" if isinstance(v, float) else f"{k:20s} {v}")
+
+
+if __name__ == "__main__":
+    main()
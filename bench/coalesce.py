@@ -0,0 +1,69 @@
+# bench/coalesce.py
+"""
+Row growth and read latency of the old append-a-row-per-session block path vs
+upsert_blocks(), which merges overlapping windows of a package into one row.
+
+    python -m bench.coalesce --users 200 --sessions 50 --apps 20
+"""
+import argparse
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+
+import crud
+import models
+from bench.common import temp_engine, timed
+
+
+def legacy_block(db, user_id, packages, start, end):
+    app_ids = crud.intern_apps(db, packages)
+    db.execute(insert(models.BlockedApp), [
+        {"user_id": user_id, "app_id": app_ids[p], "start_time": start, "end_time": end, "is_active": True}
+        for p in packages])
+    db.commit()
+
+
+def new_block(db, user_id, packages, start, end):
+    crud.upsert_blocks(db, user_id, [(p, None, start, end) for p in packages])
+
+
+def run(users: int, sessions: int, apps: int):
+    results = {}
+    packages = [f"com.app{i}" for i in range(apps)]
+    for label, block in (("old", legacy_block), ("new", new_block)):
+        engine, SessionLocal, path = temp_engine()
+        try:
+            with engine.begin() as conn:
+                conn.execute(insert(models.User), [{"id": u + 1, "email": f"user{u}@bench"} for u in range(users)])
+            db = SessionLocal()
+            # sessions start a minute apart and last an hour: every window overlaps the next
+            base = datetime.utcnow() - timedelta(minutes=sessions)
+            with timed(results, f"{label}.write"):
+                for s in range(sessions):
+                    start = base + timedelta(minutes=s)
+                    for u in range(users):
+                        block(db, u + 1, packages, start, start + timedelta(hours=1))
+            results[f"{label}.rows"] = db.query(models.BlockedApp).count()
+            with timed(results, f"{label}.list_all_users"):
+                for u in range(users):
+                    crud.list_active_blocked_apps(db, u + 1)
+            db.close()
+        finally:
+            engine.dispose()
+            os.unlink(path)
+    return results
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--users", type=int, default=200)
+    ap.add_argument("--sessions", type=int, default=50)
+    ap.add_argument("--apps", type=int, default=20)
+    args = ap.parse_args()
+    for k, v in run(args.users, args.sessions, args.apps).items():
+        print(f"{k:20s} {v:.3f}" if isinstance(v, float) else f"{k:20s} {v}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+# bench/cold_start.py
+"""
+Worker cold start, each sample in a fresh interpreter on an already migrated
+throwaway database:
+
+  import main           `import main` timed inside the child (python -X
+                        importtime shows where it goes)
+  first request         spawn `uvicorn main:app` until GET /health answers:
+                        interpreter start, imports, startup hooks, first request
+  first request (serve.py)
+                        the same through serve.py with one worker
+  worker restart (serve.py)
+                        SIGKILL serve.py's worker until GET /health answers
+                        again from the one it forks in its place: what a
+                        worker (re)start costs once the parent has the imports
+
+--app-dir points the children at another checkout, so two commits can be
+compared with bench.compare:
+
+    git worktree add /tmp/fb-base <commit>
+    python -m bench.cold_start --app-dir /tmp/fb-base --out base.json
+    python -m bench.cold_start --out head.json
+    python -m bench.compare base.json head.json
+"""
+import argparse
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_MAIN = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+
+
+def _env(app_dir: str, path: str) -> dict:
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{path}", PYTHONPATH=app_dir,
+               ARCHIVE_INTERVAL_SECONDS="0", SLOW_REQUEST_MS="1e9", SLOW_QUERY_MS="1e9")
+    env.pop("MIGRATE_ON_STARTUP", None)
+    return env
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def import_main(env: dict, app_dir: str) -> float:
+    out = subprocess.run([sys.executable, "-c", IMPORT_MAIN], env=env, cwd=app_dir,
+                         check=True, capture_output=True, text=True).stdout
+    return float(out.strip().splitlines()[-1])
+
+
+def _wait_health(proc, url: str, start: float, timeout: float) -> float:
+    while True:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as r:
+                if r.status == 200:
+                    return time.perf_counter() - start
+        except OSError:
+            pass
+        if proc.poll() is not None:
+            raise RuntimeError(f"server exited early ({proc.returncode})")
+        if time.perf_counter() - start > timeout:
+            raise RuntimeError(f"no answer on {url} after {timeout}s")
+        time.sleep(0.005)
+
+
+def first_request(env: dict, app_dir: str, timeout: float = 60) -> float:
+    port = _free_port()
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(port),
+                             "--log-level", "warning"], env=env, cwd=app_dir,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        return _wait_health(proc, f"http://127.0.0.1:{port}/health", start, timeout)
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def _workers(log: str):
+    with open(log) as f:
+        return [int(line.split("Started worker ")[1].rstrip(".\n")) for line in f if "Started worker " in line]
+
+
+def serve_py(env: dict, app_dir: str, log: str, timeout: float = 60):
+    """(first request, worker restart) seconds for serve.py with one worker."""
+    port = _free_port()
+    url = f"http://127.0.0.1:{port}/health"
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "serve.py", "--port", str(port), "--workers", "1",
+                             "--log-level", "warning"], env=env, cwd=app_dir,
+                            stdout=subprocess.DEVNULL, stderr=open(log, "w"))
+    try:
+        first = _wait_health(proc, url, start, timeout)
+        worker = _workers(log)[-1]
+        time.sleep(1.5)  # past serve.py's RESPAWN_DELAY_SECONDS: a crash loop is not what is measured
+        start = time.perf_counter()
+        os.kill(worker, signal.SIGKILL)
+        restart = _wait_health(proc, url, start, timeout)
+        assert _workers(log)[-1] != worker, "answered by the killed worker"
+        return first, restart
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--runs", type=int, default=10)
+    ap.add_argument("--app-dir", default=ROOT, help="checkout to start (default: this one)")
+    ap.add_argument("--out", help="write machine-readable results (JSON) here")
+    args = ap.parse_args()
+    app_dir = os.path.abspath(args.app_dir)
+
+    tmpdir = tempfile.mkdtemp(prefix="fb-cold-")
+    path = os.path.join(tmpdir, "cold.db")
+    env = _env(app_dir, path)
+    from bench.common import percentiles
+    try:
+        # migrated once up front, the way a deploy does it
+        subprocess.run([sys.executable, "migrate.py"], env=env, cwd=app_dir, check=True)
+        samples = {"import main": [], "first request": []}
+        prefork = os.path.exists(os.path.join(app_dir, "serve.py"))
+        if prefork:
+            samples.update({"first request (serve.py)": [], "worker restart (serve.py)": []})
+        for _ in range(args.runs):
+            samples["import main"].append(import_main(env, app_dir))
+            samples["first request"].append(first_request(env, app_dir))
+            if prefork:
+                first, restart = serve_py(env, app_dir, os.path.join(tmpdir, "serve.log"))
+                samples["first request (serve.py)"].append(first)
+                samples["worker restart (serve.py)"].append(restart)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    results = {name: dict(percentiles(s), runs=len(s), mean_ms=sum(s) / len(s) * 1000, min_seconds=min(s))
+               for name, s in samples.items()}
+    print(f"{app_dir}: {args.runs} cold starts")
+    for name, r in results.items():
+        print(f"{name:26s} min {r['min_seconds'] * 1000:7.1f} ms  p50 {r['p50_ms']:7.1f} ms  "
+              f"p95 {r['p95_ms']:7.1f} ms")
+    if args.out:
+        from bench.common import write_results
+        write_results(args.out, "cold_start", vars(args), results)
+
+
+if __name__ == "__main__":
+    main()
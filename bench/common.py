@@ -0,0 +1,172 @@
+# bench/common.py
+import json
+import math
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from database import Base
+import models
+
+SEED_CHUNK = 50000
+
+
+def temp_engine(path: str = None):
+    """
+    Engine + sessionmaker on a throwaway SQLite file so benchmarks never touch
+    focusbubble.db. Returns (engine, SessionLocal, path).
+    """
+    if path is None:
+        fd, path = tempfile.mkstemp(prefix="fb-bench-", suffix=".db")
+        os.close(fd)
+        os.unlink(path)
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    return engine, sessionmaker(autocommit=False, autoflush=False, bind=engine), path
+
+
+def seed_blocks(engine, rows: int, users: int = 1000, expired_ratio: float = 0.5):
+    """
+    Inserts `users` users and `rows` active BlockedApp rows spread across them;
+    expired_ratio of the rows have an end_time in the past.
+    """
+    now = datetime.utcnow()
+    past, future = now - timedelta(minutes=5), now + timedelta(hours=1)
+    n_expired = int(rows * expired_ratio)
+    with engine.begin() as conn:
+        conn.execute(insert(models.User), [{"id": u + 1, "email": f"user{u}@bench"} for u in range(users)])
+        conn.execute(insert(models.App), [{"id": a + 1, "package_name": f"com.app{a}"}
+                                          for a in range((rows + users - 1) // users)])
+        for start in range(0, rows, SEED_CHUNK):
+            conn.execute(insert(models.BlockedApp), [{
+                "user_id": i % users + 1,
+                "app_id": i // users + 1,  # one active row per (user, app)
+                "start_time": now - timedelta(hours=1),
+                "end_time": past if i < n_expired else future,
+                "is_active": True,
+            } for i in range(start, min(start + SEED_CHUNK, rows))])
+
+
+@contextmanager
+def timed(results: dict, key: str):
+    t0 = time.perf_counter()
+    yield
+    results[key] = time.perf_counter() - t0
+
+
+def _chunked(conn, table, rows):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == SEED_CHUNK:
+            conn.execute(insert(table), chunk)
+            chunk = []
+    if chunk:
+        conn.execute(insert(table), chunk)
+
+
+def seed_dataset(engine, users: int, schedules: int = 0, sessions: int = 0, blocks: int = 0,
+                 apps_per_schedule: int = 10, catalog: int = 1000, running_ratio: float = 0.1,
+                 active_ratio: float = 0.2, expired_ratio: float = 0.1, seed: int = 0):
+    """
+    Deterministic dataset for load tests and micro-benchmarks; schedules,
+    sessions and blocks are totals spread round-robin over the users.
+
+    - schedules block apps_per_schedule apps drawn from a `catalog`-package pool
+    - sessions are finished history, except that each user's last session is
+      running with probability running_ratio
+    - blocks are inactive history, except that rows whose (user, app) pair is
+      still unused are active with probability active_ratio
+    - a share expired_ratio of running sessions and active blocks is already
+      past end_time (work for the expiry sweep)
+    """
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    apps_per_schedule = min(apps_per_schedule, catalog)
+    with engine.begin() as conn:
+        _chunked(conn, models.User.__table__, ({"id": u + 1, "email": f"user{u}@bench"} for u in range(users)))
+        _chunked(conn, models.App.__table__,
+                 ({"id": a + 1, "package_name": f"com.vendor{a}.app"} for a in range(catalog)))
+        _chunked(conn, models.Schedule.__table__, (
+            {"id": i + 1, "user_id": i % users + 1, "label": f"Focus {i // users + 1}", "duration_minutes": 25,
+             "is_active": False, "created_at": now} for i in range(schedules)))
+        _chunked(conn, models.ScheduleApp.__table__, (
+            {"schedule_id": i + 1, "position": j, "app_id": (i * 37 + j) % catalog + 1}
+            for i in range(schedules) for j in range(apps_per_schedule)))
+
+        def session_rows():
+            for i in range(sessions):
+                if i >= sessions - users and rng.random() < running_ratio:
+                    end = now - timedelta(minutes=1) if rng.random() < expired_ratio else now + timedelta(minutes=15)
+                    yield {"user_id": i % users + 1, "start_time": end - timedelta(minutes=25),
+                           "end_time": end, "paused": False, "status": "running"}
+                    continue
+                start = now - timedelta(minutes=30 * (sessions - i) // users + 30)
+                yield {"user_id": i % users + 1, "start_time": start, "end_time": start + timedelta(minutes=25),
+                       "paused": False, "status": "finished"}
+        _chunked(conn, models.FocusSession.__table__, session_rows())
+
+        def block_rows():
+            for i in range(blocks):
+                row = {"user_id": i % users + 1, "app_id": (i // users) % catalog + 1,
+                       "start_time": now - timedelta(hours=2), "end_time": now - timedelta(hours=1),
+                       "is_active": False}
+                if i // users < catalog and rng.random() < active_ratio:
+                    row["is_active"] = True
+                    row["end_time"] = (now - timedelta(minutes=1) if rng.random() < expired_ratio
+                                       else now + timedelta(minutes=rng.randint(1, 120)))
+                yield row
+        _chunked(conn, models.BlockedApp.__table__, block_rows())
+
+
+def percentiles(samples, points=(50, 95, 99)) -> dict:
+    """Nearest-rank percentiles of samples (seconds) as {"p50_ms": ...}."""
+    ordered = sorted(samples)
+    if not ordered:
+        return {f"p{p}_ms": None for p in points}
+    return {f"p{p}_ms": ordered[max(math.ceil(p / 100 * len(ordered)) - 1, 0)] * 1000 for p in points}
+
+
+def _git(*args):
+    try:
+        return subprocess.run(["git", *args], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(path: str, suite: str, params: dict, results: dict):
+    """
+    Writes {"suite", "meta", "results"} as JSON to path, with enough metadata
+    (commit, runtime, DB mode) for bench.compare to line up two runs.
+    """
+    doc = {
+        "suite": suite,
+        "meta": {
+            "commit": _git("rev-parse", "HEAD"),
+            "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+            "created": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "use_async_db": os.getenv("USE_ASYNC_DB", ""),
+            "db_profile": os.getenv("DB_PROFILE", "default"),
+            "params": params,
+        },
+        "results": results,
+    }
+    with open(path, "w") as f:
+        json.dump(doc, f, indent=2, sort_keys=True)
+        f.write("\n")
+    print(f"results written to {path}", file=sys.stderr)
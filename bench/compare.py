@@ -0,0 +1,58 @@
+# bench/compare.py
+"""
+Compares two result files written with --out by bench.load or bench.micro
+(e.g. from two commits) and flags regressions larger than --threshold percent:
+latency and duration fields that grew, throughput that shrank. Exits non-zero
+if any result regressed.
+
+    python -m bench.compare base.json head.json --threshold 10
+"""
+import argparse
+import json
+import sys
+
+LOWER_IS_BETTER = ("p50_ms", "p95_ms", "p99_ms", "mean_ms", "seconds", "min_seconds")
+HIGHER_IS_BETTER = ("rps",)
+
+
+def compare(base: dict, head: dict, threshold: float):
+    """Yields (result, field, base, head, change %, regressed) for every field both runs have."""
+    for name in sorted(set(base["results"]) & set(head["results"])):
+        old, new = base["results"][name], head["results"][name]
+        for field in LOWER_IS_BETTER + HIGHER_IS_BETTER:
+            if old.get(field) is None or new.get(field) is None or not old[field]:
+                continue
+            change = (new[field] / old[field] - 1) * 100
+            worse = change if field in LOWER_IS_BETTER else -change
+            yield name, field, old[field], new[field], change, worse > threshold
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("base")
+    ap.add_argument("head")
+    ap.add_argument("--threshold", type=float, default=10.0, help="percent")
+    args = ap.parse_args()
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.head) as f:
+        head = json.load(f)
+    if base["suite"] != head["suite"]:
+        sys.exit(f"cannot compare a {base['suite']} run with a {head['suite']} run")
+    for label, doc in (("base", base), ("head", head)):
+        meta = doc["meta"]
+        print(f"{label}: {(meta['commit'] or '?')[:10]}{' (dirty)' if meta['dirty'] else ''} "
+              f"{meta['created']}  python {meta['python']}  sqlite {meta['sqlite']}  "
+              f"profile={meta['db_profile']} async={meta['use_async_db'] or '0'}")
+    params = [{k: v for k, v in doc["meta"]["params"].items() if k != "out"} for doc in (base, head)]
+    if params[0] != params[1]:
+        print("warning: runs used different parameters")
+    regressions = 0
+    for name, field, old, new, change, regressed in compare(base, head, args.threshold):
+        regressions += regressed
+        print(f"{name:40s} {field:12s} {old:12.3f} {new:12.3f} {change:+7.1f}%{'  REGRESSION' if regressed else ''}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# bench/concurrency.py
+"""
+Throughput of the sync (threadpool) vs async (aiosqlite) request paths at
+increasing client concurrency, driven in-process through httpx's ASGI transport.
+
+    python -m bench.concurrency --clients 10 100 1000 --requests 5000
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+
+async def _drive(clients: int, total: int, users: int):
+    import httpx
+    import main
+    import migrate
+
+    migrate.upgrade()
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as c:
+        for u in range(users):
+            r = await c.post("/users", json={"email": f"user{u}@bench"})
+            uid = r.json()["id"]
+            await c.post(f"/users/{uid}/blocks", json=[{"package_name": f"com.app{i}"} for i in range(10)])
+        remaining = total
+        errors = 0
+
+        async def client(i):
+            nonlocal remaining, errors
+            while remaining > 0:
+                remaining -= 1
+                uid = (remaining + i) % users + 1
+                r = await c.get(f"/users/{uid}/blocks")
+                if r.status_code != 200:
+                    errors += 1
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(client(i) for i in range(clients)))
+        elapsed = time.perf_counter() - t0
+    return {"requests": total, "errors": errors, "seconds": elapsed, "rps": total / elapsed}
+
+
+def _worker(args):
+    print(json.dumps(asyncio.run(_drive(args.worker_clients, args.requests, args.users))))
+
+
+def run(modes, clients_list, requests: int, users: int):
+    results = []
+    for mode in modes:
+        for clients in clients_list:
+            fd, path = tempfile.mkstemp(prefix="fb-bench-", suffix=".db")
+            os.close(fd)
+            os.unlink(path)
+            # ADMISSION_ENABLED=0: the setup signs up every user from one client address
+            env = dict(os.environ, DATABASE_URL=f"sqlite:///{path}", USE_ASYNC_DB="1" if mode == "async" else "0",
+                       ADMISSION_ENABLED="0")
+            try:
+                out = subprocess.run(
+                    [sys.executable, "-m", "bench.concurrency", "--worker-clients", str(clients),
+                     "--requests", str(requests), "--users", str(users)],
+                    env=env, check=True, capture_output=True, text=True,
+                ).stdout
+            finally:
+                if os.path.exists(path):
+                    os.unlink(path)
+            results.append(dict(json.loads(out.strip().splitlines()[-1]), mode=mode, clients=clients))
+    return results
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--modes", nargs="+", default=["sync", "async"])
+    ap.add_argument("--clients", nargs="+", type=int, default=[10, 100, 1000])
+    ap.add_argument("--requests", type=int, default=5000)
+    ap.add_argument("--users", type=int, default=50)
+    ap.add_argument("--worker-clients", type=int, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    if args.worker_clients:
+        _worker(args)
+        return
+    for r in run(args.modes, args.clients, args.requests, args.users):
+        print(f"{r['mode']:6s} clients={r['clients']:<5d} {r['rps']:8.1f} req/s  errors={r['errors']}")
+
+
+if __name__ == "__main__":
+    main()
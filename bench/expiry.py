@@ -0,0 +1,133 @@
+# bench/expiry.py
+"""
+Checks the deadline-driven expiry loop (scheduler.py, background.expiry_loop)
+in-process against a throwaway database, and exits non-zero on a failure:
+
+  accuracy   --blocks blocks ending 0.5 to --spread seconds from now, all posted
+             through POST /users/{id}/blocks; a separate sqlite3 connection polls
+             every 5 ms for the moment each one turns inactive. No block may
+             expire early, and none more than --max-lag seconds late.
+  idle       once everything has expired, --idle seconds without a single SQL
+             statement from any engine (the loop sleeps on the empty heap)
+
+The lease renewal and the overdue poll still run every EXPIRY_LEASE_SECONDS / 3
+seconds; the lease is set long enough here that neither falls in the idle
+window. USE_ASYNC_DB / DB_PROFILE are taken from the environment.
+
+    python -m bench.expiry --blocks 50 --spread 3 --out expiry.json
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+
+async def _drive(path: str, blocks: int, spread: float, idle: float):
+    import httpx
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    import main
+    import migrate
+
+    migrate.upgrade()
+    statements = []
+
+    def on_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with main.app.router.lifespan_context(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as c:
+            uid = (await c.post("/users", json={"email": "expiry@bench"})).json()["id"]
+            await asyncio.sleep(0.5)  # the startup reconcile pass
+            now = datetime.utcnow()
+            ends = {f"com.expiry{i}": now + timedelta(seconds=0.5 + (spread - 0.5) * i / max(blocks - 1, 1))
+                    for i in range(blocks)}
+            r = await c.post(f"/users/{uid}/blocks", json=[
+                {"package_name": p, "start_time": now.isoformat(), "end_time": end.isoformat()}
+                for p, end in ends.items()])
+            r.raise_for_status()
+            ids = {b["id"]: b["package_name"] for b in r.json()}
+
+        # watched from outside the app's engines, so the polling is not counted below
+        seen = {}
+        watch = sqlite3.connect(path, timeout=30)
+        give_up = time.monotonic() + spread + 10
+        while len(seen) < len(ids) and time.monotonic() < give_up:
+            at = datetime.utcnow()
+            for (block_id,) in watch.execute("SELECT id FROM blocked_apps WHERE is_active = 0"):
+                if block_id in ids and block_id not in seen:
+                    seen[block_id] = at
+            await asyncio.sleep(0.005)
+        watch.close()
+
+        await asyncio.sleep(0.2)  # let the last pass finish its commit hooks
+        event.listen(Engine, "before_cursor_execute", on_execute)
+        try:
+            await asyncio.sleep(idle)
+        finally:
+            event.remove(Engine, "before_cursor_execute", on_execute)
+    lags = [(seen[i] - ends[p]).total_seconds() for i, p in ids.items() if i in seen]
+    return {"blocks": len(ids), "expired": len(seen), "lags": lags, "idle_statements": statements}
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--blocks", type=int, default=50)
+    ap.add_argument("--spread", type=float, default=3, help="last block ends this many seconds from now")
+    ap.add_argument("--idle", type=float, default=5, help="seconds that must pass without a statement")
+    ap.add_argument("--max-lag", type=float, default=1.0, help="seconds a block may expire late")
+    ap.add_argument("--out", help="write machine-readable results (JSON) here")
+    args = ap.parse_args()
+
+    fd, path = tempfile.mkstemp(prefix="fb-bench-", suffix=".db")
+    os.close(fd)
+    os.unlink(path)
+    # must be set before main / database are imported
+    os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    os.environ.setdefault("EXPIRY_LEASE_SECONDS", str(int(max(60, args.spread * 10 + args.idle * 10))))
+    os.environ["ARCHIVE_INTERVAL_SECONDS"] = "0"
+    os.environ.setdefault("SLOW_REQUEST_MS", "1e9")
+    os.environ.setdefault("SLOW_QUERY_MS", "1e9")
+    try:
+        r = asyncio.run(_drive(path, args.blocks, args.spread, args.idle))
+    finally:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.unlink(path + suffix)
+
+    from bench.common import percentiles
+    lags = r["lags"]
+    failures = []
+    if r["expired"] < r["blocks"]:
+        failures.append(f"{r['blocks'] - r['expired']} of {r['blocks']} blocks never expired")
+    if lags and min(lags) < 0:
+        failures.append(f"a block expired {-min(lags) * 1000:.0f} ms early")
+    if lags and max(lags) > args.max_lag:
+        failures.append(f"a block expired {max(lags) * 1000:.0f} ms late (limit {args.max_lag * 1000:.0f} ms)")
+    if r["idle_statements"]:
+        failures.append(f"{len(r['idle_statements'])} statements while idle, first: "
+                        f"{' '.join(r['idle_statements'][0].split())[:120]}")
+
+    results = {"expiry lag": dict(percentiles(lags), blocks=r["blocks"], expired=r["expired"],
+                                  max_ms=max(lags) * 1000 if lags else None),
+               "idle": {"seconds": args.idle, "statements": len(r["idle_statements"])}}
+    lag = results["expiry lag"]
+    print(f"{r['expired']}/{r['blocks']} blocks expired, lag p50 {lag['p50_ms']:.0f} ms  "
+          f"p99 {lag['p99_ms']:.0f} ms  max {lag['max_ms']:.0f} ms")
+    print(f"{len(r['idle_statements'])} statements in {args.idle:g}s idle")
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    if args.out:
+        from bench.common import write_results
+        write_results(args.out, "expiry", vars(args), results)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+# bench/history_export.py
+"""
+Streaming history export on a user with --rows sessions and --rows ended
+blocks. Each export runs against a fresh `uvicorn main:app` child, and its
+peak RSS (VmHWM) is compared with the RSS it had before the export. The
+body is read over a real socket and thrown away as it arrives.
+
+  export {kind} {format}        GET /users/{id}/sessions|blocks/history?format=...
+  materialize {kind} ndjson     for reference, the unbounded way: one .all() of the
+                                whole history then one body (a child process, no HTTP)
+
+    python -m bench.history_export --rows 1000000 --out export.json
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PATHS = {"sessions": "sessions", "blocks": "blocks/history"}
+
+
+def _rss_mb(pid: int, field: str) -> float:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) / 1024
+    raise RuntimeError(f"no {field} for {pid}")
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def export_http(env: dict, kind: str, fmt: str) -> dict:
+    port = _free_port()
+    base = f"http://127.0.0.1:{port}"
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(port),
+                             "--log-level", "warning"], env=env, cwd=ROOT,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            try:
+                urllib.request.urlopen(f"{base}/users/1/{PATHS[kind]}?limit=1").read()
+                break
+            except OSError:
+                if proc.poll() is not None:
+                    raise RuntimeError("uvicorn exited early")
+                time.sleep(0.05)
+        before = _rss_mb(proc.pid, "VmRSS")
+        rows = size = 0
+        start = time.perf_counter()
+        with urllib.request.urlopen(f"{base}/users/1/{PATHS[kind]}?format={fmt}") as r:
+            while True:
+                chunk = r.read(1 << 20)
+                if not chunk:
+                    break
+                size += len(chunk)
+                rows += chunk.count(b"\n")
+        seconds = time.perf_counter() - start
+        peak = _rss_mb(proc.pid, "VmHWM")
+    finally:
+        proc.terminate()
+        proc.wait()
+    rows -= fmt == "csv"  # header
+    return {"rows": rows, "seconds": seconds, "rps": rows / seconds, "mb_per_s": size / 1e6 / seconds,
+            "rss_before_mb": before, "peak_rss_mb": peak, "peak_growth_mb": peak - before}
+
+
+def _materialize(kind: str):
+    """Child: the whole history through one .all(), encoded as one body."""
+    import crud
+    import schemas
+    from database import SessionLocal
+    from serialization import ndjson
+
+    model = schemas.SessionHistoryOut if kind == "sessions" else schemas.BlockedAppOut
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    start = time.perf_counter()
+    db = SessionLocal()
+    try:
+        rows = db.execute(crud.HISTORY[kind].query(1, None, -1)).all()
+        body = ndjson(rows, model)
+    finally:
+        db.close()
+    seconds = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps({"rows": len(rows), "seconds": seconds, "rps": len(rows) / seconds,
+                      "mb_per_s": len(body) / 1e6 / seconds, "rss_before_mb": before,
+                      "peak_rss_mb": peak, "peak_growth_mb": peak - before}))
+
+
+def materialize(env: dict, kind: str) -> dict:
+    out = subprocess.run([sys.executable, "-m", "bench.history_export", "--materialize", kind],
+                         env=env, cwd=ROOT, check=True, capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def seed_history(path: str, rows: int):
+    """One user with `rows` sessions and `rows` blocks, nearly all ended."""
+    from bench.seed import seed
+
+    seed(path, users=1, schedules=0, sessions=rows, blocks=rows)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--rows", type=int, default=1000000)
+    ap.add_argument("--db", help="database seeded by an earlier run (user 1's history); default seeds one")
+    ap.add_argument("--no-materialize", action="store_true", help="skip the .all() reference runs")
+    ap.add_argument("--materialize", help=argparse.SUPPRESS)
+    ap.add_argument("--out", help="write machine-readable results (JSON) here")
+    args = ap.parse_args()
+    if args.materialize:
+        return _materialize(args.materialize)
+
+    tmpdir = tempfile.mkdtemp(prefix="fb-export-")
+    path = args.db or os.path.join(tmpdir, "export.db")
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{path}", ARCHIVE_INTERVAL_SECONDS="0",
+               SLOW_REQUEST_MS="1e9", SLOW_QUERY_MS="1e9")
+    results = {}
+    try:
+        if not args.db:
+            os.environ["DATABASE_URL"] = env["DATABASE_URL"]
+            start = time.perf_counter()
+            seed_history(path, args.rows)
+            print(f"seeded {args.rows} sessions and blocks in {time.perf_counter() - start:.1f}s")
+        for kind in PATHS:
+            for fmt in ("ndjson", "csv"):
+                results[f"export {kind} {fmt}"] = export_http(env, kind, fmt)
+            if not args.no_materialize:
+                results[f"materialize {kind} ndjson"] = materialize(env, kind)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    for name, r in results.items():
+        print(f"{name:28s} {r['rows']:9d} rows  {r['rps']:9.0f} rows/s  {r['mb_per_s']:6.1f} MB/s  "
+              f"RSS {r['rss_before_mb']:6.1f} -> peak {r['peak_rss_mb']:7.1f} MB (+{r['peak_growth_mb']:.1f})")
+    if args.out:
+        from bench.common import write_results
+        write_results(args.out, "history_export", vars(args), results)
+
+
+if __name__ == "__main__":
+    main()
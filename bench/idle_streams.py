@@ -0,0 +1,64 @@
+# bench/idle_streams.py
+"""
+Memory per idle stream subscriber and fan-out latency of events.EventHub.
+Each connection is modelled the way main.stream_events runs it: one task
+waiting on Subscriber.next() with the heartbeat timeout.
+
+    python -m bench.idle_streams --connections 20000
+"""
+import argparse
+import asyncio
+import time
+import tracemalloc
+
+from events import EventHub
+
+
+async def run(connections: int, users: int):
+    hub = EventHub()
+    hub.bind(asyncio.get_running_loop())
+    received = 0
+    done = asyncio.Event()
+
+    async def connection(user_id):
+        nonlocal received
+        sub = hub.subscribe(user_id)
+        try:
+            while True:
+                item = await sub.next(15)
+                if item is not None:
+                    received += 1
+                    if received == connections:
+                        done.set()
+        finally:
+            hub.unsubscribe(sub)
+
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    tasks = [asyncio.create_task(connection(i % users)) for i in range(connections)]
+    await asyncio.sleep(0.5)
+    per_conn = (tracemalloc.get_traced_memory()[0] - base) / connections
+    tracemalloc.stop()
+
+    t0 = time.perf_counter()
+    hub.publish([(u, "blocks", {"reason": "expired"}) for u in range(users)])
+    await done.wait()
+    fanout = time.perf_counter() - t0
+    for t in tasks:
+        t.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return {"connections": connections, "bytes_per_connection": per_conn, "fanout_seconds": fanout}
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--connections", type=int, default=20000)
+    ap.add_argument("--users", type=int, default=10000)
+    args = ap.parse_args()
+    r = asyncio.run(run(args.connections, args.users))
+    print(f"{r['connections']} idle subscribers: {r['bytes_per_connection']:.0f} B each, "
+          f"fan-out to all in {r['fanout_seconds'] * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+# bench/leader_failover.py
+"""
+Failover check for the expiry lease: starts --workers processes, each running
+background.expiry_loop against one throwaway database with a short
+EXPIRY_LEASE_SECONDS, then repeatedly SIGKILLs, SIGTERMs and SIGSTOPs the
+current leader (restarting / resuming it afterwards) and measures how long
+the others take to pick the lease up. After each takeover it inserts a block
+due in a second straight into the DB, as another worker would, and checks the
+new leader's DB poll expires it within one lease renewal.
+
+Fails (exit 1) if a takeover is slower than the lease allows, if a due block
+is never expired, or if any worker ran an expiry pass while another process
+held the lease (every pass must come from the process that took the lease
+most recently).
+
+    python -m bench.leader_failover --workers 3 --rounds 2 --lease 3
+"""
+import argparse
+import asyncio
+import os
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+SLACK = 1.5  # seconds on top of the theoretical takeover bound
+
+
+def _worker(reconcile_seconds: int):
+    import background
+    from scheduler import expiry_scheduler
+
+    def log(*parts):
+        print(f"{time.time():.6f}", *parts, flush=True)
+
+    timed_pass, set_active = background.timed_pass, expiry_scheduler.set_active
+
+    async def traced_pass(name, fn, *args):
+        log("pass", name)
+        return await timed_pass(name, fn, *args)
+
+    def traced_set_active(active):
+        log("took" if active else "lost")
+        set_active(active)
+
+    background.timed_pass = traced_pass
+    expiry_scheduler.set_active = traced_set_active
+    log("holder", background.expiry_lease.holder)
+
+    async def run():
+        stop = asyncio.Event()
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+        task = asyncio.create_task(background.expiry_loop(reconcile_seconds))
+        await stop.wait()
+        task.cancel()
+        await background.expiry_lease.release()
+        log("released")
+
+    asyncio.run(run())
+
+
+class Cluster:
+    def __init__(self, path: str, logdir: str, lease: int, reconcile: int):
+        self.path, self.logdir = path, logdir
+        self.env = dict(os.environ, DATABASE_URL=f"sqlite:///{path}", EXPIRY_LEASE_SECONDS=str(lease),
+                        METRICS_ENABLED="0")
+        self.env.pop("DB_PROFILE", None)
+        self.env.pop("USE_ASYNC_DB", None)
+        self.reconcile = reconcile
+        self.procs = {}  # holder -> Popen
+        self.logs = []
+        self.db = sqlite3.connect(path, timeout=30, isolation_level=None)
+
+    def start(self):
+        log = os.path.join(self.logdir, f"worker{len(self.logs)}.log")
+        self.logs.append(log)
+        proc = subprocess.Popen([sys.executable, "-m", "bench.leader_failover", "--worker",
+                                 "--reconcile", str(self.reconcile)],
+                                env=self.env, stdout=open(log, "w"), stderr=subprocess.STDOUT)
+        while True:
+            with open(log) as f:
+                for line in f:
+                    if " holder " in line:
+                        holder = line.split()[2]
+                        self.procs[holder] = proc
+                        return holder
+            if proc.poll() is not None:
+                raise RuntimeError(f"worker exited early, see {log}")
+            time.sleep(0.05)
+
+    def leader(self, exclude=None, timeout: float = 60):
+        start = time.monotonic()
+        while time.monotonic() - start < timeout:
+            row = self.db.execute("SELECT holder FROM leases WHERE name = 'expiry' AND "
+                                  "expires_at > strftime('%Y-%m-%d %H:%M:%f', 'now')").fetchone()
+            if row and row[0] != exclude and row[0] in self.procs:
+                return row[0]
+            time.sleep(0.02)
+        raise RuntimeError("no leader elected")
+
+    def insert_due_block(self, app_id: int):
+        # written behind the workers' backs: only the leader's DB poll can find it
+        self.db.execute("INSERT INTO blocked_apps (user_id, app_id, start_time, end_time, is_active) VALUES "
+                        "(1, ?, strftime('%Y-%m-%d %H:%M:%f', 'now', '-1 minutes'), "
+                        "strftime('%Y-%m-%d %H:%M:%f', 'now', '+1 seconds'), 1)", (app_id,))
+
+    def active_blocks(self) -> int:
+        return self.db.execute("SELECT count(*) FROM blocked_apps WHERE is_active = 1").fetchone()[0]
+
+    def events(self):
+        out = []
+        for log in self.logs:
+            holder = None
+            with open(log) as f:
+                for line in f:
+                    parts = line.split()
+                    if len(parts) < 2 or not parts[0].replace(".", "").isdigit():
+                        continue
+                    if parts[1] == "holder":
+                        holder = parts[2]
+                    else:
+                        out.append((float(parts[0]), holder, parts[1]))
+        return sorted(out, key=lambda e: e[0])  # stable: keeps each log's own order on ties
+
+    def stop(self):
+        for proc in self.procs.values():
+            if proc.poll() is None:
+                proc.send_signal(signal.SIGCONT)
+                proc.kill()
+            proc.wait()
+        self.db.close()
+
+
+def check_passes(events):
+    """Every pass must come from the process whose 'took' is the most recent one before it."""
+    current, violations = None, []
+    for t, holder, kind in events:
+        if kind == "took":
+            current = holder
+        elif kind == "pass" and holder != current:
+            violations.append((t, holder, current))
+    return violations
+
+
+def run(workers: int, rounds: int, lease: int, reconcile: int):
+    from bench.seed import seed
+
+    renew = lease / 3
+    bounds = {"SIGKILL": lease + renew + SLACK, "SIGSTOP": lease + renew + SLACK, "SIGTERM": renew + SLACK}
+    tmpdir = tempfile.mkdtemp(prefix="fb-failover-")
+    path = os.path.join(tmpdir, "failover.db")
+    seed(path, users=10, schedules=0, sessions=0, blocks=0)
+    cluster = Cluster(path, tmpdir, lease, reconcile)
+    failures = []
+    takeovers = []
+    app_id = 0
+    try:
+        for _ in range(workers):
+            cluster.start()
+        for r in range(rounds):
+            for sig in ("SIGKILL", "SIGTERM", "SIGSTOP"):
+                old = cluster.leader()
+                t0 = time.monotonic()
+                cluster.procs[old].send_signal(getattr(signal, sig))
+                new = cluster.leader(exclude=old)
+                took = time.monotonic() - t0
+                takeovers.append((r, sig, took))
+                print(f"round {r} {sig:8s} leader {old} -> {new} in {took:.2f}s (bound {bounds[sig]:.2f}s)")
+                if took > bounds[sig]:
+                    failures.append(f"{sig} takeover took {took:.2f}s")
+                app_id += 1
+                cluster.insert_due_block(app_id)
+                t0 = time.monotonic()
+                while cluster.active_blocks() and time.monotonic() - t0 < 1 + renew + SLACK:
+                    time.sleep(0.05)
+                if cluster.active_blocks():
+                    failures.append(f"a block due after the {sig} takeover was not expired in time")
+                if sig == "SIGSTOP":
+                    time.sleep(renew)
+                    cluster.procs[old].send_signal(signal.SIGCONT)
+                else:
+                    cluster.procs[old].wait()
+                    cluster.start()
+        time.sleep(renew + SLACK)  # let resumed (SIGSTOPped) workers notice they lost the lease
+    finally:
+        cluster.stop()
+    events = cluster.events()
+    for t, holder, current in check_passes(events):
+        failures.append(f"{holder} ran an expiry pass at {t:.3f} while {current} held the lease")
+    passes = sum(1 for _, _, kind in events if kind == "pass")
+    print(f"{passes} expiry passes from {len(cluster.logs)} worker processes, "
+          f"{len(takeovers)} takeovers, logs in {tmpdir}")
+    return failures
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--workers", type=int, default=3)
+    ap.add_argument("--rounds", type=int, default=2)
+    ap.add_argument("--lease", type=int, default=3, help="EXPIRY_LEASE_SECONDS for the workers")
+    ap.add_argument("--reconcile", type=int, default=300, help="reconcile interval of each worker's loop")
+    ap.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    if args.worker:
+        _worker(args.reconcile)
+        return
+    failures = run(args.workers, args.rounds, args.lease, args.reconcile)
+    for f in failures:
+        print("FAIL", f)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
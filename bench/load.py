@@ -0,0 +1,201 @@
+# bench/load.py
+"""
+Mixed-traffic load test: closed-loop virtual users sign in, load their
+schedules, poll their blocks (with If-None-Match) and run a session through
+start / pause / resume / stop. Reports throughput and p50/p95/p99 per route.
+
+Runs in-process through httpx's ASGI transport against a seeded copy of
+--db (or a fresh bench.seed database), or with --url against a running server
+(seed its database with bench.seed and pass the same --users). In-process
+sign-ins go through POST /auth/google with tokens pre-loaded into the token
+cache; against --url they use POST /users. USE_ASYNC_DB / DB_PROFILE are
+taken from the environment.
+
+    python -m bench.load --clients 50 --duration 30 --out load.json
+    python -m bench.load --url http://127.0.0.1:8000 --users 100000 --clients 200
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import random
+import shutil
+import tempfile
+import time
+from collections import defaultdict
+
+TOKEN_TTL = 24 * 3600
+
+
+class Recorder:
+    """Latency samples and error counts per route; requests started before `since` are not recorded."""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.since = 0.0
+
+    async def call(self, client, label, method, url, **kw):
+        start = time.perf_counter()
+        record = start >= self.since
+        try:
+            r = await client.request(method, url, **kw)
+        except Exception:
+            self.errors[label] += record
+            return None
+        if record:
+            self.samples[label].append(time.perf_counter() - start)
+        if r.status_code >= 400:
+            self.errors[label] += record
+            return None
+        return r
+
+
+async def virtual_user(client, rec: Recorder, rng: random.Random, users: int, in_process: bool, stop):
+    etags = {}
+    while not stop():
+        uid = rng.randint(1, users)
+        if in_process:
+            await rec.call(client, "POST /auth/google", "POST", "/auth/google", json={"id_token": f"bench-{uid}"})
+        else:
+            await rec.call(client, "POST /users", "POST", "/users", json={"email": f"user{uid - 1}@bench"})
+
+        async def poll():
+            headers = {"If-None-Match": etags[uid]} if uid in etags else {}
+            r = await rec.call(client, "GET /users/{id}/blocks", "GET", f"/users/{uid}/blocks", headers=headers)
+            if r is not None and "etag" in r.headers:
+                etags[uid] = r.headers["etag"]
+
+        r = await rec.call(client, "GET /users/{id}/schedules", "GET", f"/users/{uid}/schedules")
+        schedules = r.json() if r is not None else []
+        for _ in range(rng.randint(1, 4)):
+            await poll()
+        if stop():
+            return
+        body = {"user_id": uid, "schedule_id": rng.choice(schedules)["id"] if schedules else None,
+                "duration_minutes": 25}
+        r = await rec.call(client, "POST /users/{id}/sessions", "POST", f"/users/{uid}/sessions", json=body)
+        if r is None:
+            continue
+        sid = r.json()["id"]
+        await poll()
+        await rec.call(client, "POST /sessions/{id}/pause", "POST", f"/sessions/{sid}/pause")
+        await rec.call(client, "POST /sessions/{id}/resume", "POST", f"/sessions/{sid}/resume")
+        await poll()
+        await rec.call(client, "POST /sessions/{id}/stop", "POST", f"/sessions/{sid}/stop")
+        await poll()
+
+
+async def drive(base_url, users: int, clients: int, duration: float, requests: int, seed: int, warmup: float = 0):
+    import httpx
+
+    in_process = base_url is None
+    if in_process:
+        import auth
+        import main
+
+        transport = httpx.ASGITransport(app=main.app)
+        client = httpx.AsyncClient(transport=transport, base_url="http://bench")
+    else:
+        limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+        client = httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30)
+
+    rec = Recorder()
+    deadline = None
+
+    def stop():
+        if deadline is not None and time.perf_counter() >= deadline:
+            return True
+        return bool(requests) and sum(len(s) for s in rec.samples.values()) >= requests
+
+    async with contextlib.AsyncExitStack() as stack:
+        if in_process:
+            # startup/shutdown handlers: expiry loop, and the group writer under DB_PROFILE=production
+            await stack.enter_async_context(main.app.router.lifespan_context(main.app))
+            # sign-in without Google: every bench token is already "verified" (for the
+            # GOOGLE_CLIENT_ID startup picked up)
+            exp = time.time() + TOKEN_TTL
+            for uid in range(1, users + 1):
+                auth.token_cache.put(auth.TokenCache.key(f"bench-{uid}", auth.GOOGLE_CLIENT_ID),
+                                     {"email": f"user{uid - 1}@bench", "exp": exp})
+        await stack.enter_async_context(client)
+        rec.since = time.perf_counter() + warmup
+        if duration:
+            deadline = rec.since + duration
+        await asyncio.gather(*(virtual_user(client, rec, random.Random(seed * 100003 + i), users, in_process, stop)
+                               for i in range(clients)))
+        elapsed = time.perf_counter() - rec.since
+    return rec, elapsed
+
+
+def summarize(rec: Recorder, elapsed: float) -> dict:
+    from bench.common import percentiles
+
+    results = {}
+    for label in sorted(rec.samples):
+        samples = rec.samples[label]
+        results[label] = dict(percentiles(samples), requests=len(samples), errors=rec.errors[label],
+                              rps=len(samples) / elapsed, mean_ms=sum(samples) / len(samples) * 1000)
+    total = sum(len(s) for s in rec.samples.values())
+    results["total"] = dict(percentiles([x for s in rec.samples.values() for x in s]), requests=total,
+                            errors=sum(rec.errors.values()), rps=total / elapsed, seconds=elapsed)
+    return results
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--url", help="base URL of a running server; default is in-process")
+    ap.add_argument("--db", help="seeded database to copy (bench.seed); default seeds a fresh one")
+    ap.add_argument("--users", type=int, default=1000)
+    ap.add_argument("--schedules", type=int, default=3000)
+    ap.add_argument("--sessions", type=int, default=10000)
+    ap.add_argument("--blocks", type=int, default=20000)
+    ap.add_argument("--clients", type=int, default=50)
+    ap.add_argument("--duration", type=float, default=20, help="seconds; 0 to stop on --requests only")
+    ap.add_argument("--requests", type=int, default=0, help="stop after this many requests (0: no limit)")
+    ap.add_argument("--warmup", type=float, default=2, help="seconds of unrecorded traffic first (startup reconcile, caches)")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", help="write machine-readable results (JSON) here")
+    args = ap.parse_args()
+    if not args.duration and not args.requests:
+        ap.error("one of --duration / --requests is required")
+
+    tmpdir = None
+    if args.url is None:
+        tmpdir = tempfile.mkdtemp(prefix="fb-load-")
+        path = os.path.join(tmpdir, "load.db")
+        if args.db:
+            shutil.copyfile(args.db, path)
+        # must be set before main / database are imported
+        os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+        # the latency histograms are the output here, not per-request log lines
+        os.environ.setdefault("SLOW_REQUEST_MS", "1e9")
+        os.environ.setdefault("SLOW_QUERY_MS", "1e9")
+        # every in-process virtual user shares one client address, so the per-address
+        # sign-in limit would shed them (bench.abuse measures admission.py over HTTP)
+        os.environ.setdefault("ADMISSION_ENABLED", "0")
+        if not args.db:
+            from bench.seed import seed
+            seed(path, args.users, args.schedules, args.sessions, args.blocks, seed=args.seed)
+        import sqlite3
+        with sqlite3.connect(path) as conn:
+            args.users = conn.execute("SELECT count(*) FROM users").fetchone()[0]
+    try:
+        rec, elapsed = asyncio.run(drive(args.url, args.users, args.clients, args.duration, args.requests,
+                                         args.seed, args.warmup))
+    finally:
+        if tmpdir is not None:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+    results = summarize(rec, elapsed)
+    print(f"{'route':32s} {'reqs':>7s} {'err':>5s} {'req/s':>8s} {'p50 ms':>8s} {'p95 ms':>8s} {'p99 ms':>8s}")
+    for label, r in results.items():
+        print(f"{label:32s} {r['requests']:7d} {r['errors']:5d} {r['rps']:8.1f} "
+              f"{r['p50_ms']:8.2f} {r['p95_ms']:8.2f} {r['p99_ms']:8.2f}")
+    if args.out:
+        from bench.common import write_results
+        write_results(args.out, "load", vars(args), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+# bench/metrics_overhead.py
+"""
+Per-request cost of the metrics.py instrumentation: the same request mix is
+driven in-process (httpx ASGI transport) in two child processes, one with
+METRICS_ENABLED=1 and one with METRICS_ENABLED=0, each on a throwaway database. The two are alternated for
+--rounds rounds and the best time per request kept, to keep scheduler noise out.
+The fixed costs are also measured in isolation: MetricsMiddleware around a bare
+ASGI app and the query hooks on a SELECT 1.
+
+    python -m bench.metrics_overhead --requests 2000 --rounds 3
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+
+async def _drive(requests: int):
+    import httpx
+
+    import main
+    import migrate
+
+    migrate.upgrade()
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as c:
+        uid = (await c.post("/users", json={"email": "overhead@bench"})).json()["id"]
+        # GET /health: middleware only; GET /users/{id}: one query; POST blocks: a write
+        mix = [("GET", "/health", None), ("GET", f"/users/{uid}", None),
+               ("POST", f"/users/{uid}/blocks", [{"package_name": "com.app"}])]
+        for method, url, body in mix * 50:  # warm-up
+            await c.request(method, url, json=body)
+        results = {}
+        for method, url, body in mix:
+            start = time.perf_counter()
+            for _ in range(requests):
+                await c.request(method, url, json=body)
+            results[f"{method} {url.replace(str(uid), '{id}')}"] = (time.perf_counter() - start) / requests
+    return results
+
+
+def _child(requests: int):
+    fd, path = tempfile.mkstemp(prefix="fb-bench-", suffix=".db")
+    os.close(fd)
+    os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    try:
+        print(json.dumps(asyncio.run(_drive(requests))))
+    finally:
+        os.unlink(path)
+
+
+def _run(enabled: bool, requests: int):
+    # ADMISSION_ENABLED=0: the write is one user's, over and over, which the rate limits would shed
+    env = dict(os.environ, METRICS_ENABLED="1" if enabled else "0", SLOW_REQUEST_MS="1e9", SLOW_QUERY_MS="1e9",
+               ADMISSION_ENABLED="0")
+    env.pop("USE_ASYNC_DB", None)
+    env.pop("DB_PROFILE", None)
+    out = subprocess.run([sys.executable, "-m", "bench.metrics_overhead", "--child", "--requests", str(requests)],
+                         env=env, check=True, capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def _components(n: int = 20000):
+    from sqlalchemy import create_engine, text
+
+    import metrics
+
+    async def bare(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def call(app):
+        scope = {"type": "http", "method": "GET", "path": "/", "headers": []}
+
+        async def send(message):
+            pass
+        start = time.perf_counter()
+        for _ in range(n):
+            await app(scope, None, send)
+        return (time.perf_counter() - start) / n
+
+    wrapped = metrics.MetricsMiddleware(bare)
+    middleware = asyncio.run(call(wrapped)) - asyncio.run(call(bare))
+
+    def query(engine):
+        with engine.connect() as conn:
+            stmt = text("SELECT 1")
+            start = time.perf_counter()
+            for _ in range(n):
+                conn.execute(stmt)
+            return (time.perf_counter() - start) / n
+
+    plain, hooked = create_engine("sqlite://"), create_engine("sqlite://")
+    metrics.instrument_engine(hooked)
+    hooks = query(hooked) - query(plain)
+    return middleware, hooks
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--requests", type=int, default=2000)
+    ap.add_argument("--rounds", type=int, default=3)
+    ap.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    if args.child:
+        _child(args.requests)
+        return
+    off, on = {}, {}
+    for _ in range(args.rounds):
+        for best, enabled in ((off, False), (on, True)):
+            for label, t in _run(enabled, args.requests).items():
+                best[label] = min(t, best.get(label, t))
+    print(f"{'request':28s} {'off us':>8s} {'on us':>8s} {'overhead':>9s}")
+    for label in off:
+        print(f"{label:28s} {off[label] * 1e6:8.1f} {on[label] * 1e6:8.1f} "
+              f"{(on[label] - off[label]) * 1e6:+7.1f}us ({(on[label] / off[label] - 1) * 100:+.1f}%)")
+    middleware, hooks = _components()
+    print(f"middleware per request        {middleware * 1e6:6.1f}us")
+    print(f"query hooks per statement     {hooks * 1e6:6.1f}us")
+
+
+if __name__ == "__main__":
+    main()
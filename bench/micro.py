@@ -0,0 +1,149 @@
+# bench/micro.py
+"""
+Micro-benchmarks of the crud.py functions behind each endpoint and of the
+expiry sweep, on a copy of a seeded database (bench.seed; a fresh one is
+seeded when --db is not given). Reports per-call p50/p95/p99 and calls/s; the
+sweep (deactivate_expired_blocks, finish_expired_sessions, re-seeding the
+expiry heap) runs once per --sweep-repeats on a fresh copy each time.
+
+    python -m bench.micro --iterations 500 --out micro.json
+    python -m bench.micro --db /tmp/fb-load.db --sweep-repeats 5
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from collections import defaultdict
+
+from sqlalchemy import create_engine, select, func
+from sqlalchemy.orm import sessionmaker
+
+
+def _open(path):
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    return engine, sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+def bench_crud(path: str, iterations: int):
+    import crud
+    import models
+    import schemas
+
+    engine, SessionLocal = _open(path)
+    samples = defaultdict(list)
+    db = SessionLocal()
+
+    def timed(label, fn, *args, **kwargs):
+        start = time.perf_counter()
+        result = fn(db, *args, **kwargs)
+        samples[label].append(time.perf_counter() - start)
+        return result
+
+    try:
+        users = db.execute(select(func.count()).select_from(models.User)).scalar()
+        schedule_of = dict(db.execute(select(models.Schedule.user_id, func.min(models.Schedule.id))
+                                      .group_by(models.Schedule.user_id)).all())
+        for i in range(iterations):
+            uid = 1 + (i * 7919) % users
+            timed("get_or_create_user", crud.get_or_create_user, f"user{uid - 1}@bench", name="Bench")
+            timed("get_user", crud.get_user, uid)
+            timed("list_schedules", crud.list_schedules, uid)
+            timed("list_active_blocked_apps", crud.list_active_blocked_apps, uid)
+            timed("list_active_sessions", crud.list_active_sessions, uid)
+            s = timed("start_session_for_user", crud.start_session_for_user, uid, schedule_of.get(uid), 25)
+            timed("pause_session", crud.pause_session, s.id)
+            timed("resume_session", crud.resume_session, s.id)
+            timed("stop_session_and_blocks", crud.stop_session_and_blocks, s.id)
+            timed("create_blocks", crud.create_blocks, uid,
+                  [schemas.BlockedAppCreate(package_name=f"com.vendor{(i + k) % 1000}.app") for k in range(5)])
+            timed("deactivate_blocks_for_user", crud.deactivate_blocks_for_user, uid)
+            sched = timed("create_schedule", crud.create_schedule, uid,
+                          schemas.ScheduleCreate(apps=[f"com.vendor{(i * 13 + k) % 1000}.app" for k in range(10)]))
+            timed("delete_schedule", crud.delete_schedule, uid, sched["id"])
+            timed("get_changes (snapshot)", crud.get_changes, uid, None)
+            head = db.execute(select(func.max(models.ChangeLog.seq))).scalar() or 0
+            timed("get_changes (delta)", crud.get_changes, uid, max(head - 50, 0))
+    finally:
+        db.close()
+        engine.dispose()
+    return samples
+
+
+def bench_sweep(path: str):
+    import crud
+    from scheduler import ExpiryScheduler
+
+    engine, SessionLocal = _open(path)
+    db = SessionLocal()
+    out = {}
+    try:
+        start = time.perf_counter()
+        expired = crud.deactivate_expired_blocks(db)
+        out["deactivate_expired_blocks"] = (time.perf_counter() - start, expired)
+        start = time.perf_counter()
+        finished = crud.finish_expired_sessions(db)
+        out["finish_expired_sessions"] = (time.perf_counter() - start, finished)
+        start = time.perf_counter()
+        seeded = ExpiryScheduler().seed(db)
+        out["expiry_scheduler.seed"] = (time.perf_counter() - start, seeded)
+    finally:
+        db.close()
+        engine.dispose()
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--db", help="seeded database to copy (bench.seed); default seeds a fresh one")
+    ap.add_argument("--users", type=int, default=10000)
+    ap.add_argument("--schedules", type=int, default=30000)
+    ap.add_argument("--sessions", type=int, default=100000)
+    ap.add_argument("--blocks", type=int, default=200000)
+    ap.add_argument("--iterations", type=int, default=300)
+    ap.add_argument("--sweep-repeats", type=int, default=3)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", help="write machine-readable results (JSON) here")
+    args = ap.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix="fb-micro-")
+    source = args.db or os.path.join(tmpdir, "seed.db")
+    work = os.path.join(tmpdir, "work.db")
+    # crud.py's own engine is never used here, but keep it off focusbubble.db
+    os.environ["DATABASE_URL"] = f"sqlite:///{work}"
+    from bench.common import percentiles
+    try:
+        if not args.db:
+            from bench.seed import seed
+            seed(source, args.users, args.schedules, args.sessions, args.blocks, seed=args.seed)
+        results = {}
+        sweeps = defaultdict(list)
+        for _ in range(args.sweep_repeats):
+            shutil.copyfile(source, work)
+            for name, (seconds, rows) in bench_sweep(work).items():
+                sweeps[name].append((seconds, rows))
+        for name, runs in sweeps.items():
+            times = sorted(t for t, _ in runs)
+            results[f"sweep.{name}"] = {"seconds": times[len(times) // 2], "min_seconds": times[0],
+                                        "rows": runs[0][1]}
+        shutil.copyfile(source, work)
+        for name, samples in bench_crud(work, args.iterations).items():
+            results[f"crud.{name}"] = dict(percentiles(samples), calls=len(samples),
+                                           mean_ms=sum(samples) / len(samples) * 1000,
+                                           rps=len(samples) / sum(samples))
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    for name, r in results.items():
+        if "seconds" in r:
+            print(f"{name:40s} {r['seconds'] * 1000:10.1f} ms  rows={r['rows']}")
+        else:
+            print(f"{name:40s} p50 {r['p50_ms']:7.3f} ms  p95 {r['p95_ms']:7.3f} ms  "
+                  f"p99 {r['p99_ms']:7.3f} ms  {r['rps']:8.0f}/s")
+    if args.out:
+        from bench.common import write_results
+        write_results(args.out, "micro", vars(args), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+# bench/query_counts.py
+"""
+Counts the SQL statements each mutating endpoint issues, driven in-process
+through httpx's ASGI transport against a throwaway database, and checks them
+against BUDGETS. Exits non-zero if an endpoint issues more statements than its
+budget, so a reintroduced per-row refresh shows up as a failure.
+
+GET /users/{id}/blocks is counted too: a cache hit (200 or 304) must issue no
+statement at all, and a block write must invalidate the cached entry (the
+next poll re-reads, returns the new block and a new ETag). The block cache's
+change-log check (BLOCK_CACHE_SYNC_SECONDS, long here so it stays out of the
+other counts) must cost one statement and must drop an entry that a block
+written by another worker made stale. Starting a session
+whose schedule includes a package that already has a future-dated block must
+succeed and leave both blocks active.
+
+    python -m bench.query_counts [--apps 50]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+
+# statements per request, excluding BEGIN/COMMIT; sessions and blocks must not
+# grow with the number of apps
+BUDGETS = {
+    "POST /users (new)": 2,
+    "POST /users (update)": 2,
+    "POST /users/{id}/schedules": 6,
+    "POST /users/{id}/sessions": 7,  # upsert_blocks reads the apps' active rows first
+    "POST /sessions/{id}/pause": 2,
+    "POST /sessions/{id}/resume": 2,
+    "POST /sessions/{id}/stop": 6,  # + the daily session and app stats upserts
+    "POST /users/{id}/blocks": 5,
+    "GET /users/{id}/blocks (miss)": 1,
+    "GET /users/{id}/blocks (hit)": 0,
+    "GET /users/{id}/blocks (hit, 304)": 0,
+    "GET /users/{id}/blocks (after a block write)": 1,
+    "GET /users/{id}/blocks (hit, change-log check)": 1,
+    "DELETE /users/{id}/schedules/{id}": 3,
+    "POST /refresh_blocks": 1,
+    "POST /batch (start + list blocks + list sessions)": 8,
+}
+
+
+async def _drive(apps: int):
+    import httpx
+    from sqlalchemy import event
+    from sqlalchemy.orm import Session
+
+    import cache
+    import crud
+    import database
+    import main
+    import migrate
+    import schemas
+
+    migrate.upgrade()
+    with database.SessionLocal() as db:
+        cache.block_cache.sync(db)  # the baseline main.py takes at startup
+
+    counted = []
+
+    def on_execute(conn, cursor, statement, parameters, context, executemany):
+        if not statement.lstrip().upper().startswith(("BEGIN", "COMMIT", "ROLLBACK", "SAVEPOINT", "RELEASE")):
+            counted.append(statement)
+
+    event.listen(database.engine, "before_cursor_execute", on_execute)
+    counts = {}
+    problems = []
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as c:
+
+        async def count(label, method, url, **kw):
+            counted.clear()
+            r = await c.request(method, url, **kw)
+            if r.status_code >= 400:
+                r.raise_for_status()
+            counts[label] = len(counted)
+            return r
+
+        async def call(label, method, url, **kw):
+            return (await count(label, method, url, **kw)).json()
+
+        packages = [f"com.app{i}" for i in range(apps)]
+        uid = (await call("POST /users (new)", "POST", "/users", json={"email": "counts@bench"}))["id"]
+        await call("POST /users (update)", "POST", "/users", json={"email": "counts@bench", "name": "Counts"})
+        sid = (await call("POST /users/{id}/schedules", "POST", f"/users/{uid}/schedules",
+                          json={"apps": packages}))["id"]
+        session = await call("POST /users/{id}/sessions", "POST", f"/users/{uid}/sessions",
+                             json={"user_id": uid, "schedule_id": sid, "duration_minutes": 25})
+        await call("POST /sessions/{id}/pause", "POST", f"/sessions/{session['id']}/pause")
+        await call("POST /sessions/{id}/resume", "POST", f"/sessions/{session['id']}/resume")
+        await call("POST /sessions/{id}/stop", "POST", f"/sessions/{session['id']}/stop")
+        await call("POST /users/{id}/blocks", "POST", f"/users/{uid}/blocks",
+                   json=[{"package_name": p} for p in packages])
+        miss = await count("GET /users/{id}/blocks (miss)", "GET", f"/users/{uid}/blocks")
+        hit = await count("GET /users/{id}/blocks (hit)", "GET", f"/users/{uid}/blocks")
+        if hit.content != miss.content or hit.headers["etag"] != miss.headers["etag"]:
+            problems.append("cache hit differs from the response it was cached from")
+        r = await count("GET /users/{id}/blocks (hit, 304)", "GET", f"/users/{uid}/blocks",
+                        headers={"If-None-Match": miss.headers["etag"]})
+        if r.status_code != 304:
+            problems.append(f"If-None-Match on an unchanged block set got {r.status_code}, not 304")
+        await c.post(f"/users/{uid}/blocks", json=[{"package_name": "com.invalidate"}])
+        r = await count("GET /users/{id}/blocks (after a block write)", "GET", f"/users/{uid}/blocks",
+                        headers={"If-None-Match": miss.headers["etag"]})
+        if r.status_code != 200 or "com.invalidate" not in {b["package_name"] for b in r.json()}:
+            problems.append("a block write did not invalidate the cached block set")
+
+        cache.block_cache.sync_interval = 0
+        await c.get(f"/users/{uid}/blocks")  # takes in the write above
+        await count("GET /users/{id}/blocks (hit, change-log check)", "GET", f"/users/{uid}/blocks")
+        # another worker's write: committed without this process's invalidation hook
+        event.remove(Session, "after_commit", cache._after_commit)
+        try:
+            with database.SessionLocal() as db:
+                crud.create_blocks(db, uid, [schemas.BlockedAppCreate(package_name="com.elsewhere")])
+        finally:
+            event.listen(Session, "after_commit", cache._after_commit)
+        r = await c.get(f"/users/{uid}/blocks")
+        if "com.elsewhere" not in {b["package_name"] for b in r.json()}:
+            problems.append("a block written by another worker was still served from the cache")
+        cache.block_cache.sync_interval = cache.BLOCK_CACHE_SYNC
+        await call("DELETE /users/{id}/schedules/{id}", "DELETE", f"/users/{uid}/schedules/{sid}")
+        await call("POST /refresh_blocks", "POST", "/refresh_blocks")
+        sid = (await c.post(f"/users/{uid}/schedules", json={"apps": packages})).json()["id"]
+        await call("POST /batch (start + list blocks + list sessions)", "POST", "/batch", json={
+            "user_id": uid, "ops": [{"op": "start_session", "schedule_id": sid, "duration_minutes": 25},
+                                    {"op": "list_blocks"}, {"op": "list_active_sessions"}]})
+
+        later = {"package_name": "com.later", "start_time": "2030-01-01T09:00:00", "end_time": "2030-01-01T10:00:00"}
+        await c.post(f"/users/{uid}/blocks", json=[later])
+        sid = (await c.post(f"/users/{uid}/schedules", json={"apps": ["com.later"]})).json()["id"]
+        r = await c.post(f"/users/{uid}/sessions", json={"user_id": uid, "schedule_id": sid, "duration_minutes": 25})
+        if r.status_code != 200:
+            problems.append(f"starting a session next to a future block of one of its apps got {r.status_code}")
+        starts = sorted(b["start_time"] for b in (await c.get(f"/users/{uid}/blocks")).json()
+                        if b["package_name"] == "com.later")
+        if len(starts) != 2 or not starts[1].startswith("2030-01-01T09:00:00"):
+            problems.append(f"expected a block from now and the 2030 one for com.later, got {starts}")
+    event.remove(database.engine, "before_cursor_execute", on_execute)
+    return counts, problems
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--apps", type=int, default=50)
+    args = ap.parse_args()
+    fd, path = tempfile.mkstemp(prefix="fb-bench-", suffix=".db")
+    os.close(fd)
+    os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    os.environ["BLOCK_CACHE_SYNC_SECONDS"] = "3600"
+    os.environ.pop("USE_ASYNC_DB", None)
+    os.environ.pop("DB_PROFILE", None)
+    try:
+        counts, problems = asyncio.run(_drive(args.apps))
+    finally:
+        os.unlink(path)
+    over = 0
+    for label, n in counts.items():
+        budget = BUDGETS[label]
+        flag = "" if n <= budget else "  OVER BUDGET"
+        over += n > budget
+        print(f"{label:50s} {n:3d} / {budget}{flag}")
+    for problem in problems:
+        print(f"FAILED: {problem}")
+    sys.exit(1 if over or problems else 0)
+
+
+if __name__ == "__main__":
+    main()
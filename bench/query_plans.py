@@ -0,0 +1,141 @@
+# bench/query_plans.py
+"""
+Runs every crud.py function and an archive.py pass against a small seeded
+database, captures each SQL statement they issue and checks its EXPLAIN QUERY
+PLAN. Exits non-zero if any statement falls back to a full table scan.
+
+    python -m bench.query_plans
+"""
+import os
+import re
+import sys
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, inspect
+
+import crud
+import schemas
+from bench.common import temp_engine, seed_blocks
+
+# "SCAN blocked_apps" is a full table scan; "SCAN t USING INDEX ..." / "SEARCH ..." are not
+FULL_SCAN = re.compile(r"^SCAN (\w+)$")
+
+
+def exercise(db):
+    """Calls every public crud function once."""
+    u = crud.get_or_create_user(db, "plans@bench", name="Plans")
+    crud.get_or_create_user(db, "plans@bench", name="Plans 2")
+    crud.get_user(db, u.id)
+    sched = crud.create_schedule(db, u.id, schemas.ScheduleCreate(apps=["com.a", "com.b"]))
+    crud.list_schedules(db, u.id)
+    s = crud.start_session_for_user(db, u.id, sched["id"], 25)
+    crud.pause_session(db, s.id)
+    crud.resume_session(db, s.id)
+    crud.list_active_sessions(db, u.id)
+    crud.stop_session(db, s.id)
+    blocks = crud.create_blocked_apps_for_session(db, u.id, ["com.a", "com.b"], 25)
+    crud.list_active_blocked_apps(db, u.id)
+    crud.deactivate_blocks_for_user(db, u.id)
+    crud.expire_blocks(db, [b.id for b in blocks], datetime.utcnow())
+    crud.finish_sessions(db, [s.id], datetime.utcnow())
+    crud.deactivate_expired_blocks(db)
+    crud.finish_expired_sessions(db)
+    crud.delete_schedule(db, u.id, sched["id"])
+    crud.get_changes(db, u.id, None)
+    crud.get_changes(db, u.id, 1)
+    crud.compact_change_log(db, retain_seconds=0)
+    today = datetime.utcnow().date()
+    crud.get_stats(db, u.id, today - timedelta(days=30), today)
+    for kind in crud.HISTORY:
+        _, cursor = crud.history_page(db, kind, u.id, limit=1)
+        crud.history_page(db, kind, u.id, cursor)  # export_history runs the same queries
+
+
+def exercise_archive(engine):
+    """
+    One archive.run pass that moves every expired block and ended session, then
+    a stats backfill that reads them back from the archive.
+    """
+    import archive
+    from sqlalchemy.orm import Session
+
+    archive.run(engine, retention_days=0, batch=100, pause=0, vacuum=False)
+    with Session(engine) as db:
+        crud.backfill_stats(db, include_archive=True, chunk_size=20)  # a slice of the 200 users, as in production
+
+
+def capture(engine, fn):
+    statements = []
+
+    def on_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE")):
+            statements.append((statement, parameters[0] if executemany else parameters))
+
+    event.listen(engine, "before_cursor_execute", on_execute)
+    try:
+        fn()
+    finally:
+        event.remove(engine, "before_cursor_execute", on_execute)
+    return statements
+
+
+def check(engine, statements):
+    """Returns [(statement, plan_detail)] for every full table scan."""
+    failures = []
+    # a subquery's co-routine ("SCAN anon_2") holds at most its own LIMIT rows
+    inspector = inspect(engine)
+    tables = set(inspector.get_table_names())
+    if "archive" in inspector.get_schema_names():
+        tables |= set(inspector.get_table_names(schema="archive"))
+    raw = engine.raw_connection()
+    try:
+        for statement, params in statements:
+            for row in raw.cursor().execute("EXPLAIN QUERY PLAN " + statement, params):
+                match = FULL_SCAN.match(row[3])
+                if match and match.group(1) in tables:
+                    failures.append((statement, row[3]))
+    finally:
+        raw.close()
+    return failures
+
+
+def run_crud(SessionLocal):
+    db = SessionLocal()
+    try:
+        exercise(db)
+    finally:
+        db.close()
+
+
+def main():
+    import archive
+
+    engine, SessionLocal, path = temp_engine()
+    archive_engine = None
+    try:
+        seed_blocks(engine, 20000, users=200)
+        engine.dispose()
+        # run ANALYZE so the planner sees realistic table sizes
+        with engine.begin() as conn:
+            conn.exec_driver_sql("ANALYZE")
+        statements = capture(engine, lambda: run_crud(SessionLocal))
+        failures = check(engine, statements)
+        # archive.py's statements need the archive file attached
+        archive_engine = archive.make_engine(f"sqlite:///{path}", path + ".archive")
+        archived = capture(archive_engine, lambda: exercise_archive(archive_engine))
+        failures += check(archive_engine, archived)
+        statements += archived
+    finally:
+        engine.dispose()
+        if archive_engine is not None:
+            archive_engine.dispose()
+            os.unlink(path + ".archive")
+        os.unlink(path)
+    print(f"checked {len(statements)} statements, {len(failures)} full table scans")
+    for statement, detail in failures:
+        print(f"\n{detail}\n{statement}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+# bench/schedules.py
+"""
+Schedule listing, session start and "which schedules block package X" with
+200-app schedules: the old comma-separated apps_csv / text package_name layout
+(recreated here as legacy_* tables) vs the apps catalog and schedule_apps.
+
+    python -m bench.schedules --users 200 --schedules 5 --apps 200
+"""
+import argparse
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import (Column, Integer, String, Boolean, DateTime, Text, Index, MetaData, Table,
+                        select, insert, func, case, text)
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+import crud
+import models
+import schemas
+from bench.common import temp_engine, timed
+
+legacy = MetaData()
+legacy_schedules = Table(
+    "legacy_schedules", legacy,
+    Column("id", Integer, primary_key=True),
+    Column("user_id", Integer, nullable=False, index=True),
+    Column("label", String), Column("duration_minutes", Integer),
+    Column("apps_csv", Text), Column("is_active", Boolean), Column("created_at", DateTime),
+)
+legacy_blocks = Table(
+    "legacy_blocked_apps", legacy,
+    Column("id", Integer, primary_key=True),
+    Column("user_id", Integer, nullable=False),
+    Column("package_name", String, nullable=False, index=True),
+    Column("app_name", String),
+    Column("start_time", DateTime, nullable=False), Column("end_time", DateTime, nullable=False),
+    Column("is_active", Boolean),
+    Index("ux_legacy_active_package", "user_id", "package_name", unique=True, sqlite_where=text("is_active = 1")),
+)
+
+
+def legacy_create_schedule(db, user_id, apps):
+    db.execute(insert(legacy_schedules).values(user_id=user_id, label="Focus", duration_minutes=25,
+                                               apps_csv=",".join(apps), is_active=False,
+                                               created_at=datetime.utcnow()))
+    db.commit()
+
+
+def legacy_list_schedules(db, user_id):
+    rows = db.execute(select(legacy_schedules).where(legacy_schedules.c.user_id == user_id)).all()
+    return [{"id": r.id, "apps": r.apps_csv.split(",") if r.apps_csv else []} for r in rows]
+
+
+def legacy_block_schedule(db, user_id, schedule_id, minutes):
+    apps_csv = db.execute(select(legacy_schedules.c.apps_csv).where(legacy_schedules.c.id == schedule_id)).scalar()
+    now = datetime.utcnow()
+    stmt = sqlite_insert(legacy_blocks)
+    current = legacy_blocks.c
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[current.user_id, current.package_name], index_where=current.is_active == True,
+        set_={"end_time": case((current.end_time <= func.strftime("%Y-%m-%d %H:%M:%f", "now"), stmt.excluded.end_time),
+                               else_=func.max(current.end_time, stmt.excluded.end_time))},
+    ).returning(*current)
+    rows = db.execute(stmt, [{"user_id": user_id, "package_name": p, "app_name": None, "start_time": now,
+                              "end_time": now + timedelta(minutes=minutes), "is_active": True}
+                             for p in apps_csv.split(",")]).all()
+    crud._blocks_added(db, rows)  # same change log / cache bookkeeping as the real path
+    db.commit()
+    return rows
+
+
+def legacy_schedules_with(db, package_name):
+    rows = db.execute(select(legacy_schedules.c.id, legacy_schedules.c.apps_csv)
+                      .where(legacy_schedules.c.apps_csv.like(f"%{package_name}%"))).all()
+    return [r.id for r in rows if package_name in r.apps_csv.split(",")]
+
+
+def schedules_with(db, package_name):
+    return db.execute(select(models.ScheduleApp.schedule_id)
+                      .join(models.App, models.App.id == models.ScheduleApp.app_id)
+                      .where(models.App.package_name == package_name)).scalars().all()
+
+
+def table_bytes(db, *names):
+    return db.execute(text("SELECT sum(pgsize) FROM dbstat WHERE name IN (%s)" % ",".join(f"'{n}'" for n in names))).scalar()
+
+
+def run(users: int, schedules: int, apps: int):
+    results = {}
+    engine, SessionLocal, path = temp_engine()
+    legacy.create_all(engine)
+    try:
+        with engine.begin() as conn:
+            conn.execute(insert(models.User), [{"id": u + 1, "email": f"user{u}@bench"} for u in range(users)])
+        db = SessionLocal()
+        # overlapping app sets drawn from a 1000-package pool
+        app_sets = [[f"com.vendor{(k * 37 + i) % 1000}.app" for i in range(apps)] for k in range(schedules)]
+        new_ids = {}
+        with timed(results, "old.create_schedules"):
+            for u in range(users):
+                for k in range(schedules):
+                    legacy_create_schedule(db, u + 1, app_sets[k])
+        with timed(results, "new.create_schedules"):
+            for u in range(users):
+                for k in range(schedules):
+                    new_ids[u, k] = crud.create_schedule(db, u + 1, schemas.ScheduleCreate(apps=app_sets[k]))["id"]
+        with timed(results, "old.list_schedules"):
+            for u in range(users):
+                legacy_list_schedules(db, u + 1)
+        with timed(results, "new.list_schedules"):
+            for u in range(users):
+                crud.list_schedules(db, u + 1)
+        legacy_ids = db.execute(select(legacy_schedules.c.id).order_by(legacy_schedules.c.id)).scalars().all()
+        with timed(results, "old.start_session"):
+            for u in range(users):
+                crud.start_session(db, u + 1, None, 25)
+                legacy_block_schedule(db, u + 1, legacy_ids[u * schedules], 25)
+        with timed(results, "new.start_session"):
+            for u in range(users):
+                crud.start_session_for_user(db, u + 1, new_ids[u, 0], 25)
+        probe = app_sets[0][0]
+        with timed(results, "old.schedules_with_app"):
+            n_old = len(legacy_schedules_with(db, probe))
+        with timed(results, "new.schedules_with_app"):
+            n_new = len(schedules_with(db, probe))
+        assert n_old == n_new, (n_old, n_new)
+        results["old.blocks_bytes"] = table_bytes(db, "legacy_blocked_apps", "ix_legacy_blocked_apps_package_name",
+                                                  "ux_legacy_active_package")
+        results["new.blocks_bytes"] = table_bytes(db, "blocked_apps", "ix_blocked_apps_app_id",
+                                                  "ix_blocked_apps_active_app", "apps", "ix_apps_package_name")
+        results["old.schedules_bytes"] = table_bytes(db, "legacy_schedules")
+        results["new.schedules_bytes"] = table_bytes(db, "schedules", "schedule_apps", "ix_schedule_apps_app_id")
+        db.close()
+    finally:
+        engine.dispose()
+        os.unlink(path)
+    return results
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--users", type=int, default=200)
+    ap.add_argument("--schedules", type=int, default=5)
+    ap.add_argument("--apps", type=int, default=200)
+    args = ap.parse_args()
+    for k, v in run(args.users, args.schedules, args.apps).items():
+        print(f"{k:24s} {v:.3f}" if isinstance(v, float) else f"{k:24s} {v}")
+
+
+if __name__ == "__main__":
+    main()
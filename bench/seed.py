@@ -0,0 +1,54 @@
+# bench/seed.py
+"""
+Builds a seeded SQLite database (schema via the Alembic migrations) for
+bench.load / bench.micro or a local uvicorn; sizes are totals.
+
+    python -m bench.seed /tmp/fb-load.db --users 100000 --schedules 300000 \\
+        --sessions 1000000 --blocks 2000000
+"""
+import argparse
+import os
+import time
+
+from sqlalchemy import create_engine, text
+
+
+def seed(path: str, users: int, schedules: int, sessions: int, blocks: int,
+         apps_per_schedule: int = 10, catalog: int = 1000, seed: int = 0):
+    """Creates path at the migrations' head and fills it with bench.common.seed_dataset."""
+    import migrate
+    from bench.common import seed_dataset
+
+    engine = create_engine(f"sqlite:///{path}")
+    try:
+        migrate.upgrade(bind=engine)
+        seed_dataset(engine, users, schedules, sessions, blocks,
+                     apps_per_schedule=apps_per_schedule, catalog=catalog, seed=seed)
+        with engine.connect() as conn:
+            conn.execute(text("ANALYZE"))
+    finally:
+        engine.dispose()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("path")
+    ap.add_argument("--users", type=int, default=10000)
+    ap.add_argument("--schedules", type=int, default=30000)
+    ap.add_argument("--sessions", type=int, default=100000)
+    ap.add_argument("--blocks", type=int, default=200000)
+    ap.add_argument("--apps-per-schedule", type=int, default=10)
+    ap.add_argument("--catalog", type=int, default=1000)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+    if os.path.exists(args.path):
+        ap.error(f"{args.path} already exists")
+    t0 = time.perf_counter()
+    seed(args.path, args.users, args.schedules, args.sessions, args.blocks,
+         args.apps_per_schedule, args.catalog, args.seed)
+    print(f"seeded {args.path} in {time.perf_counter() - t0:.1f}s "
+          f"({os.path.getsize(args.path) / 1e6:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+# bench/serialization.py
+"""
+Cost of turning --blocks active-block rows (as crud.list_active_blocked_apps
+returns them) into a JSON response body, per path:
+
+  response_model   FastAPI's route path: validate the rows against
+                   List[BlockedAppOut] (from_attributes), then dump to JSON
+  jsonable_encoder a route without response_model: jsonable_encoder + json.dumps
+  orjson           serialization.py: project the row tuples to the model's
+                   fields and orjson.dumps them (no validation)
+  pydantic_core    serialization.py's fallback when orjson is not installed
+
+plus GET /users/{id}/blocks end to end (in-process, block cache cleared before
+every request so each one serializes) for a user with --blocks active blocks.
+
+    python -m bench.serialization --blocks 1000 --iterations 200 --out ser.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import List
+
+
+def make_rows(n: int):
+    from crud import BlockRow
+
+    now = datetime.utcnow()
+    return [BlockRow(i, 1, f"com.vendor{i}.app", None if i % 3 else f"App {i}", now,
+                     now + timedelta(minutes=25 + i % 60), True) for i in range(1, n + 1)]
+
+
+def bench_paths(rows, iterations: int):
+    from fastapi.encoders import jsonable_encoder
+    from pydantic import TypeAdapter
+
+    import schemas
+    import serialization
+
+    adapter = TypeAdapter(List[schemas.BlockedAppOut])
+    fields = serialization.fields(schemas.BlockedAppOut)
+    dicts = [{f: getattr(r, f) for f in fields} for r in rows]
+
+    def fallback():
+        orjson, serialization.orjson = serialization.orjson, None
+        try:
+            return serialization.dumps([{f: getattr(r, f) for f in fields} for r in rows])
+        finally:
+            serialization.orjson = orjson
+
+    paths = {
+        "response_model": lambda: adapter.dump_json(adapter.validate_python(rows, from_attributes=True)),
+        "jsonable_encoder": lambda: json.dumps(jsonable_encoder(dicts)).encode("utf-8"),
+        "orjson": lambda: serialization.dumps([{f: getattr(r, f) for f in fields} for r in rows]),
+        "pydantic_core": fallback,
+    }
+    bodies = {name: json.loads(fn()) for name, fn in paths.items()}
+    assert all(b == bodies["response_model"] for b in bodies.values()), "paths disagree on the output"
+    samples = {}
+    for name, fn in paths.items():
+        s = samples[name] = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            fn()
+            s.append(time.perf_counter() - start)
+    return samples
+
+
+async def bench_endpoint(blocks: int, iterations: int):
+    import httpx
+
+    import crud
+    import main
+    import migrate
+    import schemas
+    from cache import block_cache
+    from database import SessionLocal
+
+    migrate.upgrade()
+    db = SessionLocal()
+    try:
+        uid = crud.get_or_create_user(db, "serialization@bench").id
+        crud.create_blocks(db, uid, [schemas.BlockedAppCreate(package_name=f"com.vendor{i}.app")
+                                     for i in range(blocks)])
+    finally:
+        db.close()
+    samples = []
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://bench") as c:
+        for _ in range(iterations):
+            block_cache.clear()
+            start = time.perf_counter()
+            r = await c.get(f"/users/{uid}/blocks")
+            samples.append(time.perf_counter() - start)
+            r.raise_for_status()
+    assert len(r.json()) == blocks
+    return samples
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--blocks", type=int, default=1000)
+    ap.add_argument("--iterations", type=int, default=200)
+    ap.add_argument("--out", help="write machine-readable results (JSON) here")
+    args = ap.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix="fb-ser-")
+    # must be set before main / database are imported
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmpdir, 'ser.db')}"
+    os.environ.setdefault("SLOW_REQUEST_MS", "1e9")
+    os.environ.setdefault("SLOW_QUERY_MS", "1e9")
+    from bench.common import percentiles
+    try:
+        results = {}
+        for name, s in bench_paths(make_rows(args.blocks), args.iterations).items():
+            results[f"serialize.{name}"] = dict(percentiles(s), calls=len(s), mean_ms=sum(s) / len(s) * 1000)
+        s = asyncio.run(bench_endpoint(args.blocks, args.iterations))
+        results["GET /users/{id}/blocks (cache miss)"] = dict(percentiles(s), requests=len(s),
+                                                             rps=len(s) / sum(s), mean_ms=sum(s) / len(s) * 1000)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    print(f"{args.blocks} blocks per response")
+    for name, r in results.items():
+        print(f"{name:40s} p50 {r['p50_ms']:8.3f} ms  p95 {r['p95_ms']:8.3f} ms  p99 {r['p99_ms']:8.3f} ms")
+    if args.out:
+        from bench.common import write_results
+        write_results(args.out, "serialization", vars(args), results)
+
+
+if __name__ == "__main__":
+    main()
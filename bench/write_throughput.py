@@ -0,0 +1,104 @@
+# bench/write_throughput.py
+"""
+Concurrent write throughput: default profile (each thread commits its own
+rollback-journal transaction) vs DB_PROFILE=production (WAL + group-commit writer).
+
+    python -m bench.write_throughput --threads 32 --writes 4000
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+
+def _worker(threads: int, writes: int):
+    import crud
+    import database
+    import writer
+    from bench.common import temp_engine
+
+    # schema via create_all on the same file the app engine points at
+    temp_engine(database.SQLALCHEMY_DATABASE_URL[len("sqlite:///"):])[0].dispose()
+    db = database.SessionLocal()
+    uid = crud.get_or_create_user(db, "writes@bench").id
+    db.close()
+    production = database.DB_PROFILE == "production"
+    w = writer.start() if production else None
+    errors = 0
+    per_thread = writes // threads
+
+    def one(db):
+        s = crud.start_session(db, uid, None, 25)
+        crud.stop_session(db, s.id)
+
+    def loop():
+        nonlocal errors
+        db = None if production else database.SessionLocal()
+        for _ in range(per_thread):
+            try:
+                if production:
+                    w.submit(one).result()
+                else:
+                    one(db)
+            except Exception:
+                errors += 1
+                if db is not None:
+                    db.rollback()
+        if db is not None:
+            db.close()
+
+    ts = [threading.Thread(target=loop) for _ in range(threads)]
+    t0 = time.perf_counter()
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    out = {"writes": per_thread * threads, "errors": errors, "seconds": elapsed,
+           "writes_per_s": per_thread * threads / elapsed}
+    if w is not None:
+        out["avg_batch"] = w.jobs / max(w.batches, 1)
+        writer.stop()
+    print(json.dumps(out))
+
+
+def run(threads: int, writes: int):
+    results = {}
+    for profile in ("default", "production"):
+        fd, path = tempfile.mkstemp(prefix="fb-bench-", suffix=".db")
+        os.close(fd)
+        os.unlink(path)
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{path}", DB_PROFILE=profile)
+        try:
+            out = subprocess.run(
+                [sys.executable, "-m", "bench.write_throughput", "--worker", "--threads", str(threads), "--writes", str(writes)],
+                env=env, check=True, capture_output=True, text=True,
+            ).stdout
+        finally:
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(path + suffix):
+                    os.unlink(path + suffix)
+        results[profile] = json.loads(out.strip().splitlines()[-1])
+    return results
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--threads", type=int, default=32)
+    ap.add_argument("--writes", type=int, default=4000)
+    ap.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    if args.worker:
+        _worker(args.threads, args.writes)
+        return
+    for profile, r in run(args.threads, args.writes).items():
+        extra = f"  avg batch={r['avg_batch']:.1f}" if "avg_batch" in r else ""
+        print(f"{profile:10s} {r['writes_per_s']:8.1f} writes/s  errors={r['errors']}{extra}")
+
+
+if __name__ == "__main__":
+    main()
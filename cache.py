@@ -0,0 +1,193 @@
+# cache.py
+import itertools
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Iterable, Optional
+
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session
+
+import models
+import schemas
+from registry import SESSION_REGISTRY_SYNC
+from scheduler import BLOCK
+from serialization import dumps, fields
+
+BLOCK_CACHE_SIZE = int(os.getenv("BLOCK_CACHE_SIZE", "10000"))
+BLOCK_CACHE_TTL = float(os.getenv("BLOCK_CACHE_TTL_SECONDS", "60"))
+# how stale a hit may be with respect to block writes made by other worker
+# processes; SESSION_REGISTRY_SYNC=0 (one worker) turns the check off
+BLOCK_CACHE_SYNC = float(os.getenv("BLOCK_CACHE_SYNC_SECONDS", "1"))
+
+_BLOCK_FIELDS = fields(schemas.BlockedAppOut)
+
+
+class _Entry:
+    __slots__ = ("version", "etag", "body", "expires_at", "valid_until")
+
+    def __init__(self, version, etag, body, expires_at, valid_until):
+        self.version = version
+        self.etag = etag
+        self.body = body
+        self.expires_at = expires_at
+        self.valid_until = valid_until
+
+
+class ActiveBlockCache:
+    """
+    Per-user cache of the serialized active block list for GET /users/{id}/blocks.
+    Every entry carries a version drawn from a process-wide counter, exposed as
+    the ETag, so a version (and ETag) is never reused for different contents.
+    Entries are bounded by size (LRU), by TTL and by the earliest end_time in the
+    list; invalidate() replaces an entry with a tombstone so a query that raced
+    with the invalidation cannot put stale rows back.
+
+    Commits in this process invalidate directly (invalidate_on_commit). Writes
+    by other workers are picked up by sync(), which main.py runs before a
+    lookup at most every sync_interval seconds, so that is how long a hit can
+    trail another worker's block write or session stop.
+    """
+
+    def __init__(self, maxsize: int = BLOCK_CACHE_SIZE, ttl: float = BLOCK_CACHE_TTL,
+                 sync: bool = SESSION_REGISTRY_SYNC, sync_interval: float = BLOCK_CACHE_SYNC):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.sync_enabled = sync
+        self.sync_interval = sync_interval
+        self._seq = None  # change_log high-water mark; None = no baseline yet
+        self._synced_at = None
+        self._entries = OrderedDict()
+        self._counter = itertools.count(1)
+        self._epoch = uuid.uuid4().hex[:8]  # distinguishes ETags across restarts/workers
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # workers forked by serve.py count versions from the same point: new epoch each
+        os.register_at_fork(after_in_child=self._forked)
+
+    def _forked(self):
+        self._entries = OrderedDict()
+        self._epoch = uuid.uuid4().hex[:8]
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int) -> Optional[_Entry]:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry.body is None:
+                self.misses += 1
+                return None
+            if time.monotonic() >= entry.expires_at or (
+                entry.valid_until is not None and datetime.utcnow() >= entry.valid_until
+            ):
+                del self._entries[user_id]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry
+
+    def version(self, user_id: int):
+        """Token to pass to put(); taken before running the query."""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            return entry.version if entry is not None else None
+
+    def put(self, user_id: int, seen, rows) -> _Entry:
+        """
+        Serializes rows and caches them unless the user was invalidated since
+        version() returned seen. Always returns an entry usable for the response.
+        """
+        body = dumps([{f: getattr(r, f) for f in _BLOCK_FIELDS} for r in rows])
+        valid_until = min((r.end_time for r in rows), default=None)
+        with self._lock:
+            version = next(self._counter)
+            entry = _Entry(version, f'"{self._epoch}-{version}"', body,
+                           time.monotonic() + self.ttl, valid_until)
+            current = self._entries.get(user_id)
+            if (current.version if current is not None else None) == seen:
+                self._entries[user_id] = entry
+                self._entries.move_to_end(user_id)
+                self._evict()
+            return entry
+
+    def invalidate(self, user_ids: Iterable[int]):
+        with self._lock:
+            for user_id in user_ids:
+                self._entries[user_id] = _Entry(next(self._counter), None, None, 0, None)
+                self._entries.move_to_end(user_id)
+            self._evict()
+
+    def sync_due(self) -> bool:
+        return self.sync_enabled and (
+            self._synced_at is None or time.monotonic() - self._synced_at >= self.sync_interval)
+
+    def sync(self, db: Session):
+        """
+        Invalidates the users with block entries in change_log after the last
+        seq seen. Without a baseline, or after more than ttl without a sync
+        (the log may have been compacted meanwhile), every entry is
+        invalidated and the current head becomes the baseline.
+        """
+        now = time.monotonic()
+        if self._seq is None or now - self._synced_at > self.ttl:
+            seq = db.execute(select(func.max(models.ChangeLog.seq))).scalar() or 0
+            with self._lock:
+                users = list(self._entries)
+            self.invalidate(users)
+            self._seq = seq
+        else:
+            changed = db.execute(
+                select(models.ChangeLog.seq, models.ChangeLog.user_id)
+                .where(models.ChangeLog.seq > self._seq, models.ChangeLog.entity == BLOCK)
+                .order_by(models.ChangeLog.seq)
+            ).all()
+            if changed:
+                self.invalidate({r.user_id for r in changed})
+                self._seq = max(self._seq, changed[-1].seq)
+        self._synced_at = now
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _evict(self):
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+
+block_cache = ActiveBlockCache()
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [t.strip() for t in if_none_match.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
+def invalidate_on_commit(db: Session, user_ids: Iterable[int]):
+    """
+    Marks users whose active block set changed; their cache entries are dropped
+    once db's transaction actually commits (after the group-commit batch when
+    running behind writer.py), so readers never re-cache pre-commit state.
+    """
+    db.info.setdefault("block_cache_users", set()).update(user_ids)
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(db):
+    users = db.info.pop("block_cache_users", None)
+    if users:
+        block_cache.invalidate(users)
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(db):
+    db.info.pop("block_cache_users", None)
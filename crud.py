@@ -1,65 +1,190 @@
 # crud.py
+from sqlalchemy import select, update, insert, delete, func, case, cast, literal, or_, union_all, DateTime, Integer
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import Session
 import models
 import schemas
-from datetime import datetime, timedelta
-from typing import List
+from datetime import date, datetime, timedelta, timezone
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional
+from scheduler import schedule_on_commit, BLOCK, SESSION
+from cache import invalidate_on_commit
+from events import publish_on_commit, session_event, json_default
+from registry import session_registry, track_on_commit
+import json
+import os
+
+def _block_dict(b) -> dict:
+    return {"id": b.id, "package_name": b.package_name, "app_name": b.app_name,
+            "start_time": b.start_time, "end_time": b.end_time, "is_active": b.is_active}
+
+def _schedule_dict(r, apps: List[str]) -> dict:
+    return {"id": r.id, "label": r.label, "duration_minutes": r.duration_minutes,
+            "apps": apps, "is_active": r.is_active, "created_at": r.created_at}
+
+def _blocks_added(db: Session, rows, reason: str = "created"):
+    """
+    BlockedApp rows were created or extended: log them, and on commit drop the
+    owners' cached block lists, push a change event and (re)schedule their expiry.
+    """
+    users = {r.user_id for r in rows}
+    invalidate_on_commit(db, users)
+    for user_id in users:
+        publish_on_commit(db, user_id, "blocks", {"reason": reason})
+    log_changes(db, [(r.user_id, BLOCK, r.id, UPSERT, _block_dict(r)) for r in rows])
+    for r in rows:
+        schedule_on_commit(db, BLOCK, r.id, r.end_time)
+
+def _blocks_removed(db: Session, rows, reason: str):
+    """
+    Like _blocks_added, for _BLOCK_END_COLUMNS rows that left the active set;
+    their blocked time goes into the daily rollups.
+    """
+    users = {r.user_id for r in rows}
+    invalidate_on_commit(db, users)
+    for user_id in users:
+        publish_on_commit(db, user_id, "blocks", {"reason": reason})
+    log_changes(db, [(r.user_id, BLOCK, r.id, DELETE, None) for r in rows])
+    for r in rows:
+        schedule_on_commit(db, BLOCK, r.id, None)
+    _record_blocks_ended(db, rows)
+
+def _session_changed(db: Session, s):
+    data = session_event(s)
+    publish_on_commit(db, s.user_id, "session", data)
+    log_changes(db, [(s.user_id, SESSION, s.id, UPSERT, data)])
+    track_on_commit(db, [s])
 
 # USER
+_USER_COLUMNS = (models.User.id, models.User.email, models.User.name, models.User.picture)
+
 def get_or_create_user(db: Session, email: str, name: str = None, picture: str = None):
-    u = db.query(models.User).filter(models.User.email == email).first()
+    u = db.execute(select(*_USER_COLUMNS).where(models.User.email == email)).first()
     if u:
         # update name/picture if changed
-        changed = False
+        changed = {}
         if name and u.name != name:
-            u.name = name; changed = True
+            changed["name"] = name
         if picture and u.picture != picture:
-            u.picture = picture; changed = True
+            changed["picture"] = picture
         if changed:
-            db.commit(); db.refresh(u)
+            u = db.execute(update(models.User).where(models.User.id == u.id).values(**changed)
+                           .returning(*_USER_COLUMNS)).first()
+            db.commit()
         return u
-    u = models.User(email=email, name=name, picture=picture)
-    db.add(u); db.commit(); db.refresh(u)
+    u = db.execute(insert(models.User).values(email=email, name=name, picture=picture)
+                   .returning(*_USER_COLUMNS)).first()
+    db.commit()
     return u
 
 def get_user(db: Session, user_id: int):
-    return db.query(models.User).filter(models.User.id == user_id).first()
+    return db.execute(select(*_USER_COLUMNS).where(models.User.id == user_id)).first()
+
+# APPS
+def intern_apps(db: Session, package_names) -> Dict[str, int]:
+    """
+    Maps package names to their apps catalog ids, adding the names not seen
+    before. The catalog only ever grows, so an id is never reused for another name.
+    The mapping is not in package_names order: look names up in it.
+    """
+    names = list(dict.fromkeys(package_names))
+    if not names:
+        return {}
+    ids = dict(db.execute(select(models.App.package_name, models.App.id)
+                          .where(models.App.package_name.in_(names))).all())
+    missing = [n for n in names if n not in ids]
+    if missing:
+        ids.update(db.execute(
+            sqlite_insert(models.App).on_conflict_do_nothing()
+            .returning(models.App.package_name, models.App.id),
+            [{"package_name": n} for n in missing]
+        ).all())
+        # lost a race with another writer: its rows are there now
+        missing = [n for n in missing if n not in ids]
+        if missing:
+            ids.update(db.execute(select(models.App.package_name, models.App.id)
+                                  .where(models.App.package_name.in_(missing))).all())
+    return ids
 
 # SCHEDULES
+_SCHEDULE_COLUMNS = (
+    models.Schedule.id, models.Schedule.user_id, models.Schedule.label, models.Schedule.duration_minutes,
+    models.Schedule.is_active, models.Schedule.created_at,
+)
+
+def _schedule_apps(db: Session, schedule_ids: List[int]) -> Dict[int, list]:
+    """(app_id, package_name) rows of each schedule, in schedule order."""
+    apps = {sid: [] for sid in schedule_ids}
+    if schedule_ids:
+        rows = db.execute(
+            select(models.ScheduleApp.schedule_id, models.App.id, models.App.package_name)
+            .join(models.App, models.App.id == models.ScheduleApp.app_id)
+            .where(models.ScheduleApp.schedule_id.in_(schedule_ids))
+            .order_by(models.ScheduleApp.schedule_id, models.ScheduleApp.position)
+        ).all()
+        for r in rows:
+            apps[r.schedule_id].append(r)
+    return apps
+
 def create_schedule(db: Session, user_id: int, sched: schemas.ScheduleCreate):
-    s = models.Schedule(
+    s = db.execute(insert(models.Schedule).values(
         user_id=user_id,
         label=sched.label,
         duration_minutes=sched.duration_minutes,
-        apps_csv=",".join(sched.apps),
         is_active=sched.is_active
-    )
-    db.add(s); db.commit(); db.refresh(s)
-    return s
+    ).returning(*_SCHEDULE_COLUMNS)).first()
+    names = list(dict.fromkeys(sched.apps))  # the client's order, duplicates dropped
+    app_ids = intern_apps(db, names)
+    if names:
+        db.execute(insert(models.ScheduleApp.__table__), [
+            {"schedule_id": s.id, "app_id": app_ids[name], "position": i}
+            for i, name in enumerate(names)
+        ])
+    result = _schedule_dict(s, names)
+    log_changes(db, [(user_id, SCHEDULE, s.id, UPSERT, result)])
+    db.commit()
+    return result
 
 def list_schedules(db: Session, user_id: int):
-    rows = db.query(models.Schedule).filter(models.Schedule.user_id == user_id).all()
-    out = []
-    for r in rows:
-        out.append({
-            "id": r.id, "label": r.label, "duration_minutes": r.duration_minutes,
-            "apps": r.apps_csv.split(",") if r.apps_csv else [], "is_active": r.is_active,
-            "created_at": r.created_at
-        })
-    return out
+    rows = db.execute(select(*_SCHEDULE_COLUMNS).where(models.Schedule.user_id == user_id)).all()
+    apps = _schedule_apps(db, [r.id for r in rows])
+    return [_schedule_dict(r, [a.package_name for a in apps[r.id]]) for r in rows]
 
 def delete_schedule(db: Session, user_id: int, schedule_id: int):
-    s = db.query(models.Schedule).filter(models.Schedule.user_id == user_id,
-                                         models.Schedule.id == schedule_id).first()
-    if s:
-        db.delete(s); db.commit(); return True
+    deleted = db.execute(delete(models.Schedule).where(models.Schedule.user_id == user_id,
+                                                       models.Schedule.id == schedule_id)).rowcount
+    if deleted:
+        db.execute(delete(models.ScheduleApp).where(models.ScheduleApp.schedule_id == schedule_id))
+        log_changes(db, [(user_id, SCHEDULE, schedule_id, DELETE, None)])
+        db.commit(); return True
     return False
 
 # SESSIONS
+# Mutations are single INSERT/UPDATE ... RETURNING statements; they return Row
+# objects carrying _SESSION_COLUMNS, so building the response never re-reads.
+# Every UPDATE bumps version; the session registry (registry.py) is written
+# through from those rows on commit and never keeps an older version.
+_SESSION_COLUMNS = (
+    models.FocusSession.id, models.FocusSession.user_id, models.FocusSession.schedule_id,
+    models.FocusSession.start_time, models.FocusSession.end_time, models.FocusSession.paused,
+    models.FocusSession.paused_at, models.FocusSession.remaining_seconds, models.FocusSession.status,
+    models.FocusSession.version, models.FocusSession.paused_seconds, models.FocusSession.ended_at,
+)
+_NEXT_VERSION = models.FocusSession.version + 1
+
+def _get_session(db: Session, session_id: int):
+    return db.execute(select(*_SESSION_COLUMNS).where(models.FocusSession.id == session_id)).first()
+
+def _update_session(db: Session, session_id: int, where, values):
+    return db.execute(
+        update(models.FocusSession).where(models.FocusSession.id == session_id, *where)
+        .values(**values, version=_NEXT_VERSION).returning(*_SESSION_COLUMNS)
+        .execution_options(synchronize_session=False)
+    ).first()
+
 def start_session(db: Session, user_id: int, schedule_id: int, duration_minutes: int):
     now = datetime.utcnow()
     end = now + timedelta(minutes=duration_minutes)
-    s = models.FocusSession(
+    s = db.execute(insert(models.FocusSession).values(
         user_id=user_id,
         schedule_id=schedule_id,
         start_time=now,
@@ -67,96 +192,820 @@ def start_session(db: Session, user_id: int, schedule_id: int, duration_minutes:
         paused=False,
         remaining_seconds=None,
         status="running"
-    )
-    db.add(s); db.commit(); db.refresh(s)
+    ).returning(*_SESSION_COLUMNS)).first()
+    _session_changed(db, s)
+    schedule_on_commit(db, SESSION, s.id, s.end_time)
+    db.commit()
     return s
 
 def pause_session(db: Session, session_id: int):
-    s = db.query(models.FocusSession).filter(models.FocusSession.id == session_id).first()
-    if not s:
-        return None
-    if s.paused or s.status != "running":
-        return s
     now = datetime.utcnow()
-    remaining = int((s.end_time - now).total_seconds())
-    s.paused = True
-    s.paused_at = now
-    s.remaining_seconds = remaining
-    s.status = "paused"
-    db.commit(); db.refresh(s)
+    s = _update_session(db, session_id, (
+        models.FocusSession.paused == False, models.FocusSession.status == "running",
+    ), {
+        "paused": True,
+        "paused_at": now,
+        "remaining_seconds": cast((func.julianday(models.FocusSession.end_time)
+                                   - func.julianday(literal(now, DateTime))) * 86400, Integer),
+        "status": "paused",
+    })
+    if s is None:
+        # missing (None), or already paused / not running: returned unchanged
+        return _get_session(db, session_id)
+    _session_changed(db, s)
+    schedule_on_commit(db, SESSION, s.id, None)
+    db.commit()
     return s
 
 def resume_session(db: Session, session_id: int):
-    s = db.query(models.FocusSession).filter(models.FocusSession.id == session_id).first()
-    if not s:
-        return None
-    if not s.paused:
-        return s
     now = datetime.utcnow()
-    new_end = now + timedelta(seconds=s.remaining_seconds or 0)
-    s.paused = False
-    s.paused_at = None
-    s.end_time = new_end
-    s.remaining_seconds = None
-    s.status = "running"
-    db.commit(); db.refresh(s)
+    s = _update_session(db, session_id, (models.FocusSession.paused == True,), {
+        "paused": False,
+        "paused_at": None,
+        "paused_seconds": models.FocusSession.paused_seconds + cast(
+            (func.julianday(literal(now, DateTime))
+             - func.julianday(func.coalesce(models.FocusSession.paused_at, literal(now, DateTime)))) * 86400,
+            Integer),
+        "end_time": func.strftime("%Y-%m-%d %H:%M:%f", literal(now, DateTime),
+                                  func.printf("%+d seconds", func.coalesce(models.FocusSession.remaining_seconds, 0)),
+                                  type_=DateTime),
+        "remaining_seconds": None,
+        "status": "running",
+    })
+    if s is None:
+        return _get_session(db, session_id)
+    _session_changed(db, s)
+    schedule_on_commit(db, SESSION, s.id, s.end_time)
+    db.commit()
     return s
 
 def stop_session(db: Session, session_id: int):
-    s = db.query(models.FocusSession).filter(models.FocusSession.id == session_id).first()
+    s = _update_session(db, session_id, (models.FocusSession.status.in_(("running", "paused")),), {
+        "status": "stopped", "paused": False, "remaining_seconds": None, "ended_at": datetime.utcnow(),
+    })
+    if s is None:
+        # missing (None), or already stopped / finished: returned unchanged
+        return _get_session(db, session_id)
+    _sessions_ended(db, [s])
+    db.commit()
+    return s
+
+def start_session_for_user(db: Session, user_id: int, schedule_id: int, duration_minutes: int):
+    """
+    Starts a session and, if a schedule is given, blocks the schedule's apps for its duration.
+    """
+    s = start_session(db, user_id, schedule_id, duration_minutes)
+    if schedule_id:
+        apps = _schedule_apps(db, [schedule_id])[schedule_id]
+        if apps:
+            create_blocked_apps_for_session(db, user_id, [a.package_name for a in apps], duration_minutes,
+                                            app_ids={a.package_name: a.id for a in apps})
+    return s
+
+def stop_session_and_blocks(db: Session, session_id: int):
+    """
+    Stops a session and deactivates every active block of its user.
+    """
+    s = stop_session(db, session_id)
     if not s:
         return None
-    s.status = "stopped"
-    s.paused = False
-    s.remaining_seconds = None
-    db.commit(); db.refresh(s)
+    deactivate_blocks_for_user(db, s.user_id)
     return s
 
 def list_active_sessions(db: Session, user_id: int):
-    now = datetime.utcnow()
-    rows = db.query(models.FocusSession).filter(
-        models.FocusSession.user_id == user_id,
-        models.FocusSession.status == "running",
-        models.FocusSession.end_time > now
-    ).all()
-    return rows
+    """Running, not yet ended sessions of user_id, from the session registry."""
+    pending = db.info.get("sessions")
+    if pending:
+        # inside a transaction that already changed sessions (batch, group writer)
+        return session_registry.active_for_user(user_id, pending=pending)
+    session_registry.sync(db)
+    return session_registry.active_for_user(user_id)
 
 # BLOCKS
-def create_blocked_apps_for_session(db: Session, user_id: int, package_names: List[str], duration_minutes: int, app_names = None):
+# blocked_apps stores the catalog app_id; reads join apps for the package name
+_BLOCK_COLUMNS = (
+    models.BlockedApp.id, models.BlockedApp.user_id, models.App.package_name,
+    models.BlockedApp.app_name, models.BlockedApp.start_time, models.BlockedApp.end_time,
+    models.BlockedApp.is_active,
+)
+# what the deactivating UPDATEs return: enough for the change log and the rollups
+_BLOCK_END_COLUMNS = (
+    models.BlockedApp.id, models.BlockedApp.user_id, models.BlockedApp.app_id,
+    models.BlockedApp.start_time, models.BlockedApp.end_time,
+)
+
+class BlockRow(NamedTuple):
+    """A block as returned by upsert_blocks; same fields as a _BLOCK_COLUMNS row."""
+    id: int
+    user_id: int
+    package_name: str
+    app_name: Optional[str]
+    start_time: datetime
+    end_time: datetime
+    is_active: bool
+
+def _naive_utc(dt: datetime) -> datetime:
+    # stored DateTimes are naive UTC; an aware value is converted, not just stripped
+    if dt.tzinfo is None:
+        return dt
+    return dt.astimezone(timezone.utc).replace(tzinfo=None)
+
+def _merge_windows(items):
+    """
+    Groups (start, end, id, app_name) windows of one package whose windows
+    overlap or touch; yields (members, start, end) per group, by start time.
+    """
+    group = None
+    for w in sorted(items, key=lambda w: w[0]):
+        if group is not None and w[0] <= group[2]:
+            group[0].append(w)
+            group[2] = max(group[2], w[1])
+            continue
+        if group is not None:
+            yield group
+        group = [[w], w[0], w[1]]
+    if group is not None:
+        yield group
+
+def upsert_blocks(db: Session, user_id: int, windows, app_ids: Dict[str, int] = None):
+    """
+    Blocks each (package_name, app_name, start, end) window for the user; app_ids
+    maps the package names to catalog ids when the caller already has them. A
+    window that overlaps or touches one of the package's active, unexpired rows
+    widens that row to cover both (a window bridging several rows keeps the
+    lowest id and deletes the others); any other window gets a row of its own,
+    so a future-dated block and one starting now are kept apart. Expired rows
+    are left to the sweep. Returns BlockRows for the rows inserted or widened.
     """
-    Creates BlockedApp rows for given packages for given duration (from now).
+    by_pkg = {}
+    for pkg, app_name, start, end in windows:
+        by_pkg.setdefault(pkg, []).append((_naive_utc(start), _naive_utc(end), None, app_name))
+    if not by_pkg:
+        return []
+    if app_ids is None:
+        app_ids = intern_apps(db, by_pkg)
+    names = {app_ids[pkg]: pkg for pkg in by_pkg}
+    b = models.BlockedApp
+    for r in db.execute(select(b.id, b.app_id, b.app_name, b.start_time, b.end_time).where(
+            b.user_id == user_id, b.app_id.in_(names), b.is_active == True, b.end_time > datetime.utcnow())):
+        by_pkg[names[r.app_id]].append((r.start_time, r.end_time, r.id, r.app_name))
+
+    inserts, widened, absorbed = [], [], []
+    for pkg, items in by_pkg.items():
+        for members, start, end in _merge_windows(items):
+            ids = sorted(m[2] for m in members if m[2] is not None)
+            if len(ids) == len(members):
+                continue  # existing rows no window touched
+            # a name sent with this request wins over the stored one
+            app_name = (next((m[3] for m in members if m[2] is None and m[3]), None)
+                        or next((m[3] for m in members if m[3]), None))
+            if ids:
+                widened.append(BlockRow(ids[0], user_id, pkg, app_name, start, end, True))
+                absorbed.extend(ids[1:])
+            else:
+                inserts.append({"user_id": user_id, "app_id": app_ids[pkg], "app_name": app_name,
+                                "start_time": start, "end_time": end, "is_active": True})
+    if absorbed:
+        db.execute(delete(b).where(b.id.in_(absorbed)).execution_options(synchronize_session=False))
+        log_changes(db, [(user_id, BLOCK, i, DELETE, None) for i in absorbed])
+        for i in absorbed:
+            schedule_on_commit(db, BLOCK, i, None)
+    if widened:
+        # ORM bulk UPDATE by primary key: one executemany
+        db.execute(update(b), [{"id": r.id, "app_name": r.app_name, "start_time": r.start_time,
+                                "end_time": r.end_time} for r in widened])
+    rows = widened
+    if inserts:
+        rows = rows + [BlockRow(r.id, r.user_id, names[r.app_id], *r[3:]) for r in db.execute(
+            insert(b).returning(b.id, b.user_id, b.app_id, b.app_name, b.start_time, b.end_time, b.is_active),
+            inserts)]
+    _blocks_added(db, rows)
+    db.commit()
+    order = {pkg: i for i, pkg in enumerate(by_pkg)}
+    return sorted(rows, key=lambda r: (order[r.package_name], r.start_time))
+
+def create_blocked_apps_for_session(db: Session, user_id: int, package_names: List[str], duration_minutes: int, app_names = None, app_ids = None):
+    """
+    Blocks the given packages for given duration (from now).
     """
     now = datetime.utcnow()
     end = now + timedelta(minutes=duration_minutes)
-    created = []
+    windows = []
     for i, pkg in enumerate(package_names):
         app_name = None
         if app_names and len(app_names) > i:
             app_name = app_names[i]
-        # upsert active block for same package: create new row
-        b = models.BlockedApp(
-            user_id=user_id, package_name=pkg, app_name=app_name,
-            start_time=now, end_time=end, is_active=True
-        )
-        db.add(b)
-        created.append(b)
-    db.commit()
-    for c in created: db.refresh(c)
-    return created
+        windows.append((pkg, app_name, now, end))
+    return upsert_blocks(db, user_id, windows, app_ids)
+
+def create_blocks(db: Session, user_id: int, blocks: List[schemas.BlockedAppCreate]):
+    """
+    Blocks client-supplied windows (default: 25 minutes from start).
+    """
+    now = datetime.utcnow()
+    windows = []
+    for b in blocks:
+        start = b.start_time or now
+        end = b.end_time or start + timedelta(minutes=25)
+        windows.append((b.package_name, b.app_name, start, end))
+    return upsert_blocks(db, user_id, windows)
 
 def list_active_blocked_apps(db: Session, user_id: int):
     now = datetime.utcnow()
-    rows = db.query(models.BlockedApp).filter(
-        models.BlockedApp.user_id == user_id,
-        models.BlockedApp.is_active == True,
-        models.BlockedApp.end_time > now
+    rows = db.execute(
+        select(*_BLOCK_COLUMNS).join(models.App, models.App.id == models.BlockedApp.app_id).where(
+            models.BlockedApp.user_id == user_id,
+            models.BlockedApp.is_active == True,
+            models.BlockedApp.end_time > now
+        )
     ).all()
     return rows
 
-def deactivate_expired_blocks(db: Session):
+def deactivate_blocks_for_user(db: Session, user_id: int, now: datetime = None):
+    """
+    Ends every active block of a user at now (used when a session is stopped).
+    Returns the number of rows changed.
+    """
+    now = now or datetime.utcnow()
+    rows = db.execute(
+        update(models.BlockedApp)
+        .where(models.BlockedApp.user_id == user_id, models.BlockedApp.is_active == True)
+        .values(is_active=False, end_time=now)
+        .returning(*_BLOCK_END_COLUMNS)
+        .execution_options(synchronize_session=False)
+    ).all()
+    _blocks_removed(db, rows, "stopped")
+    db.commit()
+    return len(rows)
+
+# EXPIRY
+EXPIRE_CHUNK = 5000
+
+def _update_in_chunks(db: Session, model, where, values: dict, chunk_size: int, on_chunk, returning=None):
+    """
+    Runs UPDATE model SET values WHERE id IN (SELECT id ... WHERE where LIMIT chunk_size)
+    RETURNING id, user_id (or `returning`) until a chunk comes back short, committing
+    after each chunk so a large backlog never holds the SQLite write lock for long.
+    on_chunk(rows) runs before each commit. Returns the number of rows changed.
+    """
+    returning = returning or (model.id, model.user_id)
+    total = 0
+    while True:
+        due = select(model.id).where(*where).limit(chunk_size)
+        rows = db.execute(
+            update(model).where(model.id.in_(due)).values(**values)
+            .returning(*returning)
+            .execution_options(synchronize_session=False)
+        ).all()
+        on_chunk(rows)
+        db.commit()
+        total += len(rows)
+        if len(rows) < chunk_size:
+            return total
+
+def _sessions_ended(db: Session, rows):
+    for r in rows:
+        _session_changed(db, r)
+        schedule_on_commit(db, SESSION, r.id, None)
+    _record_sessions_ended(db, rows)
+
+def deactivate_expired_blocks(db: Session, chunk_size: int = EXPIRE_CHUNK):
+    """
+    Deactivates every active block whose end_time has passed.
+    Returns the number of rows changed.
+    """
+    now = datetime.utcnow()
+    where = (models.BlockedApp.is_active == True, models.BlockedApp.end_time <= now)
+    return _update_in_chunks(db, models.BlockedApp, where, {"is_active": False}, chunk_size,
+                             lambda rows: _blocks_removed(db, rows, "expired"), returning=_BLOCK_END_COLUMNS)
+
+def finish_expired_sessions(db: Session, chunk_size: int = EXPIRE_CHUNK):
+    """
+    Marks every running session whose end_time has passed as finished.
+    Returns the number of rows changed.
+    """
     now = datetime.utcnow()
-    expired = db.query(models.BlockedApp).filter(models.BlockedApp.is_active == True, models.BlockedApp.end_time <= now).all()
-    for e in expired:
-        e.is_active = False
+    where = (models.FocusSession.status == "running", models.FocusSession.end_time <= now)
+    values = {"status": "finished", "version": _NEXT_VERSION, "ended_at": models.FocusSession.end_time}
+    return _update_in_chunks(db, models.FocusSession, where, values, chunk_size,
+                             lambda rows: _sessions_ended(db, rows), returning=_SESSION_COLUMNS)
+
+def expire_blocks(db: Session, block_ids: List[int], now: datetime = None):
+    """
+    Deactivates exactly the given blocks, if they are still active and due.
+    Returns the number of rows changed.
+    """
+    if not block_ids:
+        return 0
+    now = now or datetime.utcnow()
+    rows = db.execute(
+        update(models.BlockedApp)
+        .where(models.BlockedApp.id.in_(block_ids),
+               models.BlockedApp.is_active == True,
+               models.BlockedApp.end_time <= now)
+        .values(is_active=False)
+        .returning(*_BLOCK_END_COLUMNS)
+        .execution_options(synchronize_session=False)
+    ).all()
+    _blocks_removed(db, rows, "expired")
     db.commit()
-    return expired
+    return len(rows)
+
+def finish_sessions(db: Session, session_ids: List[int], now: datetime = None):
+    """
+    Marks exactly the given sessions finished, if they are still running and due.
+    Returns the number of rows changed.
+    """
+    if not session_ids:
+        return 0
+    now = now or datetime.utcnow()
+    rows = db.execute(
+        update(models.FocusSession)
+        .where(models.FocusSession.id.in_(session_ids),
+               models.FocusSession.status == "running",
+               models.FocusSession.end_time <= now)
+        .values(status="finished", version=_NEXT_VERSION, ended_at=models.FocusSession.end_time)
+        .returning(*_SESSION_COLUMNS)
+        .execution_options(synchronize_session=False)
+    ).all()
+    _sessions_ended(db, rows)
+    db.commit()
+    return len(rows)
+
+def next_deadline(db: Session) -> Optional[datetime]:
+    """
+    Earliest end_time of any active block or running session, whichever process
+    wrote it (two index lookups).
+    """
+    blocks = db.execute(select(func.min(models.BlockedApp.end_time))
+                        .where(models.BlockedApp.is_active == True)).scalar()
+    sessions = db.execute(select(func.min(models.FocusSession.end_time))
+                          .where(models.FocusSession.status == "running")).scalar()
+    return min((d for d in (blocks, sessions) if d is not None), default=None)
+
+# HISTORY
+# Keyset pagination, newest first: sessions by id (ix_sessions_user), ended
+# blocks by (end_time, id) (ix_blocked_apps_user_active_end). A cursor is the
+# key of the last row returned, so a page costs the same however deep it is.
+HISTORY_PAGE = 50
+HISTORY_PAGE_MAX = 500
+EXPORT_WINDOW = int(os.getenv("EXPORT_WINDOW", "5000"))  # rows per read transaction
+EXPORT_YIELD_PER = 1000
+
+_HISTORY_SESSION_COLUMNS = (
+    models.FocusSession.id, models.FocusSession.user_id, models.FocusSession.schedule_id,
+    models.FocusSession.start_time, models.FocusSession.end_time, models.FocusSession.ended_at,
+    models.FocusSession.paused, models.FocusSession.paused_seconds, models.FocusSession.remaining_seconds,
+    models.FocusSession.status,
+)
+
+def _session_history(user_id: int, after: Optional[int], limit: int):
+    q = (select(*_HISTORY_SESSION_COLUMNS).where(models.FocusSession.user_id == user_id)
+         .order_by(models.FocusSession.id.desc()).limit(limit))
+    if after is not None:
+        q = q.where(models.FocusSession.id < after)
+    return q
+
+def _block_history(user_id: int, after: Optional[tuple], limit: int):
+    b = models.BlockedApp
+
+    def page(*where, order=(b.end_time.desc(), b.id.desc())):
+        return (select(*_BLOCK_COLUMNS).join(models.App, models.App.id == b.app_id)
+                .where(b.user_id == user_id, b.is_active == False, *where).order_by(*order).limit(limit))
+    if after is None:
+        return page()
+    # the rest of the rows tied at the cursor's end_time, then older ones: two
+    # index ranges. SQLite bounds (end_time, id) < (?, ?) by end_time alone, so
+    # it would walk every tied row (one deactivate_blocks_for_user ends many at once)
+    end, block_id = after
+    ties = page(b.end_time == end, b.id < block_id, order=(b.id.desc(),)).subquery()
+    older = page(b.end_time < end).subquery()
+    both = union_all(select(ties), select(older)).subquery()
+    return select(both).order_by(both.c.end_time.desc(), both.c.id.desc()).limit(limit)
+
+def _block_after(cursor: str):
+    end, _, block_id = cursor.rpartition(",")
+    return datetime.fromisoformat(end), int(block_id)
+
+class _History(NamedTuple):
+    query: Callable  # (user_id, decoded cursor or None, limit) -> Select
+    decode: Callable  # cursor -> key; ValueError if malformed
+    cursor: Callable  # last row -> cursor
+
+HISTORY = {
+    "sessions": _History(_session_history, int, lambda r: str(r.id)),
+    "blocks": _History(_block_history, _block_after, lambda r: f"{r.end_time.isoformat()},{r.id}"),
+}
+
+def decode_history_cursor(kind: str, cursor: Optional[str]):
+    """The key a cursor stands for (None for the first page); ValueError if it is malformed."""
+    return None if cursor is None else HISTORY[kind].decode(cursor)
+
+def history_page(db: Session, kind: str, user_id: int, cursor: Optional[str] = None, limit: int = HISTORY_PAGE):
+    """
+    One page of a user's "sessions" (all of them) or "blocks" (ended ones),
+    newest first. Returns (rows, next cursor or None on the last page).
+    """
+    h = HISTORY[kind]
+    rows = db.execute(h.query(user_id, decode_history_cursor(kind, cursor), limit)).all()
+    return rows, (h.cursor(rows[-1]) if len(rows) == limit else None)
+
+def export_history(session_factory: Callable[[], Session], kind: str, user_id: int,
+                   encode: Callable[[Iterator], bytes], cursor: Optional[str] = None,
+                   window: int = EXPORT_WINDOW):
+    """
+    Generator of encode(rows) chunks covering all of a user's history from
+    cursor on, for streaming. Each window of rows is read in its own short
+    transaction through a server-side cursor (yield_per) and encoded before it
+    ends, so memory stays at one window however long the history is, and no
+    read lock is held while a slow client drains the response.
+    """
+    h = HISTORY[kind]
+    after = decode_history_cursor(kind, cursor)
+    while True:
+        last, count = None, 0
+        db = session_factory()
+        try:
+            result = db.execute(h.query(user_id, after, window).execution_options(yield_per=EXPORT_YIELD_PER))
+
+            def rows():
+                nonlocal last, count
+                for last in result:
+                    count += 1
+                    yield last
+            chunk = encode(rows())
+        finally:
+            db.close()
+        if chunk:
+            yield chunk
+        if count < window:
+            return
+        after = h.decode(h.cursor(last))
+
+# STATS
+# daily_stats / daily_app_stats are only ever added to, in the transaction that
+# ends a session or block (a session ends once: stop and finish both require it
+# to be live), so a day's figures are one primary-key read. Days are UTC.
+STATS_MAX_DAYS = 366
+STATS_TOP_APPS = 10
+
+def _stats_upsert(model, keys, counters):
+    table = model.__table__
+    stmt = sqlite_insert(table)
+    return stmt.on_conflict_do_update(
+        index_elements=[table.c[k] for k in keys],
+        set_={c: table.c[c] + stmt.excluded[c] for c in counters},
+    )
+
+_UPSERT_DAILY = _stats_upsert(models.DailyStats, ("user_id", "day"),
+                              ("focus_seconds", "sessions_completed", "sessions_stopped"))
+_UPSERT_DAILY_APP = _stats_upsert(models.DailyAppStats, ("user_id", "day", "app_id"), ("blocked_seconds",))
+
+def _split_days(start: datetime, end: datetime, seconds: int) -> Dict[date, int]:
+    """Spreads seconds over the UTC days of [start, end] in proportion to the time spent in each."""
+    if seconds <= 0:
+        return {}
+    if end <= start or start.date() == end.date():
+        return {end.date(): seconds}
+    total = (end - start).total_seconds()
+    out, given, day = {}, 0, start.date()
+    while day < end.date():
+        day_end = datetime.combine(day + timedelta(days=1), datetime.min.time())
+        share = int(seconds * (day_end - max(start, datetime.combine(day, datetime.min.time()))).total_seconds() / total)
+        out[day] = share
+        given += share
+        day += timedelta(days=1)
+    out[end.date()] = seconds - given
+    return out
+
+def session_focus(r):
+    """
+    (focus seconds, end of focus) of an ended session row: wall time from start
+    to when it stopped, or to paused_at if it was stopped while paused, capped
+    at end_time, minus the paused time accumulated by resume_session.
+    """
+    ended = r.ended_at or r.end_time
+    focus_end = min(r.paused_at or ended, ended, r.end_time)
+    seconds = int((focus_end - r.start_time).total_seconds()) - (r.paused_seconds or 0)
+    return max(seconds, 0), max(focus_end, r.start_time)
+
+def _add_session_stats(totals: dict, r):
+    seconds, focus_end = session_focus(r)
+    for day, n in _split_days(r.start_time, focus_end, seconds).items():
+        totals.setdefault((r.user_id, day), [0, 0, 0])[0] += n
+    counts = totals.setdefault((r.user_id, (r.ended_at or r.end_time).date()), [0, 0, 0])
+    counts[1 if r.status == "finished" else 2] += 1
+
+def _add_block_stats(totals: dict, r):
+    seconds = int((r.end_time - r.start_time).total_seconds())
+    for day, n in _split_days(r.start_time, r.end_time, seconds).items():
+        key = (r.user_id, day, r.app_id)
+        totals[key] = totals.get(key, 0) + n
+
+def _write_session_stats(db: Session, totals: dict):
+    if totals:
+        db.execute(_UPSERT_DAILY, [
+            {"user_id": user_id, "day": day, "focus_seconds": f, "sessions_completed": c, "sessions_stopped": s}
+            for (user_id, day), (f, c, s) in totals.items()
+        ])
+
+def _write_block_stats(db: Session, totals: dict):
+    rows = [{"user_id": user_id, "day": day, "app_id": app_id, "blocked_seconds": n}
+            for (user_id, day, app_id), n in totals.items() if n > 0]
+    if rows:
+        db.execute(_UPSERT_DAILY_APP, rows)
+
+def _record_sessions_ended(db: Session, rows):
+    """Adds stopped / finished _SESSION_COLUMNS rows to the daily rollups."""
+    totals = {}
+    for r in rows:
+        _add_session_stats(totals, r)
+    _write_session_stats(db, totals)
+
+def _record_blocks_ended(db: Session, rows):
+    """Adds the blocked time of deactivated _BLOCK_END_COLUMNS rows to the daily app rollups."""
+    totals = {}
+    for r in rows:
+        _add_block_stats(totals, r)
+    _write_block_stats(db, totals)
+
+def _streaks(active_days: List[date], last: date):
+    """(streak of consecutive active days ending at `last` or the day before, longest streak)."""
+    longest = run = 0
+    prev = None
+    for day in active_days:
+        run = run + 1 if prev is not None and day - prev == timedelta(days=1) else 1
+        longest = max(longest, run)
+        prev = day
+    current = run if prev is not None and last - prev <= timedelta(days=1) else 0
+    return current, longest
+
+def get_stats(db: Session, user_id: int, start: date, end: date):
+    """
+    Focus statistics of user_id for the UTC days start..end (inclusive) from
+    the rollups: per day, per ISO week (from Monday), totals, streaks within
+    the range and the most blocked packages.
+    """
+    rows = db.execute(
+        select(models.DailyStats.day, models.DailyStats.focus_seconds,
+               models.DailyStats.sessions_completed, models.DailyStats.sessions_stopped)
+        .where(models.DailyStats.user_id == user_id, models.DailyStats.day.between(start, end))
+        .order_by(models.DailyStats.day)
+    ).all()
+    blocked = func.sum(models.DailyAppStats.blocked_seconds).label("blocked_seconds")
+    apps = db.execute(
+        select(models.App.package_name, blocked)
+        .join(models.App, models.App.id == models.DailyAppStats.app_id)
+        .where(models.DailyAppStats.user_id == user_id, models.DailyAppStats.day.between(start, end))
+        .group_by(models.DailyAppStats.app_id)
+        .order_by(blocked.desc())
+        .limit(STATS_TOP_APPS)
+    ).all()
+    days = [{"day": r.day, "focus_minutes": round(r.focus_seconds / 60, 1),
+             "sessions_completed": r.sessions_completed, "sessions_stopped": r.sessions_stopped} for r in rows]
+    weeks = {}
+    for r in rows:
+        week = r.day - timedelta(days=r.day.weekday())
+        weeks[week] = weeks.get(week, 0) + r.focus_seconds
+    current, longest = _streaks([r.day for r in rows if r.focus_seconds > 0], end)
+    return {
+        "from": start,
+        "to": end,
+        "focus_minutes": round(sum(r.focus_seconds for r in rows) / 60, 1),
+        "sessions_completed": sum(r.sessions_completed for r in rows),
+        "sessions_stopped": sum(r.sessions_stopped for r in rows),
+        "current_streak_days": current,
+        "longest_streak_days": longest,
+        "days": days,
+        "weeks": [{"week_start": w, "focus_minutes": round(n / 60, 1)} for w, n in weeks.items()],
+        "top_blocked_apps": [{"package_name": a.package_name, "blocked_minutes": round(a.blocked_seconds / 60, 1)}
+                             for a in apps],
+    }
+
+def backfill_stats(db: Session, include_archive: bool = False, chunk_size: int = 1000):
+    """
+    Rebuilds the rollups from history, chunk_size users at a time: every ended
+    session and deactivated block (and the archive.py tables when db has the
+    archive attached). Each chunk's rollups are deleted first, which takes the
+    write lock, so sessions ending meanwhile are neither lost nor counted
+    twice. Sessions ended before ended_at / paused_seconds existed (live or
+    archived) count up to their end_time, without pauses. Returns (users,
+    rollup rows written).
+    """
+    s, b = models.FocusSession, models.BlockedApp
+    session_cols = lambda t: (t.c.user_id, t.c.start_time, t.c.end_time, t.c.status,
+                              t.c.paused_at, t.c.paused_seconds, t.c.ended_at)
+    sources = [(select(*session_cols(s.__table__)).where(s.status.in_(("finished", "stopped"))), s.user_id)]
+    block_sources = [(select(b.user_id, b.app_id, b.start_time, b.end_time).where(b.is_active == False), b.user_id)]
+    if include_archive:
+        import archive
+        a = archive.sessions
+        sources.append((select(*session_cols(a)), a.c.user_id))
+        a = archive.blocked_apps
+        block_sources.append((select(a.c.user_id, a.c.app_id, a.c.start_time, a.c.end_time), a.c.user_id))
+    users = written = 0
+    last = 0
+    while True:
+        ids = db.execute(select(models.User.id).where(models.User.id > last)
+                         .order_by(models.User.id).limit(chunk_size)).scalars().all()
+        if not ids:
+            return users, written
+        db.execute(delete(models.DailyStats).where(models.DailyStats.user_id.in_(ids)))
+        db.execute(delete(models.DailyAppStats).where(models.DailyAppStats.user_id.in_(ids)))
+        sessions, blocks = {}, {}
+        for q, user_col in sources:
+            for r in db.execute(q.where(user_col.in_(ids))):
+                _add_session_stats(sessions, r)
+        for q, user_col in block_sources:
+            for r in db.execute(q.where(user_col.in_(ids))):
+                _add_block_stats(blocks, r)
+        _write_session_stats(db, sessions)
+        _write_block_stats(db, blocks)
+        db.commit()
+        users += len(ids)
+        written += len(sessions) + len(blocks)
+        last = ids[-1]
+
+# LEASES
+# Times come from SQLite's clock, so every process on the host agrees on expiry
+_DB_NOW = func.strftime("%Y-%m-%d %H:%M:%f", "now")
+
+def acquire_lease(db: Session, name: str, holder: str, ttl_seconds: int) -> bool:
+    """
+    Takes or renews lease `name` for ttl_seconds. Succeeds if the lease is free,
+    expired or already held by holder; one atomic upsert, so of several
+    processes racing for an expired lease exactly one wins.
+    """
+    stmt = sqlite_insert(models.Lease).values(
+        name=name, holder=holder, acquired_at=_DB_NOW,
+        expires_at=func.strftime("%Y-%m-%d %H:%M:%f", "now", f"+{int(ttl_seconds)} seconds"),
+    )
+    current = models.Lease
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[current.name],
+        set_={"holder": stmt.excluded.holder, "expires_at": stmt.excluded.expires_at,
+              "acquired_at": case((current.holder == stmt.excluded.holder, current.acquired_at),
+                                  else_=stmt.excluded.acquired_at)},
+        where=or_(current.holder == stmt.excluded.holder, current.expires_at < _DB_NOW),
+    ).returning(current.holder)
+    won = db.execute(stmt).scalar() == holder
+    db.commit()
+    return won
+
+def release_lease(db: Session, name: str, holder: str) -> bool:
+    """Gives up lease `name` if holder still has it, so another process can take over at once."""
+    released = db.execute(delete(models.Lease).where(models.Lease.name == name, models.Lease.holder == holder)
+                          .execution_options(synchronize_session=False)).rowcount
+    db.commit()
+    return bool(released)
+
+# CHANGE LOG (delta sync)
+SCHEDULE = "schedule"
+UPSERT, DELETE = "upsert", "delete"
+CHANGES_PAGE = 500
+CHANGE_LOG_FLOOR = "change_log_floor"  # sync_state key: highest compacted seq
+
+def log_changes(db: Session, entries):
+    """
+    Appends (user_id, entity, entity_id, op, data) entries to the change log in
+    the caller's transaction, so they commit (or roll back) with the mutation.
+    """
+    if not entries:
+        return
+    now = datetime.utcnow()
+    db.execute(insert(models.ChangeLog), [{
+        "user_id": user_id, "entity": entity, "entity_id": entity_id, "op": op,
+        "data": json.dumps(data, default=json_default) if data is not None else None,
+        "created_at": now,
+    } for user_id, entity, entity_id, op, data in entries])
+
+def _change_log_floor(db: Session) -> int:
+    state = db.get(models.SyncState, CHANGE_LOG_FLOOR)
+    return state.value if state else 0
+
+def get_changes(db: Session, user_id: int, since: Optional[int], limit: int = CHANGES_PAGE):
+    """
+    Changes for user_id after seq `since`, oldest first. Falls back to a full
+    snapshot when the cursor is unset, predates the compacted window or is ahead
+    of the log. The returned seq is the cursor for the next call.
+    """
+    floor = _change_log_floor(db)
+    head = max(db.query(func.max(models.ChangeLog.seq)).scalar() or 0, floor)
+    if since is None or since < floor or since > head:
+        return snapshot(db, user_id, head)
+    rows = db.query(
+        models.ChangeLog.seq, models.ChangeLog.entity, models.ChangeLog.entity_id,
+        models.ChangeLog.op, models.ChangeLog.data
+    ).filter(
+        models.ChangeLog.user_id == user_id,
+        models.ChangeLog.seq > since
+    ).order_by(models.ChangeLog.seq).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        "snapshot": False,
+        # entries between our last one and head belong to other users
+        "seq": rows[-1].seq if has_more else head,
+        "has_more": has_more,
+        "changes": [{
+            "seq": r.seq, "entity": r.entity, "id": r.entity_id, "op": r.op,
+            "data": json.loads(r.data) if r.data else None,
+        } for r in rows],
+    }
+
+def snapshot(db: Session, user_id: int, head: int):
+    sessions = db.execute(select(*_SESSION_COLUMNS).where(
+        models.FocusSession.user_id == user_id,
+        models.FocusSession.status.in_(("running", "paused"))
+    )).all()
+    return {
+        "snapshot": True,
+        "seq": head,
+        "has_more": False,
+        "blocks": [_block_dict(b) for b in list_active_blocked_apps(db, user_id)],
+        "sessions": [session_event(s) for s in sessions],
+        "schedules": list_schedules(db, user_id),
+    }
+
+def compact_change_log(db: Session, retain_seconds: int, chunk_size: int = EXPIRE_CHUNK):
+    """
+    Deletes change log entries older than retain_seconds in chunks and raises the
+    floor below which clients get a snapshot. Returns the number of rows deleted.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=retain_seconds)
+    through = db.query(func.max(models.ChangeLog.seq)).filter(models.ChangeLog.created_at < cutoff).scalar()
+    if not through or through <= _change_log_floor(db):
+        return 0
+    # raise the floor first so no reader is served a window with holes in it
+    db.merge(models.SyncState(key=CHANGE_LOG_FLOOR, value=through))
+    db.commit()
+    total = 0
+    while True:
+        old = select(models.ChangeLog.seq).where(models.ChangeLog.seq <= through).limit(chunk_size)
+        n = db.execute(
+            delete(models.ChangeLog).where(models.ChangeLog.seq.in_(old))
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.commit()
+        total += n
+        if n < chunk_size:
+            return total
+
+# BATCH
+BATCH_MAX_OPS = schemas.BATCH_MAX_OPS
+
+class BatchAborted(Exception):
+    """An operation of a batch failed; nothing of the batch is committed."""
+    def __init__(self, index: Optional[int], status_code: int, detail: str):
+        super().__init__(detail)
+        self.index = index
+        self.status_code = status_code
+        self.detail = detail
+
+def _op_arg(i: int, op: schemas.BatchOp, field: str):
+    value = getattr(op, field)
+    if value is None:
+        raise BatchAborted(i, 422, f"{op.op} requires {field}")
+    return value
+
+def _session_result(i: int, user_id: int, s):
+    # another user's session is "not found"; the op already ran, but raising
+    # rolls the whole batch back, so nothing of it is committed
+    if not s or s.user_id != user_id:
+        raise BatchAborted(i, 404, "Session not found")
+    return session_event(s)
+
+def _batch_create_schedule(db, user_id, i, op):
+    return create_schedule(db, user_id, _op_arg(i, op, "schedule"))
+
+def _batch_delete_schedule(db, user_id, i, op):
+    if not delete_schedule(db, user_id, _op_arg(i, op, "schedule_id")):
+        raise BatchAborted(i, 404, "Schedule not found")
+    return {"ok": True}
+
+def _batch_start_session(db, user_id, i, op):
+    return session_event(start_session_for_user(db, user_id, op.schedule_id, _op_arg(i, op, "duration_minutes")))
+
+_BATCH_OPS = {
+    "create_schedule": _batch_create_schedule,
+    "list_schedules": lambda db, user_id, i, op: list_schedules(db, user_id),
+    "delete_schedule": _batch_delete_schedule,
+    "start_session": _batch_start_session,
+    "pause_session": lambda db, user_id, i, op: _session_result(i, user_id, pause_session(db, _op_arg(i, op, "session_id"))),
+    "resume_session": lambda db, user_id, i, op: _session_result(i, user_id, resume_session(db, _op_arg(i, op, "session_id"))),
+    "stop_session": lambda db, user_id, i, op: _session_result(i, user_id, stop_session_and_blocks(db, _op_arg(i, op, "session_id"))),
+    "list_active_sessions": lambda db, user_id, i, op: [session_event(s) for s in list_active_sessions(db, user_id)],
+    "create_blocks": lambda db, user_id, i, op: [_block_dict(b) for b in create_blocks(db, user_id, _op_arg(i, op, "blocks"))],
+    "list_blocks": lambda db, user_id, i, op: [_block_dict(b) for b in list_active_blocked_apps(db, user_id)],
+}
+
+def run_batch(db: Session, user_id: int, ops: List[schemas.BatchOp]):
+    """
+    Runs ops for user_id in order, looking the user up once, and returns their
+    results in the shape of the matching routes. Meant for a session whose
+    commits only flush (writer.py), so the caller commits or rolls back the
+    whole batch; raises BatchAborted on the first failing op.
+    """
+    if get_user(db, user_id) is None:
+        raise BatchAborted(None, 404, "User not found")
+    return [_BATCH_OPS[op.op](db, user_id, i, op) for i, op in enumerate(ops)]
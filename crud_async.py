@@ -0,0 +1,105 @@
+# crud_async.py
+"""
+Awaitable variants of the crud.py functions used by the endpoints in main.py.
+
+With an AsyncSession (USE_ASYNC_DB=1) each call runs the crud.py function via
+AsyncSession.run_sync, so its queries go through the aiosqlite driver without
+tying up a worker thread per request. With a plain sync Session the same
+function runs on FastAPI's threadpool, which is exactly what the old `def`
+endpoints did. Query logic therefore lives only in crud.py.
+
+Mutations go through write(): while the group-commit writer is running
+(DB_PROFILE=production) they are queued to it, otherwise they run like reads.
+"""
+from typing import List
+from starlette.concurrency import run_in_threadpool
+import crud
+import database
+import schemas
+import writer
+
+
+async def run(db, fn, *args, **kwargs):
+    # AsyncSession (duck-typed so the sync mode never needs greenlet installed)
+    if hasattr(db, "run_sync"):
+        return await db.run_sync(fn, *args, **kwargs)
+    return await run_in_threadpool(fn, db, *args, **kwargs)
+
+async def write(db, fn, *args, **kwargs):
+    if writer.group_writer is not None:
+        return await writer.group_writer.run(fn, *args, **kwargs)
+    return await run(db, fn, *args, **kwargs)
+
+# USER
+async def get_or_create_user(db, email: str, name: str = None, picture: str = None):
+    return await write(db, crud.get_or_create_user, email, name=name, picture=picture)
+
+async def get_user(db, user_id: int):
+    return await run(db, crud.get_user, user_id)
+
+# SCHEDULES
+async def create_schedule(db, user_id: int, sched: schemas.ScheduleCreate):
+    return await write(db, crud.create_schedule, user_id, sched)
+
+async def list_schedules(db, user_id: int):
+    return await run(db, crud.list_schedules, user_id)
+
+async def delete_schedule(db, user_id: int, schedule_id: int):
+    return await write(db, crud.delete_schedule, user_id, schedule_id)
+
+# SESSIONS
+async def start_session_for_user(db, user_id: int, schedule_id: int, duration_minutes: int):
+    return await write(db, crud.start_session_for_user, user_id, schedule_id, duration_minutes)
+
+async def pause_session(db, session_id: int):
+    return await write(db, crud.pause_session, session_id)
+
+async def resume_session(db, session_id: int):
+    return await write(db, crud.resume_session, session_id)
+
+async def stop_session_and_blocks(db, session_id: int):
+    return await write(db, crud.stop_session_and_blocks, session_id)
+
+async def list_active_sessions(db, user_id: int):
+    return await run(db, crud.list_active_sessions, user_id)
+
+# BLOCKS
+async def create_blocks(db, user_id: int, blocks: List[schemas.BlockedAppCreate]):
+    return await write(db, crud.create_blocks, user_id, blocks)
+
+async def list_active_blocked_apps(db, user_id: int):
+    return await run(db, crud.list_active_blocked_apps, user_id)
+
+async def deactivate_expired_blocks():
+    # a session of its own, not the request's: main.py shares one sweep between
+    # concurrent /refresh_blocks calls and it may outlive the call that started it.
+    # Never the group writer, whose batch would turn the per-chunk commits into
+    # one long write transaction (see background.run_sweep)
+    if database.USE_ASYNC_DB:
+        async with database.AsyncSessionLocal() as db:
+            return await run(db, crud.deactivate_expired_blocks)
+    db = database.SessionLocal()
+    try:
+        return await run(db, crud.deactivate_expired_blocks)
+    finally:
+        db.close()
+
+# HISTORY
+async def history_page(db, kind: str, user_id: int, cursor, limit: int):
+    return await run(db, crud.history_page, kind, user_id, cursor, limit)
+
+# STATS
+async def get_stats(db, user_id: int, start, end):
+    return await run(db, crud.get_stats, user_id, start, end)
+
+# CHANGE LOG
+async def get_changes(db, user_id: int, since: int, limit: int):
+    return await run(db, crud.get_changes, user_id, since, limit)
+
+# BATCH
+async def run_batch(user_id: int, ops: List[schemas.BatchOp]):
+    # all-or-nothing: one group-writer job (its own savepoint), or else its own
+    # transaction on a worker thread, whichever session type the request uses
+    if writer.group_writer is not None:
+        return await writer.group_writer.run(crud.run_batch, user_id, ops)
+    return await run_in_threadpool(writer.run_in_transaction, crud.run_batch, user_id, ops)
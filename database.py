@@ -1,10 +1,51 @@
-from sqlalchemy import create_engine
+import os
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, declarative_base
+import metrics
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./focusbubble.db"
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./focusbubble.db")
+# USE_ASYNC_DB=1 serves requests through an AsyncEngine (aiosqlite) instead of
+# running the sync engine on FastAPI's threadpool
+USE_ASYNC_DB = os.getenv("USE_ASYNC_DB", "").lower() in ("1", "true", "yes")
+ASYNC_DATABASE_URL = SQLALCHEMY_DATABASE_URL.replace("sqlite://", "sqlite+aiosqlite://", 1)
+ASYNC_POOL_SIZE = int(os.getenv("ASYNC_DB_POOL_SIZE", "20"))
+# DB_PROFILE=production: WAL + tuned pragmas on every connection, and crud.py
+# writes go through the single group-commit writer in writer.py
+DB_PROFILE = os.getenv("DB_PROFILE", "default")
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"),
+    "mmap_size": os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)),
+    "cache_size": os.getenv("SQLITE_CACHE_SIZE", str(-64 * 1024)),  # negative = KiB
+}
+
+def apply_sqlite_pragmas(dbapi_connection, connection_record=None):
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
 )
+if DB_PROFILE == "production":
+    event.listen(engine, "connect", apply_sqlite_pragmas)
+metrics.instrument_engine(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
+
+async_engine = None
+AsyncSessionLocal = None
+if USE_ASYNC_DB:
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+    async_engine = create_async_engine(
+        ASYNC_DATABASE_URL, pool_size=ASYNC_POOL_SIZE, max_overflow=ASYNC_POOL_SIZE
+    )
+    if DB_PROFILE == "production":
+        event.listen(async_engine.sync_engine, "connect", apply_sqlite_pragmas)
+    metrics.instrument_engine(async_engine.sync_engine)
+    # objects are serialized after the session's last commit, outside any greenlet,
+    # so they must not expire (and lazy-load) on commit
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
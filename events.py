@@ -0,0 +1,157 @@
+# events.py
+"""
+In-process pub/sub of block-set and session-state changes, fanned out to the
+per-user streaming endpoints (SSE and WebSocket) in main.py.
+
+crud.py queues events with publish_on_commit(); they are published only when
+the transaction really commits, from whatever thread that happens on. Each
+subscriber holds a small bounded buffer: a consumer that falls behind loses the
+buffered events and receives a single "resync" event telling it to re-fetch
+state, so a slow phone never makes the server buffer without limit.
+"""
+import asyncio
+import json
+import os
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Dict, Set
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+SUBSCRIBER_BUFFER = int(os.getenv("EVENT_SUBSCRIBER_BUFFER", "32"))
+HEARTBEAT_SECONDS = float(os.getenv("EVENT_HEARTBEAT_SECONDS", "15"))
+
+RESYNC = ("resync", "{}")
+
+
+class Subscriber:
+    __slots__ = ("user_id", "buffer", "lagged", "waiter")
+
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.buffer = deque()
+        self.lagged = False
+        self.waiter = None
+
+    def push(self, item):
+        if self.lagged:
+            return
+        if len(self.buffer) >= SUBSCRIBER_BUFFER:
+            # backpressure: drop what is queued and ask the client to resync
+            self.buffer.clear()
+            self.buffer.append(RESYNC)
+            self.lagged = True
+        else:
+            self.buffer.append(item)
+        _wake(self.waiter)
+
+    async def next(self, timeout: float):
+        """Next (type, json) event, or None if nothing arrived within timeout."""
+        if not self.buffer:
+            # a bare future + timer handle: much lighter than wait_for's extra task
+            loop = asyncio.get_running_loop()
+            self.waiter = loop.create_future()
+            timer = loop.call_later(timeout, _wake, self.waiter)
+            try:
+                await self.waiter
+            finally:
+                timer.cancel()
+                self.waiter = None
+            if not self.buffer:
+                return None
+        item = self.buffer.popleft()
+        if item is RESYNC:
+            self.lagged = False
+        return item
+
+
+def _wake(waiter):
+    if waiter is not None and not waiter.done():
+        waiter.set_result(None)
+
+
+class EventHub:
+    def __init__(self):
+        self._subs: Dict[int, Set[Subscriber]] = {}
+        self._loop = None
+        self._loop_thread = None
+        self.published = 0
+        self.dropped = 0
+
+    def bind(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+        self._loop_thread = threading.get_ident()
+
+    def subscribe(self, user_id: int) -> Subscriber:
+        sub = Subscriber(user_id)
+        self._subs.setdefault(user_id, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscriber):
+        subs = self._subs.get(sub.user_id)
+        if subs is not None:
+            subs.discard(sub)
+            if not subs:
+                del self._subs[sub.user_id]
+
+    def connections(self) -> int:
+        return sum(len(s) for s in self._subs.values())
+
+    def publish(self, events):
+        """events: iterable of (user_id, type, data). Safe to call from any thread."""
+        encoded = [(user_id, (etype, json.dumps(data, default=json_default)))
+                   for user_id, etype, data in events if user_id in self._subs]
+        if not encoded or self._loop is None or self._loop.is_closed():
+            return
+        if threading.get_ident() == self._loop_thread:
+            self._deliver(encoded)
+        else:
+            try:
+                self._loop.call_soon_threadsafe(self._deliver, encoded)
+            except RuntimeError:
+                pass
+
+    def _deliver(self, encoded):
+        for user_id, item in encoded:
+            self.published += 1
+            for sub in self._subs.get(user_id, ()):
+                if sub.lagged:
+                    self.dropped += 1
+                sub.push(item)
+
+
+hub = EventHub()
+
+
+def json_default(o):
+    return o.isoformat() if isinstance(o, datetime) else str(o)
+
+
+def publish_on_commit(db: Session, user_id: int, etype: str, data: dict):
+    """Queue an event for user_id; it is published once db's transaction commits."""
+    db.info.setdefault("events", []).append((user_id, etype, data))
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(db):
+    events = db.info.pop("events", None)
+    if events:
+        hub.publish(events)
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(db):
+    db.info.pop("events", None)
+
+
+def sse_frame(item) -> bytes:
+    etype, data = item
+    return f"event: {etype}\ndata: {data}\n\n".encode()
+
+
+def session_event(s) -> dict:
+    return {"id": s.id, "user_id": s.user_id, "schedule_id": s.schedule_id, "start_time": s.start_time,
+            "end_time": s.end_time, "paused": s.paused, "remaining_seconds": s.remaining_seconds,
+            "status": s.status}
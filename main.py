@@ -1,18 +1,31 @@
 # main.py
-from fastapi import FastAPI, Depends, HTTPException, BackgroundTasks
+from fastapi import FastAPI, Depends, HTTPException, BackgroundTasks, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from typing import List
-from datetime import datetime
+from starlette.concurrency import run_in_threadpool
+from typing import List, Literal, Optional
+from datetime import date, datetime, timedelta
 import asyncio
+import logging
 import os
-from dotenv import load_dotenv
-from database import SessionLocal, engine, Base
+import database
+from database import SessionLocal
 import models
 import schemas
 import crud
+import crud_async
 import auth
-from background import expiry_loop
+import migrate
+import writer
+import metrics
+import admission
+from cache import block_cache, etag_matches
+from events import hub, sse_frame, HEARTBEAT_SECONDS
+from background import expiry_loop, expiry_lease, run_read, archive_loop
+import archive
+from registry import session_registry
+from scheduler import expiry_scheduler
+from serialization import FastJSONResponse, model_response, list_response, project, ndjson, csv_header, csv_rows
 
 # Load environment variables manually
 def load_env_file():
@@ -27,11 +40,19 @@ def load_env_file():
 
 load_env_file()
 
-# create tables
-Base.metadata.create_all(bind=engine)
+logger = logging.getLogger("focusbubble.main")
 
-app = FastAPI(title="FocusBubble Backend")
+# schema changes are a deploy step (python manage.py migrate), not something
+# every worker does on import; MIGRATE_ON_STARTUP=1 migrates in startup instead
+MIGRATE_ON_STARTUP = os.getenv("MIGRATE_ON_STARTUP", "").lower() in ("1", "true", "yes")
 
+# routes return trusted rows through serialization.py, so response_model only
+# documents the shape; everything else is rendered with orjson
+app = FastAPI(title="FocusBubble Backend", default_response_class=FastJSONResponse)
+
+# innermost: rate limits and the write gate see matched routes, and 429/503s still get CORS headers
+if admission.ADMISSION_ENABLED:
+    app.add_middleware(admission.AdmissionMiddleware, routes=app.router.routes)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -39,9 +60,34 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-
-# Dependency
-def get_db():
+# outermost, so latency includes CORS handling
+if metrics.METRICS_ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware)
+
+metrics.sampled("block_cache_hits_total", "GET /users/{id}/blocks cache hits.", lambda: block_cache.hits, "counter")
+metrics.sampled("block_cache_misses_total", "GET /users/{id}/blocks cache misses.", lambda: block_cache.misses, "counter")
+metrics.sampled("event_stream_connections", "Open SSE/WebSocket subscribers.", hub.connections)
+metrics.sampled("expiry_leader", "1 while this worker holds the expiry lease.", lambda: int(expiry_lease.held()))
+metrics.sampled("session_registry_sessions", "Running/paused sessions held by the session registry.",
+                lambda: len(session_registry))
+metrics.sampled("session_registry_reloads_total", "Full reloads of the session registry.",
+                lambda: session_registry.reloads, "counter")
+metrics.sampled("expiry_scheduled_deadlines", "Deadlines held by the expiry scheduler.", lambda: len(expiry_scheduler))
+metrics.sampled("admission_writes_in_flight", "Write requests admitted and not finished.",
+                lambda: admission.write_gate.active)
+metrics.sampled("admission_writes_queued", "Write requests waiting for a slot.", admission.write_gate.waiting)
+metrics.sampled("group_commit_batches_total", "Transactions committed by the group writer.",
+                lambda: writer.group_writer.batches if writer.group_writer else None, "counter")
+metrics.sampled("group_commit_jobs_total", "Mutations committed by the group writer.",
+                lambda: writer.group_writer.jobs if writer.group_writer else None, "counter")
+
+# Dependency: an AsyncSession when USE_ASYNC_DB is set, otherwise a sync Session
+# whose crud calls crud_async runs on the threadpool
+async def get_db():
+    if database.USE_ASYNC_DB:
+        async with database.AsyncSessionLocal() as db:
+            yield db
+        return
     db = SessionLocal()
     try:
         yield db
@@ -57,9 +103,41 @@ async def startup_event():
     if env_cid:
         auth.GOOGLE_CLIENT_ID = env_cid
 
-    # start expiry loop
+    if MIGRATE_ON_STARTUP:
+        await run_in_threadpool(migrate.upgrade)
+    else:
+        migrate.check()
+
+    # production profile: all crud.py writes go through one group-commit writer
+    if database.DB_PROFILE == "production":
+        writer.start()
+
+    # change events from crud.py are fanned out on this loop
+    hub.bind(asyncio.get_running_loop())
+
+    # running/paused sessions served from memory (crud.list_active_sessions)
+    loaded = await run_read(session_registry.load)
+    logger.info(f"Session registry loaded {loaded} live sessions.")
+    if block_cache.sync_enabled:
+        await run_read(block_cache.sync)  # the change_log baseline for the block cache
+
+    # start expiry loop (deadline-driven, with a periodic DB reconcile pass)
+    reconcile_seconds = int(os.getenv("EXPIRY_RECONCILE_SECONDS", "300"))
     loop = asyncio.get_event_loop()
-    loop.create_task(expiry_loop(30))
+    loop.create_task(expiry_loop(reconcile_seconds))
+
+    # move old expired blocks / ended sessions to the archive file (archive.py)
+    if archive.ARCHIVE_INTERVAL_SECONDS > 0:
+        loop.create_task(archive_loop(archive.ARCHIVE_INTERVAL_SECONDS))
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # hand the expiry lease over now rather than after it times out
+    try:
+        await expiry_lease.release()
+    except Exception as e:
+        logger.warning(f"Could not release the expiry lease: {e}")
+    writer.stop()
 
 
 # Health
@@ -67,6 +145,11 @@ async def startup_event():
 def health():
     return {"ok": True, "time": datetime.utcnow().isoformat()}
 
+# Prometheus scrape endpoint (text exposition format 0.0.4)
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 # Test endpoint to verify Android connectivity
 @app.post("/test/echo")
 def test_echo(data: dict):
@@ -75,145 +158,254 @@ def test_echo(data: dict):
 
 # AUTH: verify google token and create/get user
 @app.post("/auth/google", response_model=schemas.UserOut)
-def google_sign_in(token_in: schemas.TokenIn, db: Session = Depends(get_db)):
-    payload = auth.verify_google_token(token_in.id_token)
+async def google_sign_in(token_in: schemas.TokenIn, db = Depends(get_db)):
+    payload = await run_in_threadpool(auth.verify_google_token, token_in.id_token)
     # payload has keys: email, name, picture etc
     email = payload.get("email")
     name = payload.get("name")
     picture = payload.get("picture")
     if not email:
         raise HTTPException(status_code=400, detail="Google token missing email")
-    user = crud.get_or_create_user(db, email=email, name=name, picture=picture)
-    return user
+    user = await crud_async.get_or_create_user(db, email=email, name=name, picture=picture)
+    return model_response(user, schemas.UserOut)
 
 
 # USERS
 @app.post("/users", response_model=schemas.UserOut)
-def create_user(user_in: schemas.UserCreate, db: Session = Depends(get_db)):
-    user = crud.get_or_create_user(db, email=user_in.email, name=user_in.name, picture=user_in.picture)
-    return user
+async def create_user(user_in: schemas.UserCreate, db = Depends(get_db)):
+    user = await crud_async.get_or_create_user(db, email=user_in.email, name=user_in.name, picture=user_in.picture)
+    return model_response(user, schemas.UserOut)
 
 @app.get("/users/{user_id}", response_model=schemas.UserOut)
-def get_user(user_id: int, db: Session = Depends(get_db)):
-    u = crud.get_user(db, user_id)
+async def get_user(user_id: int, db = Depends(get_db)):
+    u = await crud_async.get_user(db, user_id)
     if not u:
         raise HTTPException(status_code=404, detail="User not found")
-    return u
+    return model_response(u, schemas.UserOut)
 
 
 # SCHEDULES
 @app.post("/users/{user_id}/schedules", response_model=schemas.ScheduleOut)
-def create_schedule_for_user(user_id:int, s_in: schemas.ScheduleCreate, db: Session = Depends(get_db)):
-    user = crud.get_user(db, user_id)
+async def create_schedule_for_user(user_id:int, s_in: schemas.ScheduleCreate, db = Depends(get_db)):
+    user = await crud_async.get_user(db, user_id)
     if not user: raise HTTPException(status_code=404, detail="User not found")
-    s = crud.create_schedule(db, user_id, s_in)
-    return {
-        "id": s.id, "label": s.label, "duration_minutes": s.duration_minutes,
-        "apps": s.apps_csv.split(",") if s.apps_csv else [], "is_active": s.is_active,
-        "created_at": s.created_at
-    }
+    return FastJSONResponse(await crud_async.create_schedule(db, user_id, s_in))
 
-@app.get("/users/{user_id}/schedules")
-def list_schedules_for_user(user_id:int, db: Session = Depends(get_db)):
-    return crud.list_schedules(db, user_id)
+@app.get("/users/{user_id}/schedules", response_model=List[schemas.ScheduleOut])
+async def list_schedules_for_user(user_id:int, db = Depends(get_db)):
+    return FastJSONResponse(await crud_async.list_schedules(db, user_id))
 
 @app.delete("/users/{user_id}/schedules/{schedule_id}")
-def delete_schedule_for_user(user_id:int, schedule_id:int, db: Session = Depends(get_db)):
-    ok = crud.delete_schedule(db, user_id, schedule_id)
+async def delete_schedule_for_user(user_id:int, schedule_id:int, db = Depends(get_db)):
+    ok = await crud_async.delete_schedule(db, user_id, schedule_id)
     if not ok: raise HTTPException(status_code=404, detail="Schedule not found")
     return {"ok": True}
 
 
 # SESSIONS (start/pause/resume/stop)
 @app.post("/users/{user_id}/sessions", response_model=schemas.SessionOut)
-def start_session_for_user(user_id:int, body: schemas.SessionCreate, db: Session = Depends(get_db)):
-    user = crud.get_user(db, user_id)
+async def start_session_for_user(user_id:int, body: schemas.SessionCreate, db = Depends(get_db)):
+    user = await crud_async.get_user(db, user_id)
     if not user: raise HTTPException(status_code=404, detail="User not found")
 
-    # Create session
-    session = crud.start_session(db, user_id, body.schedule_id, body.duration_minutes)
-
-    # create blocked apps entries for selected schedule if schedule provided
-    if body.schedule_id:
-        sched = db.query(models.Schedule).filter(models.Schedule.id == body.schedule_id).first()
-        if sched and sched.apps_csv:
-            pkgs = sched.apps_csv.split(",")
-            crud.create_blocked_apps_for_session(db, user_id, pkgs, body.duration_minutes)
-
-    return session
+    # Create session (and blocked apps entries for the selected schedule if provided)
+    session = await crud_async.start_session_for_user(db, user_id, body.schedule_id, body.duration_minutes)
+    return model_response(session, schemas.SessionOut)
 
 @app.post("/sessions/{session_id}/pause", response_model=schemas.SessionOut)
-def pause_session(session_id:int, db: Session = Depends(get_db)):
-    s = crud.pause_session(db, session_id)
+async def pause_session(session_id:int, db = Depends(get_db)):
+    s = await crud_async.pause_session(db, session_id)
     if not s: raise HTTPException(status_code=404, detail="Session not found")
-    return s
+    return model_response(s, schemas.SessionOut)
 
 @app.post("/sessions/{session_id}/resume", response_model=schemas.SessionOut)
-def resume_session(session_id:int, db: Session = Depends(get_db)):
-    s = crud.resume_session(db, session_id)
+async def resume_session(session_id:int, db = Depends(get_db)):
+    s = await crud_async.resume_session(db, session_id)
     if not s: raise HTTPException(status_code=404, detail="Session not found")
-    return s
+    return model_response(s, schemas.SessionOut)
 
 @app.post("/sessions/{session_id}/stop", response_model=schemas.SessionOut)
-def stop_session(session_id:int, db: Session = Depends(get_db)):
-    s = crud.stop_session(db, session_id)
+async def stop_session(session_id:int, db = Depends(get_db)):
+    # Also deactivates blocked apps for that user which are active
+    s = await crud_async.stop_session_and_blocks(db, session_id)
     if not s: raise HTTPException(status_code=404, detail="Session not found")
-    # Also deactivate blocked apps for that user which are active and end_time > now
-    from datetime import datetime
-    now = datetime.utcnow()
-    blocks = db.query(models.BlockedApp).filter(models.BlockedApp.user_id == s.user_id, models.BlockedApp.is_active == True).all()
-    for b in blocks:
-        b.is_active = False
-        b.end_time = now
-    db.commit()
-    return s
+    return model_response(s, schemas.SessionOut)
 
 @app.get("/users/{user_id}/sessions/active")
-def list_active_sessions_for_user(user_id:int, db: Session = Depends(get_db)):
-    rows = crud.list_active_sessions(db, user_id)
-    return rows
+async def list_active_sessions_for_user(user_id:int, db = Depends(get_db)):
+    rows = await crud_async.list_active_sessions(db, user_id)
+    return FastJSONResponse([s.to_dict() for s in rows])
 
 
 # BLOCKED APPS endpoints
 @app.post("/users/{user_id}/blocks", response_model=List[schemas.BlockedAppOut])
-def create_blocks(user_id:int, body: List[schemas.BlockedAppCreate], db: Session = Depends(get_db)):
-    user = crud.get_user(db, user_id)
+async def create_blocks(user_id:int, body: List[schemas.BlockedAppCreate], db = Depends(get_db)):
+    user = await crud_async.get_user(db, user_id)
     if not user: raise HTTPException(status_code=404, detail="User not found")
-    created = []
-    for b in body:
-        start = b.start_time or datetime.utcnow()
-        end = b.end_time
-        if not end:
-            from datetime import timedelta
-            end = start + timedelta(minutes=25)
-        # create directly in DB
-        row = models.BlockedApp(
-            user_id=user_id,
-            package_name=b.package_name,
-            app_name=b.app_name,
-            start_time=start,
-            end_time=end,
-            is_active=True
-        )
-        db.add(row); created.append(row)
-    db.commit()
-    for c in created: db.refresh(c)
-    result = [{
-        "id": c.id,
-        "package_name": c.package_name,
-        "app_name": c.app_name,
-        "start_time": c.start_time,
-        "end_time": c.end_time,
-        "is_active": c.is_active
-    } for c in created]
-    return result
+    created = await crud_async.create_blocks(db, user_id, body)
+    return list_response(created, schemas.BlockedAppOut)
 
 @app.get("/users/{user_id}/blocks", response_model=List[schemas.BlockedAppOut])
-def get_active_blocks(user_id:int, db: Session = Depends(get_db)):
-    rows = crud.list_active_blocked_apps(db, user_id)
-    return rows
+async def get_active_blocks(user_id:int, request: Request, db = Depends(get_db)):
+    # served from the per-user cache; unchanged polls get 304 without touching the DB
+    if block_cache.sync_due():
+        # drop entries other workers' writes made stale (at most every BLOCK_CACHE_SYNC_SECONDS)
+        await crud_async.run(db, block_cache.sync)
+    entry = block_cache.get(user_id)
+    if entry is None:
+        seen = block_cache.version(user_id)
+        rows = await crud_async.list_active_blocked_apps(db, user_id)
+        entry = block_cache.put(user_id, seen, rows)
+    headers = {"ETag": entry.etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), entry.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
+
+# HISTORY: keyset pages, or the whole history streamed as NDJSON / CSV
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+def _export(kind: str, user_id: int, cursor: Optional[str], fmt: str, model):
+    if fmt == "csv":
+        encode = lambda rows: csv_rows(rows, model)
+        head = [csv_header(model)]
+    else:
+        encode = lambda rows: ndjson(rows, model)
+        head = []
+
+    def body():
+        yield from head
+        # its own sessions, one short transaction per window (crud.export_history)
+        yield from crud.export_history(SessionLocal, kind, user_id, encode, cursor)
+
+    filename = f"{kind}-{user_id}.{fmt}"
+    return StreamingResponse(body(), media_type=EXPORT_MEDIA_TYPES[fmt],
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+async def _history(kind: str, user_id: int, cursor: Optional[str], limit: int, fmt: Optional[str], model, db):
+    try:
+        crud.decode_history_cursor(kind, cursor)
+    except ValueError:
+        raise HTTPException(status_code=422, detail="Invalid cursor")
+    if fmt is not None:
+        return _export(kind, user_id, cursor, fmt, model)
+    rows, next_cursor = await crud_async.history_page(db, kind, user_id, cursor, limit)
+    return FastJSONResponse({"items": [project(r, model) for r in rows], "next_cursor": next_cursor})
+
+@app.get("/users/{user_id}/sessions", response_model=schemas.SessionPage)
+async def session_history(user_id:int, cursor: Optional[str] = None,
+                          limit:int = Query(crud.HISTORY_PAGE, ge=1, le=crud.HISTORY_PAGE_MAX),
+                          fmt: Optional[Literal["ndjson", "csv"]] = Query(None, alias="format"),
+                          db = Depends(get_db)):
+    """
+    The user's sessions, newest first, `limit` per page: pass next_cursor back
+    as `cursor` for the next one. With format=ndjson|csv, streams every session
+    from `cursor` on instead.
+    """
+    return await _history("sessions", user_id, cursor, limit, fmt, schemas.SessionHistoryOut, db)
+
+@app.get("/users/{user_id}/blocks/history", response_model=schemas.BlockPage)
+async def block_history(user_id:int, cursor: Optional[str] = None,
+                        limit:int = Query(crud.HISTORY_PAGE, ge=1, le=crud.HISTORY_PAGE_MAX),
+                        fmt: Optional[Literal["ndjson", "csv"]] = Query(None, alias="format"),
+                        db = Depends(get_db)):
+    """Like GET /users/{user_id}/sessions, for blocks that have ended, latest end first."""
+    return await _history("blocks", user_id, cursor, limit, fmt, schemas.BlockedAppOut, db)
+
+# BATCH: several operations for one user in a single round-trip and transaction
+@app.post("/batch")
+async def run_batch(body: schemas.BatchIn):
+    """
+    Runs body.ops in order for body.user_id and returns {"results": [...]}, one
+    entry per op shaped like the matching route's response. All-or-nothing: the
+    first failing op rolls back the whole batch and its error names the op index.
+    """
+    try:
+        results = await crud_async.run_batch(body.user_id, body.ops)
+    except crud.BatchAborted as e:
+        raise HTTPException(status_code=e.status_code, detail={"index": e.index, "detail": e.detail})
+    return FastJSONResponse({"results": results})
+
+# STATS
+@app.get("/users/{user_id}/stats", response_model=schemas.StatsOut)
+async def get_stats(user_id:int, from_: Optional[date] = Query(None, alias="from"), to: Optional[date] = None,
+                    db = Depends(get_db)):
+    """
+    Focus minutes per day and week, completed vs stopped sessions, streaks and
+    the most blocked packages for the UTC days from..to (default: the last 7).
+    """
+    to = to or datetime.utcnow().date()
+    from_ = from_ or to - timedelta(days=6)
+    if from_ > to or (to - from_).days >= crud.STATS_MAX_DAYS:
+        raise HTTPException(status_code=422, detail=f"from..to must be 1 to {crud.STATS_MAX_DAYS} days")
+    return FastJSONResponse(await crud_async.get_stats(db, user_id, from_, to))
+
+# DELTA SYNC
+@app.get("/users/{user_id}/changes")
+async def get_changes(user_id:int, since: Optional[int] = None, limit:int = Query(crud.CHANGES_PAGE, ge=1, le=1000), db = Depends(get_db)):
+    """
+    Changes to the user's blocks, sessions and schedules after `since`; pass the
+    returned seq back as the next cursor. Returns a full snapshot instead when the
+    cursor is missing or older than the retained window.
+    """
+    return FastJSONResponse(await crud_async.get_changes(db, user_id, since, limit))
+
+# concurrent calls join the sweep already running instead of queueing one each
+refresh_sweep = admission.SingleFlight()
 
 @app.post("/refresh_blocks")
-def refresh_blocks(db: Session = Depends(get_db)):
-    expired = crud.deactivate_expired_blocks(db)
-    return {"expired": len(expired)}
\ No newline at end of file
+async def refresh_blocks():
+    expired = await refresh_sweep.run(crud_async.deactivate_expired_blocks)
+    return {"expired": expired}
+
+
+# STREAMING: push block-set and session changes instead of client polling
+@app.get("/users/{user_id}/events")
+async def stream_events(user_id:int):
+    """
+    Server-Sent Events: `event: blocks` / `event: session` frames, a comment
+    heartbeat every HEARTBEAT_SECONDS and `event: resync` if the client fell behind.
+    """
+    sub = hub.subscribe(user_id)
+
+    async def frames():
+        try:
+            yield b"retry: 5000\n\n"
+            while True:
+                item = await sub.next(HEARTBEAT_SECONDS)
+                yield sse_frame(item) if item is not None else b": ping\n\n"
+        finally:
+            hub.unsubscribe(sub)
+
+    return StreamingResponse(frames(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+async def _ws_send(websocket: WebSocket, sub):
+    try:
+        while True:
+            item = await sub.next(HEARTBEAT_SECONDS)
+            if item is None:
+                await websocket.send_text('{"type": "ping"}')
+            else:
+                await websocket.send_text(f'{{"type": "{item[0]}", "data": {item[1]}}}')
+    except WebSocketDisconnect:
+        pass
+
+async def _ws_receive(websocket: WebSocket):
+    # client frames are ignored; receiving is what notices a close frame or a dropped connection
+    while (await websocket.receive())["type"] != "websocket.disconnect":
+        pass
+
+@app.websocket("/users/{user_id}/ws")
+async def ws_events(websocket: WebSocket, user_id:int):
+    await websocket.accept()
+    sub = hub.subscribe(user_id)
+    tasks = (asyncio.ensure_future(_ws_receive(websocket)), asyncio.ensure_future(_ws_send(websocket, sub)))
+    try:
+        # the client going away ends the receiver at once, not at the next heartbeat
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        hub.unsubscribe(sub)
+        for task in tasks:
+            task.cancel()
+    for task in done:
+        task.result()
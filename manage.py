@@ -0,0 +1,171 @@
+# manage.py
+"""
+Maintenance commands. Run from the repo root:
+
+    python manage.py migrate [revision]
+    python manage.py compact-blocks [--dry-run]
+    python manage.py archive [--retention-days N] [--no-vacuum]
+    python manage.py enable-incremental-vacuum
+    python manage.py backfill-stats
+"""
+import argparse
+import logging
+import os
+
+from sqlalchemy import select, update, delete, func
+
+import archive
+import crud
+import migrate
+import models
+import database
+from database import SessionLocal
+
+CHUNK = 5000
+
+
+def cmd_migrate(args):
+    migrate.upgrade(args.revision)
+
+
+def _merge_block_intervals(db):
+    """
+    Streams blocked_apps ordered by (user_id, app_id, start_time) and merges
+    rows whose windows overlap or touch. Returns (row_count, deletes, updates) where
+    updates maps the surviving id to its merged values.
+    """
+    cols = (models.BlockedApp.id, models.BlockedApp.user_id, models.BlockedApp.app_id,
+            models.BlockedApp.app_name, models.BlockedApp.start_time, models.BlockedApp.end_time,
+            models.BlockedApp.is_active)
+    q = select(*cols).order_by(models.BlockedApp.user_id, models.BlockedApp.app_id,
+                               models.BlockedApp.start_time)
+    deletes, updates = [], {}
+    count = 0
+    group = None  # [members, start, end]
+
+    def close(group):
+        members, start, end = group
+        if len(members) == 1:
+            return
+        # keep the active row if there is one: clients may hold its id
+        keep = next((m for m in members if m.is_active), members[0])
+        deletes.extend(m.id for m in members if m.id != keep.id)
+        updates[keep.id] = {
+            "start_time": start, "end_time": end,
+            "app_name": keep.app_name or next((m.app_name for m in members if m.app_name), None),
+            "is_active": any(m.is_active for m in members),
+        }
+
+    for row in db.execute(q.execution_options(yield_per=CHUNK)):
+        count += 1
+        if (group is not None and (row.user_id, row.app_id) == (group[0][0].user_id, group[0][0].app_id)
+                and row.start_time <= group[2]):
+            group[0].append(row)
+            group[2] = max(group[2], row.end_time)
+            continue
+        if group is not None:
+            close(group)
+        group = [[row], row.start_time, row.end_time]
+    if group is not None:
+        close(group)
+    return count, deletes, updates
+
+
+def cmd_compact_blocks(args):
+    """
+    One-off compaction of duplicate BlockedApp rows left by the old
+    append-a-row-per-session behaviour: overlapping windows of the same package
+    are merged into one row. Clients are pushed to a full re-sync afterwards.
+    """
+    db = SessionLocal()
+    try:
+        count, deletes, updates = _merge_block_intervals(db)
+        db.rollback()
+        print(f"blocked_apps: {count} rows, {len(deletes)} to delete, {len(updates)} to widen")
+        if args.dry_run or not deletes:
+            return
+        for i in range(0, len(deletes), CHUNK):
+            db.execute(delete(models.BlockedApp).where(models.BlockedApp.id.in_(deletes[i:i + CHUNK]))
+                       .execution_options(synchronize_session=False))
+            db.commit()
+        items = list(updates.items())
+        for i in range(0, len(items), CHUNK):
+            for block_id, values in items[i:i + CHUNK]:
+                db.execute(update(models.BlockedApp).where(models.BlockedApp.id == block_id).values(**values)
+                           .execution_options(synchronize_session=False))
+            db.commit()
+        # cached cursors may reference deleted rows: make every client snapshot
+        head = db.query(func.max(models.ChangeLog.seq)).scalar() or 0
+        db.merge(models.SyncState(key=crud.CHANGE_LOG_FLOOR, value=head))
+        db.commit()
+        print(f"blocked_apps: {count - len(deletes)} rows after compaction")
+    finally:
+        db.close()
+
+
+def cmd_archive(args):
+    """One archival pass now (archive.py), whatever ARCHIVE_INTERVAL_SECONDS says."""
+    if archive.archive_path() is None:
+        raise SystemExit("in-memory database: nothing to archive")
+    engine = archive.make_engine()
+    try:
+        result = archive.run(engine, retention_days=args.retention_days, vacuum=not args.no_vacuum)
+    finally:
+        engine.dispose()
+    print(f"archived {result['blocked_apps']} blocked_apps and {result['sessions']} sessions rows "
+          f"to {archive.archive_path()}, reclaimed {result['reclaimed_bytes'] or 0} bytes")
+
+
+def cmd_enable_incremental_vacuum(args):
+    """
+    Databases created before auto_vacuum=INCREMENTAL became the default need one
+    full VACUUM to switch; it rewrites the file, so run it with the app stopped.
+    """
+    mode = archive.enable_incremental_vacuum()
+    print(f"auto_vacuum={mode} (2 = incremental)")
+
+
+def cmd_backfill_stats(args):
+    """
+    Rebuilds daily_stats / daily_app_stats from every ended session and
+    expired block, including the archived ones when the archive file exists.
+    Safe to run with the app up; needed once after migration 0009.
+    """
+    path = archive.archive_path()
+    with_archive = path is not None and os.path.exists(path)
+    engine = archive.make_engine() if with_archive else database.engine
+    db = SessionLocal(bind=engine)
+    try:
+        users, rows = crud.backfill_stats(db, include_archive=with_archive)
+    finally:
+        db.close()
+        if with_archive:
+            engine.dispose()
+    print(f"stats rebuilt for {users} users: {rows} daily rows"
+          + (f" (including {path})" if with_archive else ""))
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = ap.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("migrate", help="apply Alembic migrations")
+    p.add_argument("revision", nargs="?", default="head")
+    p.set_defaults(func=cmd_migrate)
+    p = sub.add_parser("compact-blocks", help="merge overlapping duplicate blocked_apps rows")
+    p.add_argument("--dry-run", action="store_true")
+    p.set_defaults(func=cmd_compact_blocks)
+    p = sub.add_parser("archive", help="move old expired blocks and ended sessions to the archive database")
+    p.add_argument("--retention-days", type=float, default=archive.ARCHIVE_RETENTION_DAYS)
+    p.add_argument("--no-vacuum", action="store_true", help="skip the incremental VACUUM afterwards")
+    p.set_defaults(func=cmd_archive)
+    p = sub.add_parser("enable-incremental-vacuum", help="switch the database to auto_vacuum=INCREMENTAL")
+    p.set_defaults(func=cmd_enable_incremental_vacuum)
+    p = sub.add_parser("backfill-stats", help="rebuild the daily focus statistics from history")
+    p.set_defaults(func=cmd_backfill_stats)
+    args = ap.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
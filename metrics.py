@@ -0,0 +1,236 @@
+# metrics.py
+"""
+In-process request/DB instrumentation exposed as Prometheus text on GET /metrics.
+
+MetricsMiddleware times every HTTP request per route template and, through a
+per-request RequestStats held in a ContextVar, counts the SQL statements and DB
+time the request caused (the ContextVar follows the request onto FastAPI's
+threadpool, into AsyncSession.run_sync and onto the group-commit writer).
+Requests slower than SLOW_REQUEST_MS and statements slower than SLOW_QUERY_MS
+are logged. METRICS_ENABLED=0 leaves the middleware and engine hooks out.
+"""
+import bisect
+import contextvars
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+
+logger = logging.getLogger("focusbubble.metrics")
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1").lower() not in ("0", "false", "no")
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_MS", "500")) / 1000
+SLOW_QUERY_SECONDS = float(os.getenv("SLOW_QUERY_MS", "100")) / 1000
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+COUNT_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128)
+RUN_BUCKETS = (0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0, 900.0)
+
+
+def _labels(names: Sequence[str], values: Tuple) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, values)) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_labels(self.labels, key)} {value:.15g}"
+
+
+class Histogram:
+    """Fixed-bucket histogram; observe() is one bisect and a locked increment."""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple, list] = {}  # labels -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            series[i] += 1
+            series[-1] += value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._series.items())
+        for key, series in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + ("+Inf",), series):
+                cumulative += n
+                le = bound if isinstance(bound, str) else f"{bound:g}"
+                yield f"{self.name}_bucket{_labels(self.labels + ('le',), key + (le,))} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labels, key)} {series[-1]:.6f}"
+            yield f"{self.name}_count{_labels(self.labels, key)} {cumulative}"
+
+
+class Sampled:
+    """A gauge or counter read from fn() at scrape time (e.g. a cache's hit count)."""
+
+    def __init__(self, name: str, help: str, kind: str, fn: Callable[[], Optional[float]]):
+        self.name, self.help, self.kind, self.fn = name, help, kind, fn
+
+    def render(self):
+        value = self.fn()
+        if value is None:
+            return
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+        yield f"{self.name} {value:.15g}"
+
+
+_registry = []
+
+
+def _register(metric):
+    _registry.append(metric)
+    return metric
+
+
+def sampled(name: str, help: str, fn: Callable[[], Optional[float]], kind: str = "gauge"):
+    return _register(Sampled(name, help, kind, fn))
+
+
+def render() -> str:
+    return "\n".join(line for metric in _registry for line in metric.render()) + "\n"
+
+
+HTTP_REQUEST_SECONDS = _register(Histogram(
+    "http_request_duration_seconds", "Time to the last response byte, per route template.",
+    ("method", "route", "status")))
+HTTP_REQUEST_QUERIES = _register(Histogram(
+    "http_request_queries", "SQL statements issued per request.", ("method", "route"), COUNT_BUCKETS))
+HTTP_REQUEST_DB_SECONDS = _register(Histogram(
+    "http_request_db_seconds", "Time spent executing SQL per request.", ("method", "route")))
+DB_QUERY_SECONDS = _register(Histogram(
+    "db_query_duration_seconds", "Execution time of every SQL statement.", (), QUERY_BUCKETS))
+EXPIRY_TICK_SECONDS = _register(Histogram(
+    "expiry_tick_duration_seconds", "Duration of one expiry loop pass.", ("pass",)))
+EXPIRY_ROWS = _register(Counter(
+    "expiry_rows_total", "Blocks and sessions ended by the expiry loop.", ("kind",)))
+ADMISSION_REJECTED = _register(Counter(
+    "admission_rejected_total", "Write requests shed by admission.py (rate_limited: 429, overloaded: 503).",
+    ("reason", "method", "route")))
+ARCHIVE_ROWS = _register(Counter(
+    "archive_rows_total", "Rows moved to the archive database.", ("table",)))
+ARCHIVE_RECLAIMED_BYTES = _register(Counter(
+    "archive_reclaimed_bytes_total", "Bytes returned to the filesystem by incremental VACUUM after archiving."))
+ARCHIVE_RUN_SECONDS = _register(Histogram(
+    "archive_run_duration_seconds", "Duration of one archival run.", (), RUN_BUCKETS))
+AUTH_VERIFY_SECONDS = _register(Histogram(
+    "auth_verify_duration_seconds", "Google ID token verification time.", ("result",)))
+
+
+class RequestStats:
+    __slots__ = ("queries", "db_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+
+
+_current: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar("request_stats", default=None)
+
+
+# SQL hooks
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    DB_QUERY_SECONDS.observe(elapsed)
+    stats = _current.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_seconds += elapsed
+    if elapsed >= SLOW_QUERY_SECONDS:
+        logger.warning(f"Slow query ({elapsed * 1000:.1f} ms): {' '.join(statement.split())[:500]}")
+
+
+def _handle_error(exception_context):
+    # the failed statement never reaches after_cursor_execute
+    starts = exception_context.connection.info.get("query_start") if exception_context.connection else None
+    if starts:
+        starts.pop()
+
+
+def instrument_engine(engine):
+    """Attach the query timing hooks to a sync Engine (or an AsyncEngine's sync_engine)."""
+    if not METRICS_ENABLED:
+        return
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+
+# HTTP middleware
+def _route_label(scope) -> str:
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware (no BaseHTTPMiddleware task/stream overhead). Streaming
+    responses (text/event-stream) are counted in the query histograms but left out
+    of the latency histogram, which would otherwise hold connection lifetimes.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        stats = RequestStats()
+        token = _current.set(stats)
+        start = time.perf_counter()
+        status = [500, False]  # status code, streaming
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                status[1] = any(k == b"content-type" and v.startswith(b"text/event-stream")
+                                for k, v in message.get("headers", ()))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            elapsed = time.perf_counter() - start
+            method, route = scope["method"], _route_label(scope)
+            HTTP_REQUEST_QUERIES.observe(stats.queries, method, route)
+            HTTP_REQUEST_DB_SECONDS.observe(stats.db_seconds, method, route)
+            if not status[1]:
+                HTTP_REQUEST_SECONDS.observe(elapsed, method, route, status[0])
+                if elapsed >= SLOW_REQUEST_SECONDS:
+                    logger.warning(f"Slow request {method} {scope['path']} -> {status[0]} "
+                                   f"({elapsed * 1000:.1f} ms, {stats.queries} queries, "
+                                   f"{stats.db_seconds * 1000:.1f} ms in DB)")
@@ -0,0 +1,81 @@
+# migrate.py
+"""
+Applies the Alembic migrations in migrations/ to the configured database.
+
+    python migrate.py            # upgrade to head
+    python migrate.py 0001       # upgrade to a specific revision
+
+The app does not migrate when it starts (unless MIGRATE_ON_STARTUP=1): run
+this, or `python manage.py migrate`, once per deploy before the workers.
+"""
+import os
+import sys
+from typing import Optional
+
+from sqlalchemy import inspect, text
+
+from database import engine
+
+BASELINE = "0001"
+HERE = os.path.dirname(os.path.abspath(__file__))
+VERSIONS = os.path.join(HERE, "migrations", "versions")
+
+
+def _config(connection):
+    from alembic.config import Config
+
+    cfg = Config(os.path.join(HERE, "alembic.ini"))
+    cfg.set_main_option("script_location", os.path.join(HERE, "migrations"))
+    cfg.attributes["connection"] = connection
+    cfg.attributes["configure_logger"] = False
+    return cfg
+
+
+def upgrade(revision: str = "head", bind=None):
+    """
+    Upgrades the schema to revision. Databases created before migrations existed
+    (tables present, no alembic_version) are stamped at the baseline first; new
+    ones are created in auto_vacuum=INCREMENTAL mode.
+    """
+    from alembic import command
+
+    bind = bind or engine
+    with bind.begin() as conn:
+        cfg = _config(conn)
+        tables = set(inspect(conn).get_table_names())
+        if "users" in tables and "alembic_version" not in tables:
+            command.stamp(cfg, BASELINE)
+        if not tables:
+            # before the first table: lets archive.py return freed pages with incremental VACUUM
+            conn.exec_driver_sql("PRAGMA auto_vacuum=INCREMENTAL")
+        command.upgrade(cfg, revision)
+
+
+def head() -> str:
+    """
+    The newest revision, without loading Alembic: revisions are numbered like
+    their file names (0009_stats_rollups.py is "0009") and strictly linear.
+    """
+    return max(f.split("_", 1)[0] for f in os.listdir(VERSIONS) if f[:4].isdigit() and f.endswith(".py"))
+
+
+def current(bind=None) -> Optional[str]:
+    """The database's revision, or None if it was never migrated."""
+    with (bind or engine).connect() as conn:
+        if not conn.exec_driver_sql(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'alembic_version'").first():
+            return None
+        return conn.execute(text("SELECT version_num FROM alembic_version")).scalar()
+
+
+def check(bind=None):
+    """Raises RuntimeError unless the database is at head (two small reads, no Alembic)."""
+    at, expected = current(bind), head()
+    if at != expected:
+        raise RuntimeError(f"database schema is at {at or 'no revision'}, this code needs {expected}: "
+                           f"run `python manage.py migrate` (or set MIGRATE_ON_STARTUP=1)")
+
+
+if __name__ == "__main__":
+    target = sys.argv[1] if len(sys.argv) > 1 else "head"
+    upgrade(target)
@@ -0,0 +1,37 @@
+"""composite and partial indexes for the hot crud.py query shapes
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0002"
+down_revision: Union[str, Sequence[str], None] = "0001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index("ix_schedules_user_id", "schedules", ["user_id"])
+    op.create_index("ix_sessions_user_status_end", "sessions", ["user_id", "status", "end_time"])
+    op.create_index("ix_sessions_status_end", "sessions", ["status", "end_time"])
+    op.create_index("ix_blocked_apps_user_active_end", "blocked_apps", ["user_id", "is_active", "end_time"])
+    op.create_index("ix_blocked_apps_active_end", "blocked_apps", ["end_time"],
+                    sqlite_where=sa.text("is_active = 1"))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_blocked_apps_active_end", table_name="blocked_apps")
+    op.drop_index("ix_blocked_apps_user_active_end", table_name="blocked_apps")
+    op.drop_index("ix_sessions_status_end", table_name="sessions")
+    op.drop_index("ix_sessions_user_status_end", table_name="sessions")
+    op.drop_index("ix_schedules_user_id", table_name="schedules")
@@ -0,0 +1,53 @@
+"""one active block row per (user_id, package_name)
+
+Merges duplicate active rows into the lowest id (earliest start, latest end,
+first non-null app_name), deletes the merged-away rows and adds the unique
+partial index used as the ON CONFLICT target by crud.upsert_blocks.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0004"
+down_revision: Union[str, Sequence[str], None] = "0003"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute("""
+        UPDATE blocked_apps SET
+            start_time = (SELECT min(d.start_time) FROM blocked_apps d
+                          WHERE d.user_id = blocked_apps.user_id AND d.package_name = blocked_apps.package_name
+                            AND d.is_active = 1),
+            end_time = (SELECT max(d.end_time) FROM blocked_apps d
+                        WHERE d.user_id = blocked_apps.user_id AND d.package_name = blocked_apps.package_name
+                          AND d.is_active = 1),
+            app_name = coalesce(app_name, (SELECT d.app_name FROM blocked_apps d
+                                           WHERE d.user_id = blocked_apps.user_id AND d.package_name = blocked_apps.package_name
+                                             AND d.is_active = 1 AND d.app_name IS NOT NULL
+                                           ORDER BY d.id LIMIT 1))
+        WHERE id IN (SELECT min(id) FROM blocked_apps WHERE is_active = 1
+                     GROUP BY user_id, package_name HAVING count(*) > 1)
+    """)
+    op.execute("""
+        DELETE FROM blocked_apps
+        WHERE is_active = 1
+          AND id NOT IN (SELECT min(id) FROM blocked_apps WHERE is_active = 1 GROUP BY user_id, package_name)
+    """)
+    op.create_index("ux_blocked_apps_active_package", "blocked_apps", ["user_id", "package_name"],
+                    unique=True, sqlite_where=sa.text("is_active = 1"))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ux_blocked_apps_active_package", table_name="blocked_apps")
@@ -0,0 +1,107 @@
+"""app catalog: apps, schedule_apps and blocked_apps.app_id
+
+Interns every package name from blocked_apps.package_name and
+schedules.apps_csv into apps, moves schedule app lists into schedule_apps
+(keeping their order) and replaces blocked_apps.package_name with app_id.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0005"
+down_revision: Union[str, Sequence[str], None] = "0004"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _partial_block_indexes(unique_name: str, column: str):
+    # batch mode rebuilds blocked_apps; partial indexes are recreated by hand
+    op.create_index("ix_blocked_apps_active_end", "blocked_apps", ["end_time"],
+                    sqlite_where=sa.text("is_active = 1"))
+    op.create_index(unique_name, "blocked_apps", ["user_id", column],
+                    unique=True, sqlite_where=sa.text("is_active = 1"))
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "apps",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("package_name", sa.String(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_apps_package_name", "apps", ["package_name"], unique=True)
+    op.create_table(
+        "schedule_apps",
+        sa.Column("schedule_id", sa.Integer(), sa.ForeignKey("schedules.id"), nullable=False),
+        sa.Column("position", sa.Integer(), nullable=False),
+        sa.Column("app_id", sa.Integer(), sa.ForeignKey("apps.id"), nullable=False),
+        sa.PrimaryKeyConstraint("schedule_id", "position"),
+        sqlite_with_rowid=False,
+    )
+    op.create_index("ix_schedule_apps_app_id", "schedule_apps", ["app_id"])
+
+    bind = op.get_bind()
+    op.execute("INSERT OR IGNORE INTO apps (package_name) SELECT DISTINCT package_name FROM blocked_apps")
+    links = []
+    for schedule_id, apps_csv in bind.execute(sa.text(
+            "SELECT id, apps_csv FROM schedules WHERE apps_csv IS NOT NULL AND apps_csv != ''")):
+        packages = dict.fromkeys(p for p in apps_csv.split(",") if p)
+        links.extend({"schedule_id": schedule_id, "package_name": p, "position": i}
+                     for i, p in enumerate(packages))
+    if links:
+        bind.execute(sa.text("INSERT OR IGNORE INTO apps (package_name) VALUES (:package_name)"), links)
+        bind.execute(sa.text(
+            "INSERT INTO schedule_apps (schedule_id, app_id, position) "
+            "SELECT :schedule_id, id, :position FROM apps WHERE package_name = :package_name"), links)
+    with op.batch_alter_table("schedules") as batch:
+        batch.drop_column("apps_csv")
+
+    op.drop_index("ux_blocked_apps_active_package", table_name="blocked_apps")
+    op.drop_index("ix_blocked_apps_active_end", table_name="blocked_apps")
+    op.drop_index("ix_blocked_apps_package_name", table_name="blocked_apps")
+    op.add_column("blocked_apps", sa.Column("app_id", sa.Integer(), nullable=True))
+    op.execute("UPDATE blocked_apps SET app_id = "
+               "(SELECT id FROM apps WHERE apps.package_name = blocked_apps.package_name)")
+    with op.batch_alter_table("blocked_apps", recreate="always") as batch:
+        batch.alter_column("app_id", existing_type=sa.Integer(), nullable=False)
+        batch.create_foreign_key("fk_blocked_apps_app_id", "apps", ["app_id"], ["id"])
+        batch.drop_column("package_name")
+    op.create_index("ix_blocked_apps_app_id", "blocked_apps", ["app_id"])
+    _partial_block_indexes("ux_blocked_apps_active_app", "app_id")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ux_blocked_apps_active_app", table_name="blocked_apps")
+    op.drop_index("ix_blocked_apps_active_end", table_name="blocked_apps")
+    op.drop_index("ix_blocked_apps_app_id", table_name="blocked_apps")
+    op.add_column("blocked_apps", sa.Column("package_name", sa.String(), nullable=True))
+    op.execute("UPDATE blocked_apps SET package_name = "
+               "(SELECT package_name FROM apps WHERE apps.id = blocked_apps.app_id)")
+    with op.batch_alter_table("blocked_apps", recreate="always") as batch:
+        batch.alter_column("package_name", existing_type=sa.String(), nullable=False)
+        batch.drop_constraint("fk_blocked_apps_app_id", type_="foreignkey")
+        batch.drop_column("app_id")
+    op.create_index("ix_blocked_apps_package_name", "blocked_apps", ["package_name"])
+    _partial_block_indexes("ux_blocked_apps_active_package", "package_name")
+
+    op.add_column("schedules", sa.Column("apps_csv", sa.Text(), nullable=True))
+    op.execute("""
+        UPDATE schedules SET apps_csv = coalesce((
+            SELECT group_concat(package_name, ',') FROM (
+                SELECT a.package_name FROM schedule_apps sa JOIN apps a ON a.id = sa.app_id
+                WHERE sa.schedule_id = schedules.id ORDER BY sa.position)), '')
+    """)
+    op.drop_index("ix_schedule_apps_app_id", table_name="schedule_apps")
+    op.drop_table("schedule_apps")
+    op.drop_index("ix_apps_package_name", table_name="apps")
+    op.drop_table("apps")
@@ -0,0 +1,29 @@
+"""partial index on expired blocks for the archival job
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-17 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0008"
+down_revision: Union[str, Sequence[str], None] = "0007"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index("ix_blocked_apps_inactive_end", "blocked_apps", ["end_time"],
+                    sqlite_where=sa.text("is_active = 0"))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_blocked_apps_inactive_end", table_name="blocked_apps")
@@ -0,0 +1,52 @@
+"""daily focus-statistics rollups; paused time and end time on sessions
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-17 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0009"
+down_revision: Union[str, Sequence[str], None] = "0008"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column("sessions", sa.Column("paused_seconds", sa.Integer(), nullable=False, server_default="0"))
+    op.add_column("sessions", sa.Column("ended_at", sa.DateTime(), nullable=True))
+    op.create_table(
+        "daily_stats",
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("day", sa.Date(), nullable=False),
+        sa.Column("focus_seconds", sa.Integer(), nullable=False),
+        sa.Column("sessions_completed", sa.Integer(), nullable=False),
+        sa.Column("sessions_stopped", sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint("user_id", "day"),
+        sqlite_with_rowid=False,
+    )
+    op.create_table(
+        "daily_app_stats",
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("day", sa.Date(), nullable=False),
+        sa.Column("app_id", sa.Integer(), nullable=False),
+        sa.Column("blocked_seconds", sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint("user_id", "day", "app_id"),
+        sqlite_with_rowid=False,
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("daily_app_stats")
+    op.drop_table("daily_stats")
+    with op.batch_alter_table("sessions") as batch:
+        batch.drop_column("ended_at")
+        batch.drop_column("paused_seconds")
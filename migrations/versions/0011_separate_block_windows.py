@@ -0,0 +1,58 @@
+"""separate active block windows per (user_id, app_id)
+
+Replaces the unique partial index ux_blocked_apps_active_app with a plain
+one: a package may now have several active rows as long as their windows
+neither overlap nor touch (crud.upsert_blocks), e.g. a future-dated block
+next to a session's block. Downgrading merges each package's active rows
+into the lowest id again, like 0004, before restoring the unique index.
+
+Revision ID: 0011
+Revises: 0010
+Create Date: 2026-10-17 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0011"
+down_revision: Union[str, Sequence[str], None] = "0010"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.drop_index("ux_blocked_apps_active_app", table_name="blocked_apps")
+    op.create_index("ix_blocked_apps_active_app", "blocked_apps", ["user_id", "app_id"],
+                    sqlite_where=sa.text("is_active = 1"))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("""
+        UPDATE blocked_apps SET
+            start_time = (SELECT min(d.start_time) FROM blocked_apps d
+                          WHERE d.user_id = blocked_apps.user_id AND d.app_id = blocked_apps.app_id
+                            AND d.is_active = 1),
+            end_time = (SELECT max(d.end_time) FROM blocked_apps d
+                        WHERE d.user_id = blocked_apps.user_id AND d.app_id = blocked_apps.app_id
+                          AND d.is_active = 1),
+            app_name = coalesce(app_name, (SELECT d.app_name FROM blocked_apps d
+                                           WHERE d.user_id = blocked_apps.user_id AND d.app_id = blocked_apps.app_id
+                                             AND d.is_active = 1 AND d.app_name IS NOT NULL
+                                           ORDER BY d.id LIMIT 1))
+        WHERE id IN (SELECT min(id) FROM blocked_apps WHERE is_active = 1
+                     GROUP BY user_id, app_id HAVING count(*) > 1)
+    """)
+    op.execute("""
+        DELETE FROM blocked_apps
+        WHERE is_active = 1
+          AND id NOT IN (SELECT min(id) FROM blocked_apps WHERE is_active = 1 GROUP BY user_id, app_id)
+    """)
+    op.drop_index("ix_blocked_apps_active_app", table_name="blocked_apps")
+    op.create_index("ux_blocked_apps_active_app", "blocked_apps", ["user_id", "app_id"],
+                    unique=True, sqlite_where=sa.text("is_active = 1"))
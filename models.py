@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text
+from sqlalchemy import Column, Integer, String, Boolean, Date, DateTime, ForeignKey, Text, Index, text
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from database import Base
@@ -18,16 +18,34 @@ class User(Base):
 class Schedule(Base):
     __tablename__ = "schedules"
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
     label = Column(String, default="Focus")
     duration_minutes = Column(Integer, default=25)
-    apps_csv = Column(Text, default="")  # comma separated package names
     is_active = Column(Boolean, default=False)
     created_at = Column(DateTime, default=datetime.utcnow)
 
     owner = relationship("User", back_populates="schedules")
 
 
+class App(Base):
+    """Catalog of package names: each is stored once and referenced by id."""
+    __tablename__ = "apps"
+    id = Column(Integer, primary_key=True)
+    package_name = Column(String, unique=True, index=True, nullable=False)
+
+
+class ScheduleApp(Base):
+    """The apps a schedule blocks, in the order they were given."""
+    __tablename__ = "schedule_apps"
+    schedule_id = Column(Integer, ForeignKey("schedules.id"), primary_key=True)
+    position = Column(Integer, primary_key=True)
+    app_id = Column(Integer, ForeignKey("apps.id"), nullable=False, index=True)
+
+    # clustered on (schedule_id, position): a schedule's apps are read in order
+    # straight off the primary key
+    __table_args__ = ({"sqlite_with_rowid": False},)
+
+
 class FocusSession(Base):
     __tablename__ = "sessions"
     id = Column(Integer, primary_key=True, index=True)
@@ -39,18 +57,99 @@ class FocusSession(Base):
     paused_at = Column(DateTime, nullable=True)
     remaining_seconds = Column(Integer, nullable=True)  # when paused
     status = Column(String, default="running")  # running, paused, finished, stopped
+    version = Column(Integer, nullable=False, default=1, server_default="1")  # bumped by every UPDATE
+    paused_seconds = Column(Integer, nullable=False, default=0, server_default="0")  # summed on resume
+    ended_at = Column(DateTime, nullable=True)  # when it was stopped or finished
 
     owner = relationship("User", back_populates="sessions")
 
+    __table_args__ = (
+        # list_active_sessions
+        Index("ix_sessions_user_status_end", "user_id", "status", "end_time"),
+        # expiry sweep / scheduler seed
+        Index("ix_sessions_status_end", "status", "end_time"),
+        # history, newest first: (user_id, rowid) order is the keyset on id
+        Index("ix_sessions_user", "user_id"),
+    )
+
 
 class BlockedApp(Base):
     __tablename__ = "blocked_apps"
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    package_name = Column(String, nullable=False, index=True)
+    app_id = Column(Integer, ForeignKey("apps.id"), nullable=False, index=True)
     app_name = Column(String, nullable=True)
     start_time = Column(DateTime, nullable=False)
     end_time = Column(DateTime, nullable=False)
     is_active = Column(Boolean, default=True)
 
     owner = relationship("User", back_populates="block_rules")
+
+    __table_args__ = (
+        # list_active_blocked_apps / deactivate_blocks_for_user
+        Index("ix_blocked_apps_user_active_end", "user_id", "is_active", "end_time"),
+        # expiry sweep / scheduler seed: only active rows are ever swept
+        Index("ix_blocked_apps_active_end", "end_time", sqlite_where=text("is_active = 1")),
+        # archive.py: expired rows past the retention window
+        Index("ix_blocked_apps_inactive_end", "end_time", sqlite_where=text("is_active = 0")),
+        # crud.upsert_blocks: the package's active rows a new window may widen
+        Index("ix_blocked_apps_active_app", "user_id", "app_id", sqlite_where=text("is_active = 1")),
+    )
+
+
+class ChangeLog(Base):
+    """Per-user log of mutations for delta sync; seq is global and never reused."""
+    __tablename__ = "change_log"
+    seq = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, nullable=False)
+    entity = Column(String, nullable=False)  # block, session, schedule
+    entity_id = Column(Integer, nullable=False)
+    op = Column(String, nullable=False)  # upsert, delete
+    data = Column(Text, nullable=True)  # JSON of the entity for upserts
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+    __table_args__ = (
+        Index("ix_change_log_user_seq", "user_id", "seq"),
+        {"sqlite_autoincrement": True},
+    )
+
+
+class SyncState(Base):
+    __tablename__ = "sync_state"
+    key = Column(String, primary_key=True)
+    value = Column(Integer, nullable=False, default=0)
+
+
+class Lease(Base):
+    """
+    A named lease held by one process until expires_at (e.g. "expiry": which
+    worker runs the background expiry loop). See crud.acquire_lease.
+    """
+    __tablename__ = "leases"
+    name = Column(String, primary_key=True)
+    holder = Column(String, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+    acquired_at = Column(DateTime, nullable=False)
+
+
+class DailyStats(Base):
+    """Per-user, per-UTC-day focus rollup, added to as sessions end (crud.py STATS)."""
+    __tablename__ = "daily_stats"
+    user_id = Column(Integer, primary_key=True)
+    day = Column(Date, primary_key=True)
+    focus_seconds = Column(Integer, nullable=False, default=0)
+    sessions_completed = Column(Integer, nullable=False, default=0)
+    sessions_stopped = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = ({"sqlite_with_rowid": False},)
+
+
+class DailyAppStats(Base):
+    """Per-user, per-UTC-day blocked time of each app, added to as blocks end."""
+    __tablename__ = "daily_app_stats"
+    user_id = Column(Integer, primary_key=True)
+    day = Column(Date, primary_key=True)
+    app_id = Column(Integer, primary_key=True)
+    blocked_seconds = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = ({"sqlite_with_rowid": False},)
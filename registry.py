@@ -0,0 +1,181 @@
+# registry.py
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional, Set
+
+from sqlalchemy import event, select, func
+from sqlalchemy.orm import Session
+
+import models
+from scheduler import SESSION
+
+# SESSION_REGISTRY_SYNC=0: this process is the only writer (one worker), so the
+# registry is authoritative and reads never touch the DB
+SESSION_REGISTRY_SYNC = os.getenv("SESSION_REGISTRY_SYNC", "1").lower() not in ("0", "false", "no")
+# a registry that has not synced for this long reloads instead of trusting the
+# (possibly compacted) change log
+SESSION_REGISTRY_MAX_LAG = float(os.getenv("SESSION_REGISTRY_MAX_LAG_SECONDS", "3600"))
+LIVE = ("running", "paused")
+
+
+class ActiveSession(NamedTuple):
+    id: int
+    user_id: int
+    schedule_id: Optional[int]
+    start_time: datetime
+    end_time: datetime
+    paused: bool
+    paused_at: Optional[datetime]
+    remaining_seconds: Optional[int]
+    status: str
+    version: int
+
+    def to_dict(self) -> dict:
+        """The GET /users/{id}/sessions/active item (every column but version)."""
+        d = self._asdict()
+        del d["version"]
+        return d
+
+
+COLUMNS = tuple(getattr(models.FocusSession, f) for f in ActiveSession._fields)
+
+
+def _active(r) -> ActiveSession:
+    return r if isinstance(r, ActiveSession) else ActiveSession(*(getattr(r, f) for f in ActiveSession._fields))
+
+
+class SessionRegistry:
+    """
+    Process-local copy of every running and paused FocusSession, by id and by
+    user. crud.py writes through it on commit (track_on_commit). With
+    SESSION_REGISTRY_SYNC (the default) each read first applies what other
+    processes changed: the session ids in change_log after the last seq seen are
+    re-read by primary key, and a row only replaces an entry whose version is
+    not newer, so a slow reader never undoes a later local write.
+    """
+
+    def __init__(self, sync: bool = SESSION_REGISTRY_SYNC, max_lag: float = SESSION_REGISTRY_MAX_LAG):
+        self.sync_enabled = sync
+        self.max_lag = max_lag
+        self._sessions: Dict[int, ActiveSession] = {}
+        self._by_user: Dict[int, Set[int]] = {}
+        self._seq = 0
+        self._synced_at = None  # monotonic time of the last load/sync; None = never loaded
+        self._lock = threading.Lock()
+        self.reloads = 0
+
+    def load(self, db: Session):
+        """Rebuilds the registry from the DB (startup, or after a long lag)."""
+        seq = db.execute(select(func.max(models.ChangeLog.seq))).scalar() or 0
+        rows = db.execute(select(*COLUMNS).where(models.FocusSession.status.in_(LIVE))).all()
+        with self._lock:
+            self._sessions = {}
+            self._by_user = {}
+            for r in rows:
+                self._put(ActiveSession(*r))
+            self._seq = seq
+            self._synced_at = time.monotonic()
+            self.reloads += 1
+        return len(rows)
+
+    def sync(self, db: Session):
+        """
+        Brings the registry up to date with the DB; see the class docstring.
+        db must not hold uncommitted session writes (they would be applied
+        even if the transaction later rolls back).
+        """
+        if self._synced_at is None or time.monotonic() - self._synced_at > self.max_lag:
+            self.load(db)
+            return
+        if not self.sync_enabled:
+            return
+        changed = db.execute(
+            select(models.ChangeLog.seq, models.ChangeLog.entity_id)
+            .where(models.ChangeLog.seq > self._seq, models.ChangeLog.entity == SESSION)
+            .order_by(models.ChangeLog.seq)
+        ).all()
+        if changed:
+            ids = {r.entity_id for r in changed}
+            rows = {r.id: ActiveSession(*r) for r in db.execute(
+                select(*COLUMNS).where(models.FocusSession.id.in_(ids))).all()}
+            with self._lock:
+                for session_id in ids:
+                    self._apply(session_id, rows.get(session_id))
+                self._seq = max(self._seq, changed[-1].seq)
+        self._synced_at = time.monotonic()
+
+    def apply(self, rows):
+        """Write-through of committed session rows (any row carrying COLUMNS)."""
+        with self._lock:
+            for r in rows:
+                self._apply(r.id, _active(r))
+
+    def active_for_user(self, user_id: int, now: datetime = None, pending=()) -> List[ActiveSession]:
+        """
+        Running sessions of user_id that have not reached end_time, oldest first.
+        pending: rows written by the caller's still open transaction, which
+        override the registry (sync() must not run in such a transaction).
+        """
+        now = now or datetime.utcnow()
+        with self._lock:
+            found = {i: self._sessions[i] for i in self._by_user.get(user_id, ())}
+        for r in pending:
+            if r.user_id == user_id and (r.id not in found or r.version >= found[r.id].version):
+                found[r.id] = _active(r)
+        return sorted((s for s in found.values() if s.status == "running" and s.end_time > now),
+                      key=lambda s: s.id)
+
+    def get(self, session_id: int) -> Optional[ActiveSession]:
+        return self._sessions.get(session_id)
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+            self._by_user.clear()
+            self._synced_at = None
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _apply(self, session_id: int, row: Optional[ActiveSession]):
+        current = self._sessions.get(session_id)
+        if current is not None and row is not None and row.version < current.version:
+            return  # older than what a local commit already applied
+        if current is not None:
+            self._remove(current)
+        if row is not None and row.status in LIVE:
+            self._put(row)
+
+    def _put(self, s: ActiveSession):
+        self._sessions[s.id] = s
+        self._by_user.setdefault(s.user_id, set()).add(s.id)
+
+    def _remove(self, s: ActiveSession):
+        del self._sessions[s.id]
+        ids = self._by_user.get(s.user_id)
+        if ids is not None:
+            ids.discard(s.id)
+            if not ids:
+                del self._by_user[s.user_id]
+
+
+session_registry = SessionRegistry()
+
+
+def track_on_commit(db: Session, rows):
+    """Queues session rows (carrying COLUMNS) for the registry once db's transaction commits."""
+    db.info.setdefault("sessions", []).extend(rows)
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(db):
+    rows = db.info.pop("sessions", None)
+    if rows:
+        session_registry.apply(rows)
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(db):
+    db.info.pop("sessions", None)
@@ -0,0 +1,150 @@
+# scheduler.py
+import asyncio
+import heapq
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+import models
+
+BLOCK = "block"
+SESSION = "session"
+
+
+class ExpiryScheduler:
+    """
+    In-process min-heap of upcoming end_time deadlines for active blocks and
+    running sessions. crud.py keeps it up to date on every mutation so the
+    expiry loop can sleep until the next deadline instead of polling the DB.
+    Cancelled/rescheduled entries are left in the heap and skipped lazily.
+    While `active` is False (this worker is not the expiry leader) schedule()
+    is a no-op, so the heap does not grow with deadlines nobody will expire.
+    """
+
+    def __init__(self):
+        self._heap: List[Tuple[datetime, str, int]] = []
+        self._deadlines: Dict[Tuple[str, int], datetime] = {}
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self.active = True
+
+    def bind(self, loop: asyncio.AbstractEventLoop):
+        """Attach to the event loop running the expiry loop (called once at startup)."""
+        self._loop = loop
+        self._wakeup = asyncio.Event()
+
+    def set_active(self, active: bool):
+        self.active = active
+        if not active:
+            self.clear()
+
+    def schedule(self, kind: str, row_id: int, deadline: datetime):
+        if not self.active:
+            return
+        with self._lock:
+            self._deadlines[(kind, row_id)] = deadline
+            heapq.heappush(self._heap, (deadline, kind, row_id))
+            is_next = self._heap[0] == (deadline, kind, row_id)
+        if is_next:
+            self._notify()
+
+    def cancel(self, kind: str, row_id: int):
+        with self._lock:
+            self._deadlines.pop((kind, row_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._heap.clear()
+            self._deadlines.clear()
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def next_deadline(self) -> Optional[datetime]:
+        with self._lock:
+            self._drop_stale()
+            return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: datetime) -> Dict[str, List[int]]:
+        """Remove and return the ids whose deadline is <= now, grouped by kind."""
+        due = {BLOCK: [], SESSION: []}
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                deadline, kind, row_id = heapq.heappop(self._heap)
+                if self._deadlines.get((kind, row_id)) == deadline:
+                    del self._deadlines[(kind, row_id)]
+                    due[kind].append(row_id)
+        return due
+
+    def seed(self, db, now: Optional[datetime] = None):
+        """Rebuild the heap from the DB: every active block and running session."""
+        now = now or datetime.utcnow()
+        blocks = db.query(models.BlockedApp.id, models.BlockedApp.end_time).filter(
+            models.BlockedApp.is_active == True
+        ).all()
+        sessions = db.query(models.FocusSession.id, models.FocusSession.end_time).filter(
+            models.FocusSession.status == "running"
+        ).all()
+        entries = [(end, BLOCK, i) for i, end in blocks] + [(end, SESSION, i) for i, end in sessions]
+        with self._lock:
+            self._heap = entries
+            heapq.heapify(self._heap)
+            self._deadlines = {(kind, i): end for end, kind, i in entries}
+        self._notify()
+        return len(entries)
+
+    async def wait(self, timeout: float):
+        """Sleep for up to timeout seconds, waking early if an earlier deadline arrives."""
+        if self._wakeup is None:
+            await asyncio.sleep(timeout)
+            return
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=max(timeout, 0))
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+    def _drop_stale(self):
+        while self._heap:
+            deadline, kind, row_id = self._heap[0]
+            if self._deadlines.get((kind, row_id)) == deadline:
+                return
+            heapq.heappop(self._heap)
+
+    def _notify(self):
+        # crud functions run on FastAPI's threadpool, so hop onto the loop thread
+        if self._loop is None or self._wakeup is None or self._loop.is_closed():
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        except RuntimeError:
+            pass
+
+
+expiry_scheduler = ExpiryScheduler()
+
+
+def schedule_on_commit(db: Session, kind: str, row_id: int, deadline: Optional[datetime]):
+    """
+    Queues a schedule (or, with deadline None, a cancel) that is applied once
+    db's transaction really commits, so a rolled-back batch leaves the heap alone.
+    """
+    db.info.setdefault("expiry", []).append((kind, row_id, deadline))
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(db):
+    for kind, row_id, deadline in db.info.pop("expiry", ()):
+        if deadline is None:
+            expiry_scheduler.cancel(kind, row_id)
+        else:
+            expiry_scheduler.schedule(kind, row_id, deadline)
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(db):
+    db.info.pop("expiry", None)
@@ -1,7 +1,8 @@
 # schemas.py
+import os
 from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional
-from datetime import datetime
+from typing import List, Literal, Optional
+from datetime import date, datetime
 
 class UserCreate(BaseModel):
     email: str
@@ -65,6 +66,65 @@ class SessionOut(BaseModel):
     remaining_seconds: Optional[int]
     status: str
 
+# GET /users/{id}/sessions, /users/{id}/blocks/history: keyset pages, newest first
+class SessionHistoryOut(SessionOut):
+    ended_at: Optional[datetime]
+    paused_seconds: int
+
+class SessionPage(BaseModel):
+    items: List[SessionHistoryOut]
+    next_cursor: Optional[str]
+
+class BlockPage(BaseModel):
+    items: List[BlockedAppOut]
+    next_cursor: Optional[str]
+
+# GET /users/{id}/stats: UTC days, from the daily rollups
+class StatsDay(BaseModel):
+    day: date
+    focus_minutes: float
+    sessions_completed: int
+    sessions_stopped: int
+
+class StatsWeek(BaseModel):
+    week_start: date
+    focus_minutes: float
+
+class BlockedAppStat(BaseModel):
+    package_name: str
+    blocked_minutes: float
+
+class StatsOut(BaseModel):
+    model_config = ConfigDict(populate_by_name=True)
+
+    from_: date = Field(alias="from")
+    to: date
+    focus_minutes: float
+    sessions_completed: int
+    sessions_stopped: int
+    current_streak_days: int
+    longest_streak_days: int
+    days: List[StatsDay]
+    weeks: List[StatsWeek]
+    top_blocked_apps: List[BlockedAppStat]
+
 # Simple token input for google ID token
 class TokenIn(BaseModel):
     id_token: str
+
+# POST /batch: ops run in order, in one transaction
+class BatchOp(BaseModel):
+    op: Literal["create_schedule", "list_schedules", "delete_schedule",
+                "start_session", "pause_session", "resume_session", "stop_session", "list_active_sessions",
+                "create_blocks", "list_blocks"]
+    schedule_id: Optional[int] = None
+    session_id: Optional[int] = None
+    duration_minutes: Optional[int] = None
+    schedule: Optional[ScheduleCreate] = None
+    blocks: Optional[List[BlockedAppCreate]] = None
+
+BATCH_MAX_OPS = int(os.getenv("BATCH_MAX_OPS", "20"))
+
+class BatchIn(BaseModel):
+    user_id: int
+    ops: List[BatchOp] = Field(max_length=BATCH_MAX_OPS)
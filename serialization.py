@@ -0,0 +1,88 @@
+# serialization.py
+import csv
+import io
+from datetime import datetime
+from functools import lru_cache
+from typing import Iterable, Tuple, Type
+
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from pydantic_core import to_json
+
+try:
+    import orjson
+except ImportError:  # optional: falls back to pydantic-core's encoder
+    orjson = None
+
+
+def _default(o):
+    return o.isoformat() if isinstance(o, datetime) else str(o)
+
+
+def dumps(content) -> bytes:
+    """
+    JSON bytes for trusted response data (dicts/lists of str, int, bool, None,
+    datetime). Naive datetimes come out in the same ISO format pydantic uses.
+    """
+    if orjson is not None:
+        return orjson.dumps(content, default=_default)
+    return to_json(content, fallback=_default)
+
+
+class FastJSONResponse(JSONResponse):
+    """The app's default response class: orjson when it is installed."""
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+@lru_cache(maxsize=None)
+def fields(model: Type[BaseModel]) -> Tuple[str, ...]:
+    return tuple(model.model_fields)
+
+
+def project(row, model: Type[BaseModel]) -> dict:
+    """row (a Row, NamedTuple or object) as a dict of model's fields, without validating it."""
+    return {f: getattr(row, f) for f in fields(model)}
+
+
+def model_response(row, model: Type[BaseModel], status_code: int = 200) -> FastJSONResponse:
+    """
+    Response for one trusted row shaped like model. Returning a Response skips
+    FastAPI's response_model validation; the route keeps response_model for the
+    OpenAPI schema.
+    """
+    return FastJSONResponse(project(row, model), status_code=status_code)
+
+
+def list_response(rows: Iterable, model: Type[BaseModel]) -> FastJSONResponse:
+    """Like model_response, for a list of rows."""
+    names = fields(model)
+    return FastJSONResponse([{f: getattr(r, f) for f in names} for r in rows])
+
+
+def ndjson(rows: Iterable, model: Type[BaseModel]) -> bytes:
+    """rows as newline-delimited JSON objects of model's fields."""
+    names = fields(model)
+    return b"".join(dumps({f: getattr(r, f) for f in names}) + b"\n" for r in rows)
+
+
+def _csv_value(v):
+    if isinstance(v, datetime):
+        return v.isoformat()
+    if isinstance(v, bool):
+        return "true" if v else "false"
+    return v
+
+
+def csv_header(model: Type[BaseModel]) -> bytes:
+    return (",".join(fields(model)) + "\r\n").encode("utf-8")
+
+
+def csv_rows(rows: Iterable, model: Type[BaseModel]) -> bytes:
+    """rows as CSV lines (no header) of model's fields, in the same formats as the JSON output."""
+    names = fields(model)
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerows([_csv_value(getattr(r, f)) for f in names] for r in rows)
+    return buf.getvalue().encode("utf-8")
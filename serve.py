@@ -0,0 +1,108 @@
+# serve.py
+"""
+Pre-forking server. Imports the app once, binds the listening socket, then
+forks WEB_CONCURRENCY uvicorn workers that share it. Most of a worker's cold
+start is importing FastAPI, SQLAlchemy and pydantic. A forked worker inherits
+those modules, so starting or replacing a worker only costs a fork plus the
+app's startup hooks. A worker that dies is re-forked. SIGTERM / SIGINT are
+passed on to the workers, and the server waits for them to exit.
+
+    python manage.py migrate            # once per deploy, before the workers
+    python serve.py [--host 0.0.0.0] [--port 8000] [--workers 4]
+
+`uvicorn main:app --workers N` also works. It starts every worker from a
+fresh interpreter, so each one pays the full import time.
+"""
+import argparse
+import logging
+import os
+import signal
+import socket
+import time
+
+import uvicorn
+
+import database
+
+logger = logging.getLogger("focusbubble.serve")
+
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+RESPAWN_DELAY_SECONDS = 1.0  # a worker dying faster than this is not re-forked in a tight loop
+
+
+def _bind(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    return sock
+
+
+def _fork(config: uvicorn.Config, sock: socket.socket) -> int:
+    pid = os.fork()
+    if pid:
+        return pid
+    # worker: plain signal dispositions, so uvicorn's graceful shutdown ends the process
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, signal.SIG_DFL)
+    # per SQLAlchemy's multiprocessing notes: never reuse the parent's pooled connections
+    database.engine.dispose(close=False)
+    try:
+        uvicorn.Server(config).run(sockets=[sock])
+    finally:
+        os._exit(0)
+
+
+def serve(host: str, port: int, workers: int, log_level: str = "info"):
+    from main import app  # the expensive part, done once in this process
+
+    sock = _bind(host, port)
+    config = uvicorn.Config(app, log_level=log_level, proxy_headers=True)
+    config.load()
+    children = {}
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(workers):
+        pid = _fork(config, sock)
+        children[pid] = time.monotonic()
+        logger.info(f"Started worker {pid}.")
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        started = children.pop(pid, None)
+        if started is None or stopping:
+            continue
+        logger.warning(f"Worker {pid} exited ({os.waitstatus_to_exitcode(status)}), forking a new one.")
+        time.sleep(max(0.0, RESPAWN_DELAY_SECONDS - (time.monotonic() - started)))
+        pid = _fork(config, sock)
+        children[pid] = time.monotonic()
+        logger.info(f"Started worker {pid}.")
+    sock.close()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8000)
+    ap.add_argument("--workers", type=int, default=WEB_CONCURRENCY)
+    ap.add_argument("--log-level", default="info")
+    args = ap.parse_args()
+    serve(args.host, args.port, args.workers, args.log_level)
+
+
+if __name__ == "__main__":
+    main()
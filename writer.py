@@ -0,0 +1,180 @@
+# writer.py
+"""
+Single-writer group commit for the SQLite production profile.
+
+One dedicated thread owns the only write connection. Mutations are submitted
+as crud.py functions; the thread drains whatever is pending (up to
+GROUP_COMMIT_MAX_BATCH), runs each one inside its own SAVEPOINT and commits
+the whole batch in one transaction. A failing mutation only rolls back its
+savepoint and re-raises in its caller; the rest of the batch still commits.
+Readers keep using database.SessionLocal / AsyncSessionLocal (the read pool).
+"""
+import asyncio
+import contextvars
+import copy
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import Future
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session, sessionmaker
+
+import database
+import metrics
+
+logger = logging.getLogger("focusbubble.writer")
+
+GROUP_COMMIT_MAX_BATCH = int(os.getenv("GROUP_COMMIT_MAX_BATCH", "64"))
+
+
+class _BatchSession(Session):
+    """
+    crud.py commits after every mutation; inside a batch those commit points only
+    flush (so pending ORM changes reach the batch) and the writer commits it.
+    """
+
+    def commit(self):
+        self.flush()
+
+    def commit_batch(self):
+        Session.commit(self)
+
+
+def _make_engine():
+    eng = create_engine(
+        database.SQLALCHEMY_DATABASE_URL,
+        connect_args={"check_same_thread": False}, pool_size=1, max_overflow=0,
+    )
+
+    @event.listens_for(eng, "connect")
+    def _connect(dbapi_connection, connection_record):
+        database.apply_sqlite_pragmas(dbapi_connection)
+        # let SQLAlchemy (not pysqlite) emit BEGIN so SAVEPOINTs behave
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(eng, "begin")
+    def _begin(conn):
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+    metrics.instrument_engine(eng)
+    return eng
+
+
+class GroupCommitWriter:
+    def __init__(self, max_batch: int = GROUP_COMMIT_MAX_BATCH):
+        self.max_batch = max_batch
+        self.engine = _make_engine()
+        self._sessions = sessionmaker(bind=self.engine, class_=_BatchSession,
+                                      autoflush=False, expire_on_commit=False)
+        self._queue = queue.Queue()
+        self._thread = None
+        self.batches = 0
+        self.jobs = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        self.engine.dispose()
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        """Queue fn(session, *args, **kwargs); the Future resolves once its batch commits."""
+        fut = Future()
+        # the caller's context, so the job's statements count towards its request
+        self._queue.put((fn, args, kwargs, fut, contextvars.copy_context()))
+        return fut
+
+    async def run(self, fn, *args, **kwargs):
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            batch = [job]
+            while len(batch) < self.max_batch:
+                try:
+                    job = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job is None:
+                    self._queue.put(None)
+                    break
+                batch.append(job)
+            self._commit(batch)
+
+    def _commit(self, batch):
+        db = self._sessions()
+        results = []
+        try:
+            for fn, args, kwargs, fut, ctx in batch:
+                # events / cache invalidations queued by a job that rolls back must not publish
+                info = {k: copy.copy(v) for k, v in db.info.items()}
+                try:
+                    with db.begin_nested():
+                        results.append((fut, ctx.run(fn, db, *args, **kwargs), None))
+                except Exception as e:
+                    db.info.clear()
+                    db.info.update(info)
+                    results.append((fut, None, e))
+            db.commit_batch()
+        except Exception as e:
+            logger.exception("Group commit of %d mutations failed", len(batch))
+            db.rollback()
+            results = [(fut, None, e) for fut, _, _ in results]
+        finally:
+            db.expunge_all()
+            db.close()
+        self.batches += 1
+        self.jobs += len(batch)
+        for fut, value, exc in results:
+            if exc is not None:
+                fut.set_exception(exc)
+            else:
+                fut.set_result(value)
+
+
+def run_in_transaction(fn, *args, **kwargs):
+    """
+    Runs fn(session, *args, **kwargs) as one all-or-nothing transaction on its
+    own session: crud.py commits inside fn only flush, and any exception rolls
+    back everything fn did. Blocking; for use when the group writer is not
+    running (a job submitted to it already gets the same treatment).
+    """
+    db = _BatchSession(bind=database.engine, autoflush=False, expire_on_commit=False)
+    try:
+        result = fn(db, *args, **kwargs)
+        db.commit_batch()
+        return result
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+group_writer = None  # GroupCommitWriter while running with DB_PROFILE=production
+
+
+def start():
+    global group_writer
+    if group_writer is None:
+        group_writer = GroupCommitWriter()
+        group_writer.start()
+    return group_writer
+
+
+def stop():
+    global group_writer
+    if group_writer is not None:
+        group_writer.stop()
+        group_writer = None